@@ -3,22 +3,30 @@ import sys
 from glob import glob
 
 import argparse
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import multiprocessing
+import queue
 from pathlib import PurePosixPath
 from datetime import datetime
 import uuid
 
-from pymarc import MARCReader, MARCWriter, XMLWriter, TextWriter
-from pymarc import marcxml
-from pymarc import Record, Field
-
 from lxml import etree
+from pymarc import MARCReader, MARCWriter, TextWriter
+from pymarc import Record, Field
 
 from lib.utils import db_connect_url
 from lib.utils import get_configs_by_filename
 from cid_minter.cid_minter import CidMinter
+from marcxml_stream import iter_marcxml_records
+from marcxml_stream import MarcXmlWriter
 
-def assign_cids(cid_minter, input_file, output_file, err_file, zed_event_data):
+# Number of records minted together by CidMinter.mint_cids
+MINTING_BATCH_SIZE = 1000
+CID_BLOCK_SIZE = 100
+
+def assign_cids(cid_minter, input_file, output_file, err_file, zed_event_data, batch_size=MINTING_BATCH_SIZE):
     """Process input records and write records to output files based on specifications.
 
     Args:
@@ -26,59 +34,88 @@ def assign_cids(cid_minter, input_file, output_file, err_file, zed_event_data):
       input_file: full path of input file
       output_file: full path of output file
       err_file: full path or error file
+      batch_size: number of records minted together
+    Records are read and written one at a time, so memory use depends on the batch size, not on the file size.
+    The output files are written in the final pretty printed format and moved into place when all records are written.
+    The error file is only kept when a record failed.
+    """
+    writer = MarcXmlWriter(output_file)
+    writer_err = MarcXmlWriter(err_file)
+    try:
+        no_error = assign_cids_from_file(cid_minter, input_file, writer, writer_err, zed_event_data, batch_size)
+    except Exception:
+        writer.discard()
+        writer_err.discard()
+        raise
+
+    writer.close()
+    if no_error:
+        writer_err.discard()
+    else:
+        writer_err.close()
+
+def assign_cids_from_file(cid_minter, input_file, writer, writer_err, zed_event_data, batch_size):
+    """Read the records of the input file in batches, mint their CIDs and write them.
+    When the file is not well-formed XML, the records read before the error are minted and written.
+    Returns: True when all records were assigned a CID.
     """
-    writer = XMLWriter(open(output_file,'wb'))
-    writer_err = XMLWriter(open(err_file,'wb'))
     no_error = True
     with open(input_file, 'rb') as fh:
-        reader = marcxml.parse_xml_to_array(fh, strict=True, normalize_form=None)
+        reader = iter_marcxml_records(fh, strict=True)
         """strict=True: check the namespaces for the MARCSlim namespace.
-           Valid values for normalize_form are 'NFC', 'NFKC', 'NFD', and 'NFKD
-           See unicodedata.normalize for more info on these
+           Records are read one at a time, so minting starts before the whole file is parsed.
         """
 
-        for record in reader:
-            if record:
-                #ids = {"ocns": "80274381,25231018", "contribsys_id": "hvd.000012735,hvd000012735", "previous_sysids": "", "htid": "hvd.hw5jdo"}
-                ids = get_ids(record)
-                zed_event_data["object"] = ids.get("htid")
-                zed_event_data["ids"] = ids
-                cid = mint_cid(cid_minter, ids, zed_event_data)
-                if cid:
-                    cid_fields = record.get_fields("CID")
-                    if not cid_fields:
-                        record.add_field(Field(tag = 'CID', indicators = [' ',' '], subfields = ['a', cid]))
-                    elif len(cid_fields) == 1:
-                        record["CID"]['a'] = cid 
-                    else:
-                        no_error = False
-                        logging.error("Error - more than one CID field. log error and skip this record")
-                        writer_err.write(record)
-                        continue
-                    writer.write(record)
-                else:
-                    no_error = False
-                    logging.error("Error - CID minting failed. log error and skip this record")
-                    writer_err.write(record)
-                    continue
-            elif isinstance(reader.current_exception, exc.FatalReaderError):
-                # data file format error
-                # reader will raise StopIteration
-                logging.error(f"Pymarc error: {reader.current_exception}")
-                logging.error(f"Current chunk: {reader.current_chunk}")
+        batch = []
+        try:
+            for record in reader:
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    no_error = assign_cids_to_records(cid_minter, batch, writer, writer_err, zed_event_data) and no_error
+                    batch = []
+        except etree.XMLSyntaxError as err:
+            # data file format error: keep the records read before the error
+            no_error = False
+            logging.error(f"XML syntax error in {input_file}: {err}")
+        if batch:
+            no_error = assign_cids_to_records(cid_minter, batch, writer, writer_err, zed_event_data) and no_error
+    return no_error
+
+def assign_cids_to_records(cid_minter, records, writer, writer_err, zed_event_data):
+    """Mint CIDs for a batch of records and write the records with their CIDs.
+
+    Args:
+      cid_minter: CidMinter object
+      records: list of MARC records
+      writer: writer for records with CIDs
+      writer_err: writer for records that failed
+      zed_event_data: ZED event data shared by the records
+    Returns: True when all records were assigned a CID.
+    """
+    no_error = True
+    #ids = {"ocns": "80274381,25231018", "contribsys_id": "hvd.000012735,hvd000012735", "previous_sysids": "", "htid": "hvd.hw5jdo"}
+    ids_list = [get_ids(record) for record in records]
+    event_data_list = [{**zed_event_data, "object": ids.get("htid"), "ids": ids} for ids in ids_list]
+    cids = mint_cids(cid_minter, ids_list, event_data_list)
+    for record, cid in zip(records, cids):
+        if cid:
+            cid_fields = record.get_fields("CID")
+            if not cid_fields:
+                record.add_field(Field(tag = 'CID', indicators = [' ',' '], subfields = ['a', cid]))
+            elif len(cid_fields) == 1:
+                record["CID"]['a'] = cid 
             else:
                 no_error = False
-                # fix the record data, skip or stop reading:
-                logging.error(f"Pymarc error: {reader.current_exception}")
-                logging.error(f"Current chunk: {reader.current_chunk}")
-                # break/continue/raise
-                writer_err.write(reader.current_chunk)
+                logging.error("Error - more than one CID field. log error and skip this record")
+                writer_err.write(record)
                 continue
-
-    writer.close()
-    writer_err.close()
-    if no_error:
-        os.remove(err_file)
+            writer.write(record)
+        else:
+            no_error = False
+            logging.error("Error - CID minting failed. log error and skip this record")
+            writer_err.write(record)
+            continue
+    return no_error
 
 def get_ids(record):
     """Get IDs from the following fields:
@@ -182,39 +219,48 @@ def mint_cid(cid_minter, ids, zed_event_data):
         return None
 
 
-def convert_to_pretty_xml(input_file, output_file):
+def mint_cids(cid_minter, ids_list, zed_event_data_list):
+    # call cid_minter to assign CIDs to a batch of records
     try:
-        parser = etree.XMLParser(remove_blank_text=True, recover=True)
-        tree = etree.parse(input_file, parser)
-        tree.write(output_file, pretty_print=True)
+        return cid_minter.mint_cids(ids_list, zed_event_data_list)
     except Exception as ex:
-        err_msg = f"Pretty XMLParser error: {ex}"
-        logging.error(err_msg)
-        print(err_msg)
-
-def config_logger(logfile, console):
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-
+        logging.error(f"CID minting error: {ex}")
+        return [None] * len(ids_list)
+
+def config_logger(logfile, console, level=logging.INFO, multiprocess=False):
+    """Log to the log file, and to the console when console is set.
+    Records are put on a queue by a QueueHandler and written by a QueueListener thread,
+    so the minting thread does not wait for log I/O. With multiprocess, the queue is a
+    multiprocessing queue shared with the worker processes forked later.
+    Args:
+      level: root logger level. Per record steps of the minter are logged at DEBUG, one summary line per record at INFO.
+    Returns: the started QueueListener. It is stopped, and the queue drained, at exit.
+    """
     log_format = logging.Formatter('%(asctime)s %(levelname)s %(funcName)s: %(message)s')
     # output to file
     file = logging.FileHandler(logfile)
     file.setFormatter(log_format)
-
-    logger.addHandler(file)
+    handlers = [file]
 
     if console:   
         # output to console
-        stream = logging.StreamHandler()
-        logger.addHandler(stream)
+        handlers.append(logging.StreamHandler())
+
+    log_queue = multiprocessing.Queue(-1) if multiprocess else queue.Queue(-1)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    logger.addHandler(QueueHandler(log_queue))
+    return listener
 
 def process_one_file(config, source_dir, target_dir, input_filename, output_filename):
     err_filename = f"{input_filename}.err"
     input_file = os.path.join(source_dir, input_filename)
     output_file = os.path.join(target_dir, output_filename)
     err_file = os.path.join(target_dir, err_filename)
-    output_file_tmp = f"/tmp/{output_filename}.tmp"
-    err_file_tmp = f"/tmp/{err_filename}.tmp"
 
     if input_file == output_file:
         err_msg = f"Filename error: Input and output files share the same path and name. ({input_file})"
@@ -229,12 +275,11 @@ def process_one_file(config, source_dir, target_dir, input_filename, output_file
     }
 
     cid_minter = CidMinter(config)
-    assign_cids(cid_minter, input_file, output_file_tmp, err_file_tmp, zed_event_data)
-
-    if os.path.exists(output_file_tmp):
-        convert_to_pretty_xml(output_file_tmp, output_file)
-    if os.path.exists(err_file_tmp): 
-        convert_to_pretty_xml(err_file_tmp, err_file)
+    batch_size = config.get("minting_batch_size") or MINTING_BATCH_SIZE
+    try:
+        assign_cids(cid_minter, input_file, output_file, err_file, zed_event_data, batch_size)
+    finally:
+        cid_minter.close()
 
 def lock_a_dir_for_cid_minting(dir_path):
     """Locate a directory for CID minting.
@@ -248,18 +293,48 @@ def lock_a_dir_for_cid_minting(dir_path):
       dirname_locked: the identified/locked directory
     """
     for a_dir in glob(dir_path):
-        process_dot_cid = os.path.join(a_dir, "process.cid")
-        if os.path.exists(process_dot_cid):
+        locked_dir = lock_dir_with_xml_files(a_dir)
+        if locked_dir:
+            return locked_dir
+    return None
+
+def lock_dirs_for_cid_minting(dir_path):
+    """Lock all directories for CID minting.
+       Identify the dirctories that contain at least one Zephir prepared file with .xml extension but do not contain a process.cid file;
+       Lock the identified directories for CID minting by putting a process.cid file underneath.
+    Args:
+      dir_path: a string for a directroy with or without wildcard char "*".
+    Returns:
+      locked_dirs: list of the identified/locked directories
+    """
+    locked_dirs = []
+    for a_dir in glob(dir_path):
+        locked_dir = lock_dir_with_xml_files(a_dir)
+        if locked_dir:
+            locked_dirs.append(locked_dir)
+    return locked_dirs
+
+def lock_dir_with_xml_files(a_dir):
+    """Lock a directory that contains at least one .xml file by creating a process.cid file underneath.
+       The process.cid file is created exclusively, so only one CID minter can lock the directory.
+    Returns:
+      the locked directory; None when the directory has no .xml file or is locked by another CID minter
+    """
+    process_dot_cid = os.path.join(a_dir, "process.cid")
+    if os.path.exists(process_dot_cid):
+        print(f"Another CID minter is processing files in directroy {a_dir} - pass this dir")
+        return None
+    xml_files = os.path.join(a_dir, "*.xml")
+    for file in glob(xml_files):
+        print(f"Found an xml file to process: {file}")
+        print("Lock this directory")
+        try:
+            with open(process_dot_cid, 'x') as fp:
+                pass
+        except FileExistsError:
             print(f"Another CID minter is processing files in directroy {a_dir} - pass this dir")
-            continue
-        else:
-            xml_files = os.path.join(a_dir, "*.xml")
-            for file in glob(xml_files):
-                print(f"Found an xml file to process: {file}")
-                print("Lock this directory")
-                with open(process_dot_cid, 'w') as fp:
-                    pass
-                return os.path.dirname(file)
+            return None
+        return os.path.dirname(file)
     return None
 
 def lock_a_file_for_cid_minting(a_dir, pid):
@@ -283,9 +358,13 @@ def lock_a_file_for_cid_minting(a_dir, pid):
         print("Lock this file for CID minting")
         dirname_locked, filename_org = os.path.split(file)
         filename_locked = f"{filename_org}.{pid}"
-        os.rename(file, os.path.join(dirname_locked, filename_locked))
+        try:
+            os.rename(file, os.path.join(dirname_locked, filename_locked))
+        except FileNotFoundError:
+            # locked by another worker
+            continue
         return filename_org, filename_locked 
-    return filename_org, filename_locked 
+    return None, None
 
 def batch_process(config, dir_path, pid):
     """Batch process files in an identified directroy
@@ -298,26 +377,74 @@ def batch_process(config, dir_path, pid):
     """
     locked_dir = lock_a_dir_for_cid_minting(dir_path)
     if locked_dir:
-        parent_dir = os.path.dirname(locked_dir)
-        target_dir = os.path.join(parent_dir, "cidfiles")
         # process all files in the locked directory 
-        while True:
-            filename_org, filename_locked = lock_a_file_for_cid_minting(locked_dir, pid)
-            if filename_org and filename_locked:
-                process_one_file(config=config, 
-                                 source_dir=locked_dir, 
-                                 target_dir=target_dir, 
-                                 input_filename=filename_locked, 
-                                 output_filename=filename_org)
-                locked_file = os.path.join(locked_dir, filename_locked)
-                processed_file = os.path.join(locked_dir, f"{filename_org}.processed")
-                os.rename(locked_file, processed_file)
-            else:
-                # unlock the directory
-                process_dot_cid_file = os.path.join(locked_dir, "process.cid")
-                if os.path.exists(process_dot_cid_file):
-                    os.remove(process_dot_cid_file)
-                return
+        try:
+            process_locked_files(config, locked_dir, pid)
+        finally:
+            unlock_dir(locked_dir)
+
+def parallel_batch_process(config, dir_path, workers):
+    """Process the files in all identified directories with a pool of worker processes.
+       All directories with Zephir prepared files are locked with a process.cid file first.
+       Each worker then locks one file at a time by renaming it to filename.pid, so a file is only processed once.
+       Workers create their own CidMinter for each file, with their own database connections,
+       and write to their own ZED log. New CIDs are reserved with an atomic update of the cid_minter table,
+       and the IDs of a record are claimed in the local minter before its new CID is used, so workers
+       minting records that share a new OCN or contribsys ID at the same time assign the same CID.
+    Args:
+      config: a Python directroy for configurations 
+      dir_path: a string for a directroy with or without wildcard char "*".
+      workers: number of worker processes
+    """
+    locked_dirs = lock_dirs_for_cid_minting(dir_path)
+    if not locked_dirs:
+        return
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            pool.starmap(process_files_in_worker, [(config, locked_dirs)] * workers)
+    finally:
+        for locked_dir in locked_dirs:
+            unlock_dir(locked_dir)
+
+def process_files_in_worker(config, locked_dirs):
+    """Process files in the locked directories until no file is left. Runs in a worker process.
+    """
+    pid = os.getpid()
+    worker_config = {
+        **config,
+        "zed_log": zed_log_filename(config.get("zed_log_path"), pid),
+        "process_key": str(uuid.uuid4()),
+    }
+    logging.info(f"Start CID minting worker PID:{pid}")
+    for locked_dir in locked_dirs:
+        process_locked_files(worker_config, locked_dir, pid)
+
+def process_locked_files(config, locked_dir, pid):
+    """Lock and process the files in a locked directory one at a time until no file is left.
+    """
+    parent_dir = os.path.dirname(locked_dir)
+    target_dir = os.path.join(parent_dir, "cidfiles")
+    while True:
+        filename_org, filename_locked = lock_a_file_for_cid_minting(locked_dir, pid)
+        if not (filename_org and filename_locked):
+            return
+        process_one_file(config=config, 
+                         source_dir=locked_dir, 
+                         target_dir=target_dir, 
+                         input_filename=filename_locked, 
+                         output_filename=filename_org)
+        locked_file = os.path.join(locked_dir, filename_locked)
+        processed_file = os.path.join(locked_dir, f"{filename_org}.processed")
+        os.rename(locked_file, processed_file)
+
+def unlock_dir(locked_dir):
+    process_dot_cid_file = os.path.join(locked_dir, "process.cid")
+    if os.path.exists(process_dot_cid_file):
+        os.remove(process_dot_cid_file)
+
+def zed_log_filename(zed_log_path, pid):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(zed_log_path, f"zed_cid_{timestamp}_{pid}.log")
 
 def main():
     parser = argparse.ArgumentParser(description="Assign CID to Zephir records.")
@@ -329,6 +456,7 @@ def main():
     parser.add_argument("--outfile", "-o", nargs="?", dest="output_filename", help="output filename")
     parser.add_argument("--batch", "-b", action="store_true", dest="batch", help="assign CID in batch")
     parser.add_argument("--zephir_config", "-z",  nargs="?", dest="zephir_config", help="assign CID for specified config")
+    parser.add_argument("--workers", "-w", type=int, default=1, dest="workers", help="number of worker processes for batch processing")
 
     args = parser.parse_args()
 
@@ -340,6 +468,7 @@ def main():
     output_filename = args.output_filename
     batch = args.batch
     zephir_config = args.zephir_config
+    workers = args.workers
 
     ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
     CONFIG_PATH = os.path.join(ROOT_PATH, "config")
@@ -352,27 +481,49 @@ def main():
 
     primary_db_path = cid_minting_config["primary_db_path"]
     cluster_db_path = cid_minting_config["cluster_db_path"]
+    concordance_arrays_path = cid_minting_config.get("concordance_arrays_path")
+    minting_batch_size = cid_minting_config.get("minting_batch_size", MINTING_BATCH_SIZE)
+    cid_block_size = cid_minting_config.get("cid_block_size", CID_BLOCK_SIZE)
     logfile = cid_minting_config["logfile"]
+    log_level = cid_minting_config.get("log_level", "INFO")
     zephir_files_dir = cid_minting_config["zephir_files_dir"]
     zed_log_path = cid_minting_config["zed_log_path"]
     zed_msg_table = cid_minting_config["zed_msg_table"]
+    zed_log_fsync = cid_minting_config.get("zed_log_fsync", False)
+    zed_sink = cid_minting_config.get("zed_sink", "file")
+    zed_schema = cid_minting_config.get("zed_schema")
+    zed_db_conn_str = None
+    if zed_sink == "database":
+        # the ZED events table, configured in zed_db.yml as for zed-verify
+        zed_db_config = (get_configs_by_filename(CONFIG_PATH, "zed_db") or {}).get(env)
+        if zed_db_config:
+            zed_db_conn_str = str(db_connect_url(zed_db_config))
 
     pid = os.getpid()
     process_key = str(uuid.uuid4())
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    zed_log = os.path.join(zed_log_path, f"zed_cid_{timestamp}_{pid}.log")
+    zed_log = zed_log_filename(zed_log_path, pid)
 
     config = {
         "zephirdb_conn_str": zephirdb_conn_str,
         "minterdb_conn_str": minterdb_conn_str,
         "leveldb_primary_path": primary_db_path,
         "leveldb_cluster_path": cluster_db_path,
+        "concordance_arrays_path": concordance_arrays_path,
+        "minting_batch_size": minting_batch_size,
+        "cid_block_size": cid_block_size,
         "zed_log": zed_log,
+        "zed_log_path": zed_log_path,
+        # one ZED log for all files processed by this process
+        "zed_log_append": True,
+        "zed_log_fsync": zed_log_fsync,
         "zed_msg_table": zed_msg_table,
+        "zed_sink": zed_sink,
+        "zed_schema": zed_schema,
+        "zed_db_conn_str": zed_db_conn_str,
         "process_key": process_key,
     }
 
-    config_logger(logfile, console)
+    config_logger(logfile, console, level=log_level, multiprocess=workers > 1)
 
     logging.info("Start " + os.path.basename(__file__) + " PID:" + str(pid))
     logging.info("Env: {}".format(env))
@@ -386,7 +537,22 @@ def main():
             print(err_msg)
             exit(1)
 
-    if batch or zephir_config:
+    if workers > 1 and not concordance_arrays_path:
+        # a LevelDB database can only be opened by one process at a time
+        err_msg = "Configuration error: --workers requires concordance_arrays_path in cid_minting.yml"
+        logging.error(err_msg)
+        print(err_msg)
+        exit(1)
+
+    if zed_sink == "database" and not (zed_db_conn_str and zed_schema):
+        err_msg = f"Configuration error: zed_sink: database requires the {env} database in zed_db.yml and zed_schema in cid_minting.yml"
+        logging.error(err_msg)
+        print(err_msg)
+        exit(1)
+
+    if (batch or zephir_config) and workers > 1:
+        parallel_batch_process(config, preparedfile_dir, workers)
+    elif batch or zephir_config:
         batch_process(config, preparedfile_dir, pid)
     elif source_dir and target_dir and input_filename:
         if output_filename is None:
@@ -0,0 +1,90 @@
+import os
+import time
+import tempfile
+
+import argparse
+import atexit
+import logging
+
+from assign_cid_to_zephir_records import config_logger
+from assign_cid_to_zephir_records import get_ids
+from cid_minter.cid_minter import CidMinter
+from marcxml_stream import iter_marcxml_records
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(funcName)s: %(message)s'
+
+def direct_logger(logfile, level):
+    """Log to the file from the minting thread, the way config_logger did before the QueueHandler."""
+    file = logging.FileHandler(logfile)
+    file.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    logger.addHandler(file)
+
+def queue_logger(logfile, level):
+    return config_logger(logfile, False, level=level)
+
+def reset_logging(listener):
+    if listener:
+        listener.stop()
+        atexit.unregister(listener.stop)
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+def benchmark(config, ids_list, passes):
+    """Returns records per second for minting the records passes times, including close()."""
+    cid_minter = CidMinter(config)
+    event_data = [{"object": ids.get("htid"), "ids": ids} for ids in ids_list]
+    start = time.perf_counter()
+    for i in range(passes):
+        cid_minter.mint_cids(ids_list, event_data)
+    cid_minter.close()
+    return len(ids_list) * passes / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure records minted per second with minting logs off, at INFO and at DEBUG.')
+    parser.add_argument('--input', '-i', dest='input', required=True, help="MARCXML file of Zephir prepared records")
+    parser.add_argument('--zephir-db', dest='zephir_db', required=True, help="Zephir database connection string")
+    parser.add_argument('--minter-db', dest='minter_db', required=True, help="Local minter database connection string")
+    parser.add_argument('--primary-db', dest='primary_db', help="LevelDB primary-lookup path")
+    parser.add_argument('--cluster-db', dest='cluster_db', help="LevelDB cluster-lookup path")
+    parser.add_argument('--concordance-arrays', dest='concordance_arrays', help="Sorted-array concordance path, used instead of LevelDB")
+    parser.add_argument('--msg-table', '-m', dest='msg_table', required=True, help="ZED msg table (columns_prep.csv)")
+    parser.add_argument('--passes', '-n', dest='passes', type=int, default=10, help="Times the records are minted per run")
+    parser.add_argument('--tmp-dir', dest='tmp_dir', help="Directory for the logs")
+
+    args = parser.parse_args()
+
+    with open(args.input, 'rb') as fh:
+        ids_list = [get_ids(record) for record in iter_marcxml_records(fh)]
+
+    runs = [
+        ("off (WARNING)", queue_logger, logging.WARNING),
+        ("INFO, queue", queue_logger, logging.INFO),
+        ("DEBUG, queue", queue_logger, logging.DEBUG),
+        ("DEBUG, direct", direct_logger, logging.DEBUG),
+    ]
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        config = {
+            "zephirdb_conn_str": args.zephir_db,
+            "minterdb_conn_str": args.minter_db,
+            "leveldb_primary_path": args.primary_db,
+            "leveldb_cluster_path": args.cluster_db,
+            "concordance_arrays_path": args.concordance_arrays,
+            "zed_log": os.path.join(tmp_dir, "zed.log"),
+            "zed_msg_table": args.msg_table,
+        }
+        # the first pass mints new CIDs, later passes find them in the local minter
+        benchmark(config, ids_list, 1)
+        for name, create_logger, level in runs:
+            logfile = os.path.join(tmp_dir, "cid_minting.log")
+            listener = create_logger(logfile, level)
+            rate = benchmark(config, ids_list, args.passes)
+            reset_logging(listener)
+            print("{:<16} {:>10.0f} records/s {:>10d} log bytes".format(name, rate, os.path.getsize(logfile)))
+            os.remove(logfile)
+
+if __name__ == '__main__':
+    main()
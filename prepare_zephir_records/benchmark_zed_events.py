@@ -0,0 +1,66 @@
+import os
+import time
+import json
+import tempfile
+
+import argparse
+
+from cid_minter.zed_for_cid import CidZedEvent
+from cid_minter.zed_for_cid import ZedFileSink
+from cid_minter.zed_for_cid import ZED_LOG_BUFFER_SIZE
+
+class JsonDumpSink:
+    """Writes each event with json.dump, the way CidZedEvent did before ZedFileSink."""
+    def __init__(self, zed_event_log):
+        self._fp = open(zed_event_log, "w")
+
+    def write(self, zed_event):
+        json.dump(zed_event, self._fp)
+        self._fp.write('\n')
+
+    def flush(self):
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+def benchmark(zed_event, events):
+    """Returns events per second for creating and writing events, including close()."""
+    msg_codes = ["pr0212", "pr0213"]
+    start = time.perf_counter()
+    for i in range(events):
+        zed_event.setup_zed_event_data({
+            "process_key": "92b1be8b-5fa0-44e5-9796-0a2ab3a4d5f0",
+            "subject": "test_1_ia-coo-2_20220511.xml",
+            "object": f"coo1.ark:/13960/t{i}",
+            "ids": {"htid": f"coo1.ark:/13960/t{i}", "ocns": "15340141", "contribsys_ids": "coo.1398704,coo1398704"},
+            "report": {"CID": "009547290"},
+        })
+        zed_event.create_zed_event(msg_codes[i % 2])
+    zed_event.close()
+    return events / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure ZED events written per second with the buffered and unbuffered ZED log writers.')
+    parser.add_argument('--msg-table', '-m', dest='msg_table', required=True, help="ZED msg table (columns_prep.csv)")
+    parser.add_argument('--events', '-n', dest='events', type=int, default=100000, help="Events per writer")
+    parser.add_argument('--buffer-size', dest='buffer_size', type=int, default=ZED_LOG_BUFFER_SIZE, help="ZedFileSink buffer size in bytes")
+    parser.add_argument('--tmp-dir', dest='tmp_dir', help="Directory for the ZED logs")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        zed_log = os.path.join(tmp_dir, "zed.log")
+        writers = [
+            ("json.dump per event", lambda: JsonDumpSink(zed_log)),
+            ("ZedFileSink", lambda: ZedFileSink(zed_log, buffer_size=args.buffer_size)),
+            ("ZedFileSink fsync", lambda: ZedFileSink(zed_log, buffer_size=args.buffer_size, fsync=True)),
+        ]
+        for name, create_sink in writers:
+            zed_event = CidZedEvent(args.msg_table, zed_log)
+            zed_event.zed_log.close()
+            zed_event.zed_log = create_sink()
+            print("{:<20} {:>10.0f} events/s".format(name, benchmark(zed_event, args.events)))
+
+if __name__ == '__main__':
+    main()
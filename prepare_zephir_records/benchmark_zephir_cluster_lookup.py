@@ -0,0 +1,61 @@
+import os
+import time
+
+import argparse
+
+from lib.utils import db_connect_url
+from lib.utils import get_configs_by_filename
+from cid_minter.zephir_cluster_lookup import ZephirDatabase
+
+def two_query_lookup(zephirDb, ocns_list):
+    """Cluster lookup in two queries: CIDs by OCNs, then all OCNs by CIDs."""
+    cid_ocn_list = zephirDb.find_zephir_clusters_by_ocns(ocns_list)
+    if not cid_ocn_list:
+        return cid_ocn_list
+    cids_list = list(set([cid_ocn.get("cid") for cid_ocn in cid_ocn_list]))
+    return zephirDb.find_zephir_clusters_by_cids(cids_list)
+
+def one_query_lookup(zephirDb, ocns_list):
+    """Cluster lookup in one query."""
+    return zephirDb.find_zephir_clusters_with_all_ocns_by_ocns(ocns_list)
+
+def benchmark(lookup, zephirDb, ocns_list, repeat):
+    """Returns the result of the lookup and the mean time per lookup in seconds."""
+    result = lookup(zephirDb, ocns_list)
+    start = time.perf_counter()
+    for i in range(repeat):
+        lookup(zephirDb, ocns_list)
+    return result, (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the one and two query Zephir cluster lookups by OCNs.')
+    parser.add_argument('--env', '-e', nargs='?', dest='env', choices=["test", "dev", "stg", "prd"], help="Database config in config/zephir_db.yml")
+    parser.add_argument('--db', nargs='?', dest='db_conn_str', help="Database connection string, for example sqlite:///test.db")
+    parser.add_argument('--repeat', '-r', nargs='?', dest='repeat', type=int, default=1000, help="Lookups per query strategy")
+    parser.add_argument('ocns', help="OCNs separated by a comma without spaces. For example: 6758168,15437990")
+
+    args = parser.parse_args()
+    ocns_list = args.ocns.split(",")
+
+    if args.db_conn_str:
+        db_conn_str = args.db_conn_str
+    elif args.env:
+        ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+        CONFIG_PATH = os.path.join(ROOT_PATH, 'config')
+        configs= get_configs_by_filename(CONFIG_PATH, 'zephir_db')
+        db_conn_str = str(db_connect_url(configs[args.env]))
+    else:
+        parser.error("--env or --db is required")
+
+    zephirDb = ZephirDatabase(db_conn_str)
+    two_result, two_time = benchmark(two_query_lookup, zephirDb, ocns_list, args.repeat)
+    one_result, one_time = benchmark(one_query_lookup, zephirDb, ocns_list, args.repeat)
+    zephirDb.close()
+
+    print("Inquiry OCNs: {}".format(ocns_list))
+    print("Two queries: {:.3f} ms per lookup".format(two_time * 1000))
+    print("One query:   {:.3f} ms per lookup".format(one_time * 1000))
+    print("Same results: {}".format(one_result == two_result))
+
+if __name__ == '__main__':
+    main()
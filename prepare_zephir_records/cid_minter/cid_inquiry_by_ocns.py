@@ -10,7 +10,7 @@ import time
 from cid_minter.oclc_lookup import lookup_ocns_from_oclc
 from cid_minter.zephir_cluster_lookup import ZephirDatabase
 
-def cid_inquiry_by_ocns(ocns, zephirDb, primary_db_path, cluster_db_path):
+def cid_inquiry_by_ocns(ocns, zephirDb, primary_db_path, cluster_db_path, oclc_concordance=None):
     """Find Zephir clusters by given OCNs and their associated OCLC OCNs.
        1. Find associated OCLC OCNs
        2. Combine incoming OCNs and OCLC OCNs, remove duplicates  
@@ -20,6 +20,8 @@ def cid_inquiry_by_ocns(ocns, zephirDb, primary_db_path, cluster_db_path):
         db_conn_str: database connection string
         primary_db_path: full path to the OCNs primary LevelDB
         cluster_db_path: full path to the OCNs cluster LevelDB
+        oclc_concordance: OclcConcordance object to use for the OCLC lookup (optional).
+            When present, the database paths are ignored.
     Returns: a dict combining both OCLC lookup and Zephir lookup results:
        "inquiry_ocns": input ocns, list of integers.
        "matched_oclc_clusters": OCNs in matched OCLC clusters, list of lists in integers.
@@ -32,7 +34,10 @@ def cid_inquiry_by_ocns(ocns, zephirDb, primary_db_path, cluster_db_path):
     """
 
     # Lookups OCN clusters by a list of OCNs in integer
-    oclc_lookup_result = lookup_ocns_from_oclc(ocns, primary_db_path, cluster_db_path)
+    if oclc_concordance:
+        oclc_lookup_result = oclc_concordance.lookup_ocns_from_oclc(ocns)
+    else:
+        oclc_lookup_result = lookup_ocns_from_oclc(ocns, primary_db_path, cluster_db_path)
 
     # combine incoming OCNs with and matched OCLC ocns, and dedup
     oclc_ocns_list = oclc_lookup_result["matched_oclc_clusters"]
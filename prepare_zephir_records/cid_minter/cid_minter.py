@@ -5,12 +5,26 @@ from enum import Enum
 import logging
 
 from cid_minter.oclc_lookup import lookup_ocns_from_oclc
+from cid_minter.oclc_lookup import OclcConcordance
+from cid_minter.concordance_arrays import SortedArrayConcordance
 from cid_minter.zephir_cluster_lookup import ZephirDatabase
 from cid_minter.zephir_cluster_lookup import CidMinterTable 
+from cid_minter.zephir_cluster_lookup import CidBlockAllocator
 from cid_minter.cid_inquiry_by_ocns import cid_inquiry_by_ocns
 from cid_minter.cid_store import CidStore
 from cid_minter.cid_inquiry_by_ocns import convert_comma_separated_str_to_int_list
+from cid_minter.cid_inquiry_by_ocns import flat_and_dedup_sort_list
+from cid_minter.minting_batch import PrefetchedZephirDatabase
+from cid_minter.minting_batch import BufferedCidStore
 from cid_minter.zed_for_cid import CidZedEvent
+from cid_minter.zed_for_cid import ZedFileSink
+from cid_minter.zed_for_cid import ZedDatabaseSink
+from cid_minter.zed_for_cid import load_zed_schema
+from cid_minter.zed_for_cid import ZED_LOG_BUFFER_SIZE
+from cid_minter.zed_for_cid import ZED_LOG_FLUSH_INTERVAL
+from cid_minter.zed_for_cid import ZED_DB_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
 
 class IdType(Enum):
     OCN = "ocn"
@@ -27,16 +41,104 @@ class CidMinter:
         self.config = config
         self._zephir_db = ZephirDatabase(self.config.get("zephirdb_conn_str"))
         self._minter_db = CidStore(self.config.get("minterdb_conn_str"))
+        self._cid_allocator = CidBlockAllocator(CidMinterTable(self._zephir_db), self.config.get("cid_block_size") or 1)
+        # lookups go to the databases, or to the prefetched IDs while minting a batch
+        self._zephir_lookup = self._zephir_db
+        self._minter_lookup = self._minter_db
         self._leveldb_primary_path = self.config.get("leveldb_primary_path")
         self._leveldb_cluster_path = self.config.get("leveldb_cluster_path")
-        self.cid_zed_event = CidZedEvent(self.config.get("zed_msg_table"), self.config.get("zed_log"))
+        concordance_store = None
+        if self.config.get("concordance_arrays_path"):
+            concordance_store = SortedArrayConcordance(self.config.get("concordance_arrays_path"))
+        self._oclc_concordance = OclcConcordance(self._leveldb_primary_path, self._leveldb_cluster_path,
+                cache_size=self.config.get("oclc_cache_size", OclcConcordance.DEFAULT_CACHE_SIZE),
+                store=concordance_store)
+        self.cid_zed_event = CidZedEvent(self.config.get("zed_msg_table"), sink=self._create_zed_sink())
      
+    def _create_zed_sink(self):
+        """ZED events go to the ZED log, or to the ZED events table of zed_db_conn_str, validated with the
+        zed_schema file, when zed_sink is "database"."""
+        zed_log_sink = ZedFileSink(self.config.get("zed_log"),
+                append=self.config.get("zed_log_append", False),
+                buffer_size=self.config.get("zed_log_buffer_size", ZED_LOG_BUFFER_SIZE),
+                flush_interval=self.config.get("zed_log_flush_interval", ZED_LOG_FLUSH_INTERVAL),
+                fsync=self.config.get("zed_log_fsync", False))
+        if self.config.get("zed_sink") != "database":
+            return zed_log_sink
+        return ZedDatabaseSink(self.config.get("zed_db_conn_str"),
+                load_zed_schema(self.config.get("zed_schema")), zed_log_sink,
+                batch_size=self.config.get("zed_db_batch_size", ZED_DB_BATCH_SIZE),
+                flush_interval=self.config.get("zed_log_flush_interval", ZED_LOG_FLUSH_INTERVAL))
+
     def close(self):
+        self._cid_allocator.close()
         self.cid_zed_event.close()
+        logger.info("OCLC lookup cache: %s", self._oclc_concordance.cache_stats())
+        self._oclc_concordance.close()
+
+    def mint_cids(self, batch, zed_event_data=None):
+        """Assign CIDs to a batch of records.
+        Same as calling mint_cid for each record in turn, with the IDs of all records looked up
+        together: one current CID query by htid, one local minter query per ID type,
+        one Zephir cluster query by OCNs and one by contribsys IDs. Records are minted in order,
+        so records that share IDs get the CID assigned to the first one, as with mint_cid.
+        Local minter updates are written after the last record; a failed write raises RuntimeError.
+        The IDs of records assigned a new CID are claimed in the local minter right away, see mint_cid.
+        Args:
+          batch: list of IDs dictionaries as used by mint_cid
+          zed_event_data: list of ZED event data, one per record (optional).
+               Set up for the ZED events of each record.
+        Returns: list of assigned CIDs, None for records that failed.
+        """
+        self._zephir_lookup, self._minter_lookup = self._prefetch_ids(batch)
+        cids = []
+        try:
+            for idx, ids in enumerate(batch):
+                if zed_event_data:
+                    self.cid_zed_event.setup_zed_event_data(zed_event_data[idx])
+                try:
+                    cids.append(self.mint_cid(ids))
+                except Exception as ex:
+                    logger.error("CID minting failed for record %s: %s", ids.get('htid'), ex)
+                    cids.append(None)
+        finally:
+            minter_lookup = self._minter_lookup
+            self._zephir_lookup = self._zephir_db
+            self._minter_lookup = self._minter_db
+            minter_lookup.flush()
+        return cids
+
+    def _prefetch_ids(self, batch):
+        """Look up the IDs of a batch of records together.
+        Returns: PrefetchedZephirDatabase and BufferedCidStore for the batch.
+        """
+        htids = []
+        ocns = []
+        zephir_ocns = []
+        sysids = []
+        for ids in batch:
+            if ids.get("htid"):
+                htids.append(ids.get("htid"))
+            record_ocns = convert_comma_separated_str_to_int_list(ids.get("ocns"))
+            if record_ocns:
+                ocns.extend(record_ocns)
+                oclc_ocns_list = self._oclc_concordance.lookup_ocns_from_oclc(record_ocns)["matched_oclc_clusters"]
+                zephir_ocns.extend(flat_and_dedup_sort_list([record_ocns] + oclc_ocns_list))
+            for key in ["contribsys_ids", "previous_contribsys_ids"]:
+                if ids.get(key):
+                    sysids.extend(ids.get(key).split(","))
+
+        zephir_lookup = PrefetchedZephirDatabase(self._zephir_db, htids, zephir_ocns, sysids)
+        minter_lookup = BufferedCidStore(self._minter_db, {
+            "ocn": [str(ocn) for ocn in ocns],
+            "sysid": sysids,
+        })
+        return zephir_lookup, minter_lookup
 
     def mint_cid(self, ids):
         """Assign CID by OCNs, local system IDs or previous local system IDs.
         Search CID in the local minter first. If there is no matched CID found then search the Zephir database.
+        A new CID is only used when the record's IDs are still free in the local minter, see _claim_ids_in_local_minter.
         Args:
           ids: IDs in a dictionary with following keys: 
                  "htid",
@@ -62,16 +164,16 @@ class CidMinter:
             previous_sysids = ids.get("previous_contribsys_ids").split(",")
 
         if not htid:
-            logging.error("ID error: missing required htid")
+            logger.error("ID error: missing required htid")
             raise ValueError("ID error: missing required htid")
 
-        logging.info(f"Find current CID by htid: {htid}")
-        results = self._zephir_db.find_cid_by_htid(htid)
+        logger.debug("Find current CID by htid: %s", htid)
+        results = self._zephir_lookup.find_cid_by_htid(htid)
         if results:
             current_cid = results[0].get("cid")
-            logging.info(f"Found current CID: {current_cid} by htid: {htid}")
+            logger.debug("Found current CID: %s by htid: %s", current_cid, htid)
         else:
-            logging.info(f"No CID/item found in Zephir DB by htid: {htid}")
+            logger.debug("No CID/item found in Zephir DB by htid: %s", htid)
 
         if ocns:
             assigned_cid = self._find_cid_in_local_minter(IdType.OCN, ocns)
@@ -80,7 +182,7 @@ class CidMinter:
             if assigned_cid:
                 cid_assigned_by = "OCLC number(s)"
         else:
-            logging.info(f"No OCLC number: Record {htid} does not contain OCLC number.")
+            logger.debug("No OCLC number: Record %s does not contain OCLC number.", htid)
 
         if sysids and self._cid_not_assigned_yet(assigned_cid):
             assigned_cid = self._find_cid_in_local_minter(IdType.SYSID, sysids)
@@ -99,19 +201,23 @@ class CidMinter:
         if self._cid_assigned(assigned_cid) and current_cid and current_cid != assigned_cid:
             msg_code = "pr0059"
             msg_detail = f"WARNING: Hathi-id ({htid}) changed CID from: {current_cid} to: {assigned_cid}"
-            logging.info(f"ZED code: {msg_code} - {msg_detail}")
+            logger.info("ZED code: %s - %s", msg_code, msg_detail)
             event_data = {
                 "msg_detail": msg_detail,
             }
             self.cid_zed_event.merge_zed_event_data(event_data)
             self.cid_zed_event.create_zed_event(msg_code)
 
+        new_cid = None
         if self._cid_not_assigned_yet(assigned_cid):
-            current_minter = self._find_current_minter()
-            self._minter_new_cid()
-            assigned_cid = self._find_current_minter().get("cid")
+            new_cid = self._cid_allocator.next_cid()
             msg_code = "pr0212" # assign new CID
-            logging.info(f"ZED code: {msg_code} - Minted a new minter: {assigned_cid} - from current minter: {current_minter}")
+            logger.debug("ZED code: %s - Minted a new minter: %s - from current minter: %s", msg_code, new_cid, int(new_cid) - 1)
+            assigned_cid = self._claim_ids_in_local_minter(ids, new_cid)
+            if assigned_cid != new_cid:
+                cid_assigned_by = "IDs claimed by another process"
+
+        if new_cid and assigned_cid == new_cid:
             event_data = {
                 "msg_detail": f"Assigned new CID: {assigned_cid}",
                 "report": {"CID": assigned_cid}
@@ -121,7 +227,7 @@ class CidMinter:
         else:
             msg_code = "pr0213" # assigned existing CID 
             msg_detail = f"Assigned existing CID: {assigned_cid} - assigned by matching {cid_assigned_by}"
-            logging.info(f"ZED code: {msg_code} - {msg_detail}")
+            logger.debug("ZED code: %s - %s", msg_code, msg_detail)
             event_data = {
                 "msg_detail": msg_detail,
                 "report": {"CID": assigned_cid}
@@ -132,6 +238,8 @@ class CidMinter:
         if assigned_cid:
             self._update_local_minter(ids, assigned_cid)
 
+        # one summary line per record, the steps above are logged at DEBUG
+        logger.info("Record %s: CID %s by %s (current CID: %s)", htid, assigned_cid, cid_assigned_by or "new CID", current_cid)
         return assigned_cid 
 
     def _cid_assigned(self, assigned_cid):
@@ -152,10 +260,10 @@ class CidMinter:
         """
         if type(input_id_type) != IdType:
             err_msg = f"Data type error: ID type should be IdType. Type {type(input_id_type)} was used instead."
-            logging.error(err_msg)
+            logger.error(err_msg)
             raise TypeError(err_msg)
 
-        logging.info(f"Find CID in local minter by {input_id_type.name}: {values}")
+        logger.debug("Find CID in local minter by %s: %s", input_id_type.name, values)
 
         if input_id_type == IdType.OCN:
             id_type = "ocn"
@@ -165,17 +273,18 @@ class CidMinter:
         assigned_cid = None
         matched_cids = []
 
+        found_cids = self._minter_lookup.find_cids(id_type, [str(value) for value in values])
         for value in values:
-            results = self._minter_db.find_cid(id_type, str(value))
-            if results and results.get('matched_cid') not in matched_cids:
-                matched_cids.append(results.get('matched_cid'))
+            cid = found_cids.get(str(value))
+            if cid and cid not in matched_cids:
+                matched_cids.append(cid)
         if len(matched_cids) == 0:
-            logging.info(f"Local minter: No CID found by {input_id_type.name}: {values}")
+            logger.debug("Local minter: No CID found by %s: %s", input_id_type.name, values)
         elif len(matched_cids) == 1:
             assigned_cid = matched_cids[0]
-            logging.info(f"Local minter: Found matched CID: {matched_cids} by {input_id_type.name}: {values}")
+            logger.debug("Local minter: Found matched CID: %s by %s: %s", matched_cids, input_id_type.name, values)
         else:
-            logging.error(f"Local minter error: Found more than one matched CID: {matched_cids} by {input_id_type.name}: {values}")
+            logger.error("Local minter error: Found more than one matched CID: %s by %s: %s", matched_cids, input_id_type.name, values)
 
         return assigned_cid
 
@@ -194,10 +303,10 @@ class CidMinter:
            'min_cid': '009705704'
            }
         """
-        logging.info(f"Find CID in Zephir Database by OCNs: {ocns}")
+        logger.debug("Find CID in Zephir Database by OCNs: %s", ocns)
         assigned_cid = None
-        results = cid_inquiry_by_ocns(ocns, self._zephir_db, self._leveldb_primary_path, self._leveldb_cluster_path)
-        logging.info(f"Minting results from Zephir by OCNs: {results}")
+        results = cid_inquiry_by_ocns(ocns, self._zephir_lookup, self._leveldb_primary_path, self._leveldb_cluster_path, self._oclc_concordance)
+        logger.debug("Minting results from Zephir by OCNs: %s", results)
 
         if results:
             num_of_matched_oclc_clusters = results.get('num_of_matched_oclc_clusters')
@@ -209,7 +318,7 @@ class CidMinter:
                 if num_of_matched_oclc_clusters > 1:
                     msg_code = "pr0096"
                     msg_detail = f"Record OCNs {ocns} match more than one OCLC Concordance clusters"
-                    logging.info(f"ZED code: {msg_code} - {msg_detail}")
+                    logger.info("ZED code: %s - %s", msg_code, msg_detail)
                     event_data = {
                         "msg_detail": msg_detail,
                     }
@@ -218,7 +327,7 @@ class CidMinter:
             else:
                 msg_code = "pr0094"
                 msg_detail = f"OCLC Concordance Table does not contain record OCNs {ocns}"
-                logging.error(f"ZED code: {msg_code} - {msg_detail}")
+                logger.error("ZED code: %s - %s", msg_code, msg_detail)
                 event_data = {
                     "msg_detail": msg_detail,
                 }
@@ -226,9 +335,9 @@ class CidMinter:
                 self.cid_zed_event.create_zed_event(msg_code)
 
             if num_of_matched_zephir_clusters == 0:
-                logging.info(f"Zephir minter: No CID found by OCNs: {ocns}")
+                logger.debug("Zephir minter: No CID found by OCNs: %s", ocns)
             else:
-                logging.info(f"Zephir minter: Found matched CID: {cid_list} by OCNs: {ocns}")
+                logger.debug("Zephir minter: Found matched CID: %s by OCNs: %s", cid_list, ocns)
 
             if num_of_matched_zephir_clusters > 1:
                 plural = ""
@@ -237,7 +346,7 @@ class CidMinter:
                     msg_code = "pr0090"
                     plural = "s"
                 msg_detail = f"Record with OCLC{plural} ({ocns}) matches {num_of_matched_zephir_clusters} CIDs ({cid_list}) used {assigned_cid}"
-                logging.warning(f"ZED code: {msg_code} - {msg_detail}")
+                logger.warning("ZED code: %s - %s", msg_code, msg_detail)
                 event_data = {
                         "msg_detail": msg_detail,
                     }
@@ -258,18 +367,18 @@ class CidMinter:
         """
         if type(input_id_type) != IdType:
             err_msg = f"Data type error: ID type should be IdType. Type {type(input_id_type)} was used instead."
-            logging.error(err_msg)
+            logger.error(err_msg)
             raise TypeError(err_msg)
 
-        logging.info(f"Find CID in Zephir Database by {input_id_type.name}: {sysids}")
+        logger.debug("Find CID in Zephir Database by %s: %s", input_id_type.name, sysids)
 
         if input_id_type not in [IdType.SYSID, IdType.PREV_SYSID]:
             err_msg = f"ID type error: ID type should be IdType.SYSID or IdType.PREV_SYSID. {input_id_type.name} was used instead."
-            logging.error(err_msg)
+            logger.error(err_msg)
             raise TypeError(err_msg)
 
-        results = self._zephir_db.find_zephir_clusters_by_contribsys_ids(sysids)
-        logging.info(f"Minting results from Zephir by {input_id_type.name}: {results}")
+        results = self._zephir_lookup.find_zephir_clusters_by_contribsys_ids(sysids)
+        logger.debug("Minting results from Zephir by %s: %s", input_id_type.name, results)
         
         if input_id_type == IdType.SYSID:
             return self._sysid_results(results, sysids)
@@ -281,11 +390,11 @@ class CidMinter:
         if results:
             assigned_cid = min(item.get('cid') for item in results )
             cid_list = list(item.get('cid') for item in results) 
-            logging.info(f"Zephir minter: Found matched CIDs: {cid_list} by contribsys IDs: {sysids}")
+            logger.debug("Zephir minter: Found matched CIDs: %s by contribsys IDs: %s", cid_list, sysids)
             if len(results) > 1:
                 msg_code = "pr0089"
                 msg_detail = f"Record with local num ({sysids}) matches {len(results)} CIDs ({cid_list}) used {assigned_cid}";
-                logging.warning(f"ZED code: {msg_code} - Record with local number matches more than one CID. - {msg_detail} ")
+                logger.warning("ZED code: %s - Record with local number matches more than one CID. - %s ", msg_code, msg_detail)
                 event_data = {
                     "msg_detail": msg_detail,
                 }
@@ -293,10 +402,10 @@ class CidMinter:
                 self.cid_zed_event.create_zed_event(msg_code)
 
             if self._cluster_contain_multiple_contribsys(assigned_cid):
-                logging.warning(f"Zephir cluster contains records from different contrib systems. Skip this CID ({assigned_cid}) assignment")
+                logger.warning("Zephir cluster contains records from different contrib systems. Skip this CID (%s) assignment", assigned_cid)
                 assigned_cid = None
         else:
-            logging.info(f"Zephir minter: No CID found by local num: {sysids}")
+            logger.debug("Zephir minter: No CID found by local num: %s", sysids)
 
         return assigned_cid
 
@@ -304,12 +413,12 @@ class CidMinter:
         assigned_cid = None
         if results:
             cid_list = list(item.get('cid') for item in results)
-            logging.info(f"Zephir minter: Found matched CIDs: {cid_list} by previous contribsys IDs: {sysids}")
+            logger.debug("Zephir minter: Found matched CIDs: %s by previous contribsys IDs: %s", cid_list, sysids)
             if len(results) > 1:
                 msg_code = "pr0042"
                 msg_detail = f"Record with previous local num ({sysids}) matches {len(results)} CIDs ({cid_list})";
                 zed_msg = f"ZED code: {msg_code} - Record with previous local num matches more than one CID. - {msg_detail}"
-                logging.error(zed_msg)
+                logger.error(zed_msg)
                 event_data = {
                     "msg_detail": msg_detail,
                 }
@@ -319,44 +428,58 @@ class CidMinter:
             else:
                 assigned_cid = results[0].get('cid')
                 if self._cluster_contain_multiple_contribsys(assigned_cid):
-                    logging.warning(f"Zephir cluster contains records from different contrib systems. Skip this CID ({assigned_cid}) assignment")
+                    logger.warning("Zephir cluster contains records from different contrib systems. Skip this CID (%s) assignment", assigned_cid)
                     assigned_cid = None
         else:
-            logging.info(f"Zephir minter: No CID found by previous contribsys IDs: {sysids}")
+            logger.debug("Zephir minter: No CID found by previous contribsys IDs: %s", sysids)
 
         return assigned_cid
 
     def _cluster_contain_multiple_contribsys(self, cid):
-        results = self._zephir_db.find_zephir_clusters_and_contribsys_ids_by_cid([cid])
+        results = self._zephir_lookup.find_zephir_clusters_and_contribsys_ids_by_cid([cid])
         if results and len(results) > 1:
             return True
         else:
             return False
 
-    def _minter_new_cid(self):
-        cid_minter_table = CidMinterTable(self._zephir_db)
-        return cid_minter_table.mint_a_new_cid()
-
-    def _find_current_minter(self):
-        cid_minter_table = CidMinterTable(self._zephir_db)
-        return cid_minter_table.get_cid()
+    def _local_minter_ids(self, ids):
+        """The record's OCNs, contribsys IDs and previous contribsys IDs as (data type, value, ID name) tuples.
+        """
+        updates = []
+        if ids.get("ocns"):
+            updates += [("ocn", ocn, "ocn") for ocn in ids.get("ocns").split(",")]
+        if ids.get("contribsys_ids"):
+            updates += [("sysid", sysid, "contribsys id") for sysid in ids.get("contribsys_ids").split(",")]
+        if ids.get("previous_contribsys_ids"):
+            updates += [("sysid", sysid, "previous contribsys id") for sysid in ids.get("previous_contribsys_ids").split(",")]
+        return updates
+
+    def _claim_ids_in_local_minter(self, ids, new_cid):
+        """Write the record's IDs that are not in the local minter with a newly minted CID before the CID is used.
+        Another process may have claimed some of them since they were looked up. Those keep their CID, and the CID
+        of the first one, in the order of mint_cid's lookups, is used instead of the new CID, so processes minting
+        records that share IDs at the same time assign the same CID.
+        Returns: the CID to assign.
+        """
+        updates = self._local_minter_ids(ids)
+        found = set()
+        for data_type in dict.fromkeys(data_type for data_type, value, id_name in updates):
+            values = [value for a_type, value, id_name in updates if a_type == data_type]
+            found.update((data_type, value) for value in self._minter_lookup.find_cids(data_type, values))
+        claims = [(data_type, value, id_name) for data_type, value, id_name in updates if (data_type, value) not in found]
+        stored = self._minter_lookup.claim_identifiers([(data_type, value, new_cid) for data_type, value, id_name in claims])
+        for data_type, value, id_name in claims:
+            cid = stored.get((data_type, value))
+            if cid and cid != new_cid:
+                logger.info("Local minter: %s %s was claimed with CID %s by another process. New CID %s is not used", id_name, value, cid, new_cid)
+                return cid
+        return new_cid
 
     def _update_local_minter(self, ids, cid):
-        ocns = ids.get("ocns")
-        sysids = ids.get("contribsys_ids")
-        previous_sysids = ids.get("previous_contribsys_ids")
-        if ocns:
-            for ocn in ocns.split(","):
-                self._minter_db.write_identifier("ocn", ocn, cid)
-                logging.info(f"Updated local minter: ocn: {ocn}")
-
-        if sysids:
-            for sysid in sysids.split(","):
-                self._minter_db.write_identifier("sysid", sysid, cid)
-                logging.info(f"Updated local minter: contribsys id: {sysid}")
-
-        if previous_sysids:
-            for sysid in previous_sysids.split(","):
-                self._minter_db.write_identifier("sysid", sysid, cid)
-                logging.info(f"Updated local minter: previous contribsys id: {sysid}")
-
+        """Write the record's OCNs, contribsys IDs and previous contribsys IDs with the CID to the local minter in one transaction.
+        """
+        updates = self._local_minter_ids(ids)
+        self._minter_lookup.write_identifiers([(data_type, value, cid) for data_type, value, id_name in updates])
+        if logger.isEnabledFor(logging.DEBUG):
+            for data_type, value, id_name in updates:
+                logger.debug("Updated local minter: %s: %s", id_name, value)
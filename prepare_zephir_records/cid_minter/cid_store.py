@@ -8,11 +8,18 @@ from sqlalchemy.ext.automap import automap_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import Session
 from sqlalchemy import create_engine
+from sqlalchemy import text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.exc import IntegrityError
 
 import logging
 
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT statement in write_identifiers
+WRITE_BATCH_SIZE = 1000
+
 class CidStore:
     def __init__(self, db_connect_str):
         self._prepare_database(db_connect_str)
@@ -41,22 +48,129 @@ class CidStore:
             results['matched_cid'] = record.cid
         return results
 
+    def find_cids(self, data_type, identifiers):
+        """Find the CIDs of a list of identifiers of the same type in one query.
+        Returns:
+            A dict with key=identifier, value=cid for the identifiers found.
+        """
+        if not identifiers:
+            return {}
+        query = self.session.query(self.tablename).filter(self.tablename.type==data_type).filter(self.tablename.identifier.in_(list(identifiers)))
+        return {record.identifier: record.cid for record in query.all()}
+
+    def write_identifiers(self, rows):
+        """Write a list of (data_type, identifier, cid) rows in one transaction.
+           The current CIDs of the identifiers are looked up with one query per data type.
+           Rows that are already in the table are skipped; the others are inserted or updated with
+           INSERT ... ON DUPLICATE KEY UPDATE statements (INSERT ... ON CONFLICT on SQLite).
+           When an identifier is listed more than once, the last row wins.
+        Returns: number of rows inserted or updated, None when the write failed.
+        """
+        latest = {}
+        for data_type, identifier, cid in rows:
+            latest.pop((data_type, identifier), None)
+            latest[(data_type, identifier)] = cid
+
+        current = {}
+        for data_type in dict.fromkeys(data_type for data_type, identifier in latest):
+            identifiers = [identifier for (a_type, identifier) in latest if a_type == data_type]
+            for identifier, cid in self.find_cids(data_type, identifiers).items():
+                current[(data_type, identifier)] = cid
+
+        values = []
+        unchanged = updated = 0
+        for (data_type, identifier), cid in latest.items():
+            if current.get((data_type, identifier)) == cid:
+                unchanged += 1
+                continue
+            if (data_type, identifier) in current:
+                updated += 1
+            values.append({"type": data_type, "identifier": identifier, "cid": cid})
+
+        try:
+            for start in range(0, len(values), WRITE_BATCH_SIZE):
+                self._upsert(values[start:start + WRITE_BATCH_SIZE])
+        except Exception:
+            self.session.rollback()
+            logger.error("Database Error: failed to write records")
+            logger.info("records: %s", values)
+            return None
+        else:
+            self.session.commit()
+        if unchanged:
+            logger.debug("Local minter: Record exists. No need to update (%d records)", unchanged)
+        if updated:
+            logger.debug("Local minter: Updated an exsiting record (%d records)", updated)
+        if len(values) > updated:
+            logger.debug("Local minter: Inserted a new record (%d records)", len(values) - updated)
+        return len(values)
+
+    def claim_identifiers(self, rows):
+        """Write a list of (data_type, identifier, cid) rows for a new CID, keeping the CIDs of
+           identifiers that are already in the table, and read back the stored CIDs.
+           The rows are inserted with INSERT ... ON DUPLICATE KEY UPDATE cid = cid (INSERT ... ON CONFLICT
+           DO NOTHING on SQLite) and committed before the read, so when processes claim the same
+           identifier at the same time they all get the CID of the first one.
+        Returns: dict with key=(data_type, identifier), value=stored cid.
+        Raises: the database error when the write failed.
+        """
+        values = [{"type": data_type, "identifier": identifier, "cid": cid} for data_type, identifier, cid in rows]
+        if not values:
+            return {}
+        if self.engine.dialect.name == "mysql":
+            stmt = text("INSERT INTO cid_minting_store (type, identifier, cid) VALUES (:type, :identifier, :cid) "
+                    "ON DUPLICATE KEY UPDATE cid = cid")
+        else:
+            stmt = text("INSERT INTO cid_minting_store (type, identifier, cid) VALUES (:type, :identifier, :cid) "
+                    "ON CONFLICT (type, identifier) DO NOTHING")
+        try:
+            self.session.execute(stmt, values)
+        except Exception:
+            self.session.rollback()
+            logger.error("Database Error: failed to claim records")
+            logger.info("records: %s", values)
+            raise
+        else:
+            self.session.commit()
+
+        stored = {}
+        for data_type in dict.fromkeys(value["type"] for value in values):
+            identifiers = [value["identifier"] for value in values if value["type"] == data_type]
+            for identifier, cid in self.find_cids(data_type, identifiers).items():
+                stored[(data_type, identifier)] = cid
+        inserted = sum(1 for value in values if stored.get((value["type"], value["identifier"])) == value["cid"])
+        if inserted:
+            logger.debug("Local minter: Inserted a new record (%d records)", inserted)
+        return stored
+
+    def _upsert(self, values):
+        if not values:
+            return
+        if self.engine.dialect.name == "mysql":
+            stmt = mysql_insert(self.tablename.__table__).values(values)
+            stmt = stmt.on_duplicate_key_update(cid=stmt.inserted.cid)
+            self.session.execute(stmt)
+        else:
+            stmt = text("INSERT INTO cid_minting_store (type, identifier, cid) VALUES (:type, :identifier, :cid) "
+                    "ON CONFLICT (type, identifier) DO UPDATE SET cid = excluded.cid")
+            self.session.execute(stmt, values)
+
     def write_identifier(self, data_type, identifier, cid):
         record = self.tablename(type=data_type, identifier=identifier, cid=cid)
         if self._find_record(record):
             msg = "Local minter: Record exists. No need to update"
-            logging.info(msg)
+            logger.debug(msg)
             return msg 
 
         if self._find_record_by_identifier(data_type, identifier):
             if self._update_a_record(record):
                 msg = "Local minter: Updated an exsiting record"
-                logging.info(msg)
+                logger.debug(msg)
                 return msg
         
         if self._insert_a_record(record):
             msg = "Local minter: Inserted a new record"
-            logging.info(msg)
+            logger.debug(msg)
             return msg 
 
         return None
@@ -99,8 +213,8 @@ class CidStore:
             ret = 1
         except Exception as e:
             self.session.rollback()
-            logging.error("Database Error: failed to insert a record")
-            logging.info("type: {}, value: {}, cid: {} ".format(record.type, record.identifier, record.cid))
+            logger.error("Database Error: failed to insert a record")
+            logger.info("type: %s, value: %s, cid: %s ", record.type, record.identifier, record.cid)
         else:
             self.session.commit()
         return ret
@@ -113,8 +227,8 @@ class CidStore:
             ret = self.session.query(self.tablename).filter(self.tablename.type == record.type, self.tablename.identifier == record.identifier).update({self.tablename.cid: record.cid}, synchronize_session=False)
         except Exception as e:
             self.session.rollback()
-            logging.error("Database Error: failed to update a record")
-            logging.info("type: {}, value: {}, cid: {} ".format(record.type, record.identifier, record.cid))
+            logger.error("Database Error: failed to update a record")
+            logger.info("type: %s, value: %s, cid: %s ", record.type, record.identifier, record.cid)
         else:
             self.session.commit()
         return ret
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+
+# Array files written by zephir-resolve/create_concordance_arrays.py
+OCNS = "ocns.npy"
+PRIMARIES = "primaries.npy"
+CLUSTER_PRIMARIES = "cluster_primaries.npy"
+CLUSTER_OFFSETS = "cluster_offsets.npy"
+CLUSTER_OCNS = "cluster_ocns.npy"
+
+class SortedArrayConcordance:
+    """The OCLC Concordance Table in the sorted-array format.
+
+    The concordance is stored as flat uint64 arrays (see zephir-resolve/create_concordance_arrays.py):
+        ocns, primaries: every OCN and its primary OCN, sorted by OCN
+        cluster_primaries: primary OCNs with previous OCNs, sorted
+        cluster_offsets: start and end of each primary's previous OCNs in cluster_ocns
+        cluster_ocns: previous OCNs grouped by primary OCN
+
+    The arrays are memory mapped read-only, so opening the concordance costs next to nothing
+    and parallel minter processes share the same pages in the OS page cache.
+    Lookups are vectorized binary searches over the sorted arrays.
+
+    Args:
+        arrays_path: directory of the concordance array files
+    """
+    def __init__(self, arrays_path):
+        self.arrays_path = arrays_path
+        self._ocns = self._load(OCNS)
+        self._primaries = self._load(PRIMARIES)
+        self._cluster_primaries = self._load(CLUSTER_PRIMARIES)
+        self._cluster_offsets = self._load(CLUSTER_OFFSETS)
+        self._cluster_ocns = self._load(CLUSTER_OCNS)
+
+    def _load(self, filename):
+        return np.load(os.path.join(self.arrays_path, filename), mmap_mode="r")
+
+    def get_primary_ocns(self, ocns):
+        """Gets the primary OCNs for a list of OCNs.
+        Returns:
+            A dict with key=ocn, value=primary ocn for the OCNs found in the concordance.
+        """
+        keys, idx = self._search(self._ocns, ocns)
+        primaries = self._primaries[idx]
+        return dict(zip(keys.tolist(), primaries.tolist()))
+
+    def get_ocns_clusters_by_primary_ocns(self, primary_ocns):
+        """Gets the previous OCNs of the oclc clusters for a list of primary OCNs.
+        Returns:
+            A dict with key=primary ocn, value=list of previous OCNs in the cluster.
+            Primary OCNs without previous OCNs are not included.
+        """
+        keys, idx = self._search(self._cluster_primaries, primary_ocns)
+        starts = self._cluster_offsets[idx].tolist()
+        ends = self._cluster_offsets[idx + 1].tolist()
+        clusters = {}
+        for key, start, end in zip(keys.tolist(), starts, ends):
+            clusters[key] = self._cluster_ocns[start:end].tolist()
+        return clusters
+
+    def _search(self, sorted_keys, values):
+        """Binary search of values in sorted_keys.
+        Returns:
+            The values found and their positions in sorted_keys, as numpy arrays.
+        """
+        keys = np.fromiter(sorted(set(value for value in values if value and value > 0)), dtype=np.uint64)
+        idx = np.searchsorted(sorted_keys, keys)
+        in_range = idx < len(sorted_keys)
+        keys = keys[in_range]
+        idx = idx[in_range]
+        found = sorted_keys[idx] == keys
+        return keys[found], idx[found]
+
+    def close(self):
+        self._ocns = None
+        self._primaries = None
+        self._cluster_primaries = None
+        self._cluster_offsets = None
+        self._cluster_ocns = None
@@ -0,0 +1,164 @@
+from cid_minter.zephir_cluster_lookup import compile_zephir_clusters
+
+class PrefetchedZephirDatabase:
+    """Zephir database lookups for a batch of records, answered from a few bulk queries.
+
+    Provides the ZephirDatabase lookups used by CidMinter. The current CIDs of all htids,
+    the clusters of all OCNs, the clusters of all contribsys IDs and the contribsys IDs of
+    those clusters are each fetched with one query when the batch is set up.
+    Each lookup then filters the prefetched rows, which gives the same rows as the
+    per record query. The rows are indexed by ID, so a lookup only reads the rows of its IDs.
+    Lookups outside the prefetched IDs, or whose bulk query failed, go to the database.
+
+    Args:
+        zephir_db: ZephirDatabase
+        htids: htids of the records
+        ocns: OCNs (integers) used to query Zephir clusters
+        sysids: contribsys IDs and previous contribsys IDs of the records
+    """
+    def __init__(self, zephir_db, htids, ocns, sysids):
+        self._zephir_db = zephir_db
+
+        self._htids = set(htids)
+        self._cids_by_htid = None
+        rows = zephir_db.find_cids_by_htids(sorted(self._htids)) if self._htids else []
+        if rows is not None:
+            self._cids_by_htid = {}
+            for row in rows:
+                self._cids_by_htid.setdefault(row.get("id"), []).append({"cid": row.get("cid")})
+
+        self._ocns = set(str(ocn) for ocn in ocns)
+        self._cid_ocn_list = zephir_db.find_zephir_clusters_with_all_ocns_by_ocns(sorted(set(ocns))) if ocns else []
+        self._cids_by_ocn = index_rows(self._cid_ocn_list, "ocn")
+        self._cid_ocn_rows_by_cid = index_rows(self._cid_ocn_list, "cid")
+
+        self._sysids = set(sysids)
+        self._cid_sysid_list = zephir_db.find_zephir_clusters_by_contribsys_ids(sorted(self._sysids)) if sysids else []
+        self._cid_sysid_rows_by_sysid = index_rows(self._cid_sysid_list, "contribsys_id")
+
+        self._cluster_cids = set(row.get("cid") for row in self._cid_sysid_list or [])
+        self._cluster_sysid_list = []
+        if self._cluster_cids:
+            self._cluster_sysid_list = zephir_db.find_zephir_clusters_and_contribsys_ids_by_cid(sorted(self._cluster_cids))
+        self._cluster_sysid_rows_by_cid = index_rows(self._cluster_sysid_list, "cid")
+
+    def find_cid_by_htid(self, id):
+        if self._cids_by_htid is None or id not in self._htids:
+            return self._zephir_db.find_cid_by_htid(id)
+        return self._cids_by_htid.get(id, [])
+
+    def zephir_clusters_lookup(self, ocns_list):
+        inquiry_ocns = set(str(ocn) for ocn in ocns_list)
+        if self._cid_ocn_list is None or not inquiry_ocns.issubset(self._ocns):
+            return self._zephir_db.zephir_clusters_lookup(ocns_list)
+        cids = set(row.get("cid") for _, row in lookup_rows(self._cids_by_ocn, inquiry_ocns))
+        cid_ocn_list = [row for _, row in lookup_rows(self._cid_ocn_rows_by_cid, cids)]
+        return compile_zephir_clusters(ocns_list, cid_ocn_list)
+
+    def find_zephir_clusters_by_contribsys_ids(self, contribsys_id_list):
+        if not contribsys_id_list:
+            return None
+        sysids = set(contribsys_id_list)
+        if self._cid_sysid_list is None or not sysids.issubset(self._sysids):
+            return self._zephir_db.find_zephir_clusters_by_contribsys_ids(contribsys_id_list)
+        return [row for _, row in lookup_rows(self._cid_sysid_rows_by_sysid, sysids)]
+
+    def find_zephir_clusters_and_contribsys_ids_by_cid(self, cid_list):
+        if not cid_list:
+            return None
+        cids = set(cid_list)
+        if self._cluster_sysid_list is None or not cids.issubset(self._cluster_cids):
+            return self._zephir_db.find_zephir_clusters_and_contribsys_ids_by_cid(cid_list)
+        return [row for _, row in lookup_rows(self._cluster_sysid_rows_by_cid, cids)]
+
+def index_rows(rows, key):
+    """Index query result rows by the value of a column.
+    Returns: dict with key=column value, value=list of (row number, row), None when rows is None.
+    """
+    if rows is None:
+        return None
+    index = {}
+    for number, row in enumerate(rows):
+        index.setdefault(row.get(key), []).append((number, row))
+    return index
+
+def lookup_rows(index, values):
+    """Rows of an index_rows index for a set of values, in query result order."""
+    return sorted((item for value in values for item in index.get(value, [])), key=lambda item: item[0])
+
+
+class BufferedCidStore:
+    """Local minter lookups and updates for a batch of records.
+
+    Provides the CidStore lookups and updates used by CidMinter. The CIDs of all identifiers
+    in the batch are fetched with one query per data type when the batch is set up.
+    Updates are applied to the fetched CIDs right away, so later records in the batch see
+    the CIDs assigned to earlier ones, and are written to the database by flush().
+    Identifiers claimed for a new CID are written to the database right away.
+
+    Args:
+        cid_store: CidStore
+        identifiers: dict with key=data type ("ocn" or "sysid"), value=list of identifiers
+    """
+    def __init__(self, cid_store, identifiers):
+        self._cid_store = cid_store
+        self._cids = {}
+        self._known = set()
+        self._updates = {}
+        for data_type, values in identifiers.items():
+            values = sorted(set(values))
+            for identifier, cid in cid_store.find_cids(data_type, values).items():
+                self._cids[(data_type, identifier)] = cid
+            self._known.update((data_type, value) for value in values)
+
+    def find_cid(self, data_type, identifier):
+        key = (data_type, identifier)
+        if key not in self._known:
+            return self._cid_store.find_cid(data_type, identifier)
+        results = {}
+        if key in self._cids:
+            results['data_type'] = data_type
+            results['inquiry_identifier'] = identifier
+            results['matched_cid'] = self._cids[key]
+        return results
+
+    def find_cids(self, data_type, identifiers):
+        results = {}
+        unknown = []
+        for identifier in identifiers:
+            key = (data_type, identifier)
+            if key not in self._known:
+                unknown.append(identifier)
+            elif key in self._cids:
+                results[identifier] = self._cids[key]
+        if unknown:
+            results.update(self._cid_store.find_cids(data_type, unknown))
+        return results
+
+    def write_identifiers(self, rows):
+        for data_type, identifier, cid in rows:
+            self.write_identifier(data_type, identifier, cid)
+
+    def write_identifier(self, data_type, identifier, cid):
+        key = (data_type, identifier)
+        self._known.add(key)
+        self._cids[key] = cid
+        self._updates.pop(key, None)
+        self._updates[key] = cid
+
+    def claim_identifiers(self, rows):
+        """Claim identifiers for a new CID in the local minter right away, see CidStore.claim_identifiers."""
+        stored = self._cid_store.claim_identifiers(rows)
+        for key, cid in stored.items():
+            self._known.add(key)
+            self._cids[key] = cid
+        return stored
+
+    def flush(self):
+        """Write the updates to the local minter.
+        Raises: RuntimeError when the write failed, so the CIDs of the batch are not used.
+        """
+        rows = [(data_type, identifier, cid) for (data_type, identifier), cid in self._updates.items()]
+        self._updates = {}
+        if rows and self._cid_store.write_identifiers(rows) is None:
+            raise RuntimeError(f"Local minter error: failed to write {len(rows)} identifiers")
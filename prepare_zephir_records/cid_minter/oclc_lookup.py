@@ -1,5 +1,6 @@
 import sys
 import os
+from collections import OrderedDict
 
 import environs
 import msgpack
@@ -13,6 +14,44 @@ def int_to_bytes(inum):
 def int_from_bytes(bnum):
     return int.from_bytes(bnum, 'big')
 
+# marks a key that is not in a LookupCache
+_NOT_CACHED = object()
+
+# LevelDB handles shared by all lookups in this process, keyed by normalized db path
+_leveldb_handles = {}
+
+def open_leveldb(db_path):
+    """Returns the shared LevelDB handle for db_path, opening the database on first use.
+
+    LevelDB takes an exclusive lock on the database directory, and opening it reads the manifest
+    and warms up the table cache. Keeping one handle per database for the life of the process
+    avoids paying that cost on every lookup. The concordance databases are only read here.
+
+    Args:
+        db_path: Path to a LevelDB database.
+
+    Returns:
+        An open plyvel.DB object.
+    """
+    key = os.path.normpath(db_path)
+    db = _leveldb_handles.get(key)
+    if db is None or db.closed:
+        db = plyvel.DB(db_path, create_if_missing=True)
+        _leveldb_handles[key] = db
+    return db
+
+def close_leveldb(db_path=None):
+    """Closes the shared LevelDB handle for db_path, or all shared handles when db_path is None.
+    """
+    if db_path is None:
+        keys = list(_leveldb_handles)
+    else:
+        keys = [os.path.normpath(db_path)]
+    for key in keys:
+        db = _leveldb_handles.pop(key, None)
+        if db is not None and not db.closed:
+            db.close()
+
 def get_primary_ocn(ocn, db_path="primary-lookup"):
     """Gets the primary oclc number for a given oclc number.
 
@@ -28,16 +67,7 @@ def get_primary_ocn(ocn, db_path="primary-lookup"):
         An integer representing the primary oclc number for the given ocn;
         None if the given ocn has no matched key in the primary-lookup database.
     """
-    primary = None
-    if ocn:
-        try:
-            mdb = plyvel.DB(db_path, create_if_missing=True)
-            key = int_to_bytes(ocn)
-            if mdb.get(key):
-                primary = int_from_bytes(mdb.get(key))
-        finally:
-            mdb.close()
-    return primary
+    return get_primary_ocns([ocn], db_path).get(ocn)
 
 def get_ocns_cluster_by_primary_ocn(primary_ocn, db_path="cluster-lookup"):
     """Gets all OCNs of an oclc cluster by a primary OCN.
@@ -68,16 +98,7 @@ def get_ocns_cluster_by_primary_ocn(primary_ocn, db_path="cluster-lookup"):
             when primary_ocn=518119215, return: None
             when primary_ocn=1234567890, return: None
     """
-    cluster = None
-    if primary_ocn:
-        try:
-            cdb = plyvel.DB(db_path, create_if_missing=True)
-            key = int_to_bytes(primary_ocn)
-            if cdb.get(key):
-                cluster = msgpack.unpackb(cdb.get(key))
-        finally:
-            cdb.close()
-    return cluster
+    return get_ocns_clusters_by_primary_ocns([primary_ocn], db_path).get(primary_ocn)
 
 
 def get_ocns_cluster_by_ocn(ocn, primarydb_path="primary-lookup", clusterdb_path="cluster-lookup"):
@@ -102,16 +123,91 @@ def get_ocns_cluster_by_ocn(ocn, primarydb_path="primary-lookup", clusterdb_path
         when ocn=1000000000, return: [1000000000] (a cluster without previous OCNs)
         when ocn=1234567890, return: None (for an invalid ocn)
     """
+    return get_ocns_clusters_by_ocns([ocn], primarydb_path, clusterdb_path).get(ocn)
+
+def get_primary_ocns(ocns, db_path="primary-lookup"):
+    """Gets the primary oclc numbers for a list of oclc numbers.
+
+    Looks up all OCNs in one pass over a snapshot of the primary-lookup database.
+    Keys are read in their stored (byte) order so that neighbouring keys share LevelDB blocks,
+    and each key is read once.
+
+    Args:
+        ocns: An iterable of integers representing oclc numbers.
+
+    Returns:
+        A dict with key=ocn, value=primary ocn for the OCNs found in the primary-lookup database.
+        OCNs which are None, 0 or not in the database are not included.
+    """
+    primaries = {}
+    keys = sorted((int_to_bytes(ocn), ocn) for ocn in set(ocns) if ocn)
+    if not keys:
+        return primaries
+
+    with open_leveldb(db_path).snapshot() as snapshot:
+        for key, ocn in keys:
+            value = snapshot.get(key)
+            if value:
+                primaries[ocn] = int_from_bytes(value)
+    return primaries
+
+def get_ocns_clusters_by_primary_ocns(primary_ocns, db_path="cluster-lookup"):
+    """Gets the previous OCNs of the oclc clusters for a list of primary OCNs.
+
+    Looks up all primary OCNs in one sorted pass over a snapshot of the cluster-lookup database.
+
+    Args:
+        primary_ocns: An iterable of integers representing primary OCNs.
+
+    Returns:
+        A dict with key=primary ocn, value=list of previous OCNs in the cluster.
+        Primary OCNs without previous OCNs are not included (see get_ocns_cluster_by_primary_ocn).
+    """
+    clusters = {}
+    keys = sorted((int_to_bytes(ocn), ocn) for ocn in set(primary_ocns) if ocn)
+    if not keys:
+        return clusters
+
+    with open_leveldb(db_path).snapshot() as snapshot:
+        for key, ocn in keys:
+            value = snapshot.get(key)
+            if value:
+                clusters[ocn] = msgpack.unpackb(value)
+    return clusters
+
+def get_ocns_clusters_by_ocns(ocns, primarydb_path="primary-lookup", clusterdb_path="cluster-lookup"):
+    """Gets the oclc clusters for a list of OCNs.
+
+    Resolves all OCNs to their primary OCNs first, then reads the clusters of the distinct primary OCNs.
+
+    Args:
+        ocns: An iterable of integers representing OCNs.
+
+    Returns:
+        A dict with key=ocn, value=list of integers representing the OCN cluster the ocn belongs to,
+        in the format of [previous_OCN(s), primary_OCN] (see get_ocns_cluster_by_ocn).
+        OCNs which do not belong to any oclc cluster are not included.
+
+        For example:
+        when ocns=[1, 4, 1234567890],
+        return: {1: [433981287, 6567842, 53095235, 9987701, 1], 4: [518119215, 4]}
+    """
+    primaries = get_primary_ocns(ocns, primarydb_path)
+    previous_ocns = get_ocns_clusters_by_primary_ocns(primaries.values(), clusterdb_path)
+    return merge_primary_and_previous_ocns(primaries, previous_ocns)
 
-    cluster = None
-    primary = get_primary_ocn(ocn, primarydb_path)
-    if primary:
-        cluster = get_ocns_cluster_by_primary_ocn(primary, clusterdb_path)
-        if cluster:
-            cluster.append(primary)
-        else:
-            cluster = [primary]
-    return cluster
+def merge_primary_and_previous_ocns(primaries, previous_ocns):
+    """Builds the OCN cluster of each OCN from its primary OCN and the previous OCNs of the primary.
+    Args:
+        primaries: dict with key=ocn, value=primary ocn
+        previous_ocns: dict with key=primary ocn, value=list of previous ocns
+    Returns:
+        A dict with key=ocn, value=list of OCNs in the format of [previous_OCN(s), primary_OCN]
+    """
+    clusters = {}
+    for ocn, primary in primaries.items():
+        clusters[ocn] = previous_ocns.get(primary, []) + [primary]
+    return clusters
 
 def get_clusters_by_ocns(ocns, primarydb_path="primary-lookup", clusterdb_path="cluster-lookup"):
     """Finds the OCN clusters for a list of OCNs.
@@ -138,15 +234,11 @@ def get_clusters_by_ocns(ocns, primarydb_path="primary-lookup", clusterdb_path="
 
     Note: Returning set of tuples makes unit tests easier.
     """
-    clusters = []
-    for ocn in ocns:
-        cluster = get_ocns_cluster_by_ocn(ocn, primarydb_path, clusterdb_path)
-        if cluster:
-            clusters.append(cluster)
+    clusters = get_ocns_clusters_by_ocns(ocns, primarydb_path, clusterdb_path)
+    return dedup_clusters(clusters.values())
 
-    # dedup
-    deduped_cluster = set([tuple(sorted(i)) for i in clusters])
-    return deduped_cluster
+def dedup_clusters(clusters):
+    return set([tuple(sorted(i)) for i in clusters])
 
 def convert_set_to_list(set_of_tuples):
     list_of_tuples = list(set_of_tuples)
@@ -169,7 +261,9 @@ def lookup_ocns_from_oclc(ocns, primary_db_path, cluster_db_path ):
     # oclc lookup by a list of OCNs in integer
     # returns: A Set of tuples containing OCNs of resolved OCN clusters
     set_of_tuples = get_clusters_by_ocns(ocns, primary_db_path, cluster_db_path)
+    return format_oclc_lookup_result(ocns, set_of_tuples)
 
+def format_oclc_lookup_result(ocns, set_of_tuples):
     # convert to a list of OCNs lists
     oclc_ocns_list = convert_set_to_list(set_of_tuples)
 
@@ -181,6 +275,180 @@ def lookup_ocns_from_oclc(ocns, primary_db_path, cluster_db_path ):
     }
     return oclc_lookup_result
 
+class LookupCache:
+    """A bounded least recently used cache for concordance lookups.
+
+    Counts hits, misses and evictions. A maxsize of 0 turns the cache off.
+    """
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+class LevelDBConcordance:
+    """The OCLC Concordance Table in the primary-lookup and cluster-lookup LevelDB databases.
+
+    Args:
+        primary_db_path: full path to the OCNs primary LevelDB
+        cluster_db_path: full path to the OCNs cluster LevelDB
+    """
+    def __init__(self, primary_db_path="primary-lookup", cluster_db_path="cluster-lookup"):
+        self.primary_db_path = primary_db_path
+        self.cluster_db_path = cluster_db_path
+        open_leveldb(primary_db_path)
+        open_leveldb(cluster_db_path)
+
+    def get_primary_ocns(self, ocns):
+        return get_primary_ocns(ocns, self.primary_db_path)
+
+    def get_ocns_clusters_by_primary_ocns(self, primary_ocns):
+        return get_ocns_clusters_by_primary_ocns(primary_ocns, self.cluster_db_path)
+
+    def close(self):
+        close_leveldb(self.primary_db_path)
+        close_leveldb(self.cluster_db_path)
+
+class OclcConcordance:
+    """Lookups in the OCLC Concordance Table for the life of a CID minting run.
+
+    The concordance is read from a store: by default a LevelDBConcordance, which holds the
+    primary-lookup and cluster-lookup LevelDB databases open so that repeated lookups do not
+    reopen them. The handles are shared with the module level functions, so both can be used
+    in the same process against the same databases. Any object with get_primary_ocns,
+    get_ocns_clusters_by_primary_ocns and close methods can be used as the store, for example
+    a SortedArrayConcordance.
+
+    Primary OCNs and clusters are kept in LRU caches, so OCNs seen again in the same run
+    (serials, large government documents clusters) are not read from the store again.
+    OCNs not found in the concordance are cached as well. The caches are cleared when
+    the store changes.
+
+    Args:
+        primary_db_path: full path to the OCNs primary LevelDB
+        cluster_db_path: full path to the OCNs cluster LevelDB
+        cache_size: maximum number of entries in each cache, 0 turns caching off
+        store: concordance store to use instead of the LevelDB databases
+    """
+    DEFAULT_CACHE_SIZE = 100000
+
+    def __init__(self, primary_db_path="primary-lookup", cluster_db_path="cluster-lookup", cache_size=DEFAULT_CACHE_SIZE, store=None):
+        self._primary_cache = LookupCache(cache_size)
+        self._cluster_cache = LookupCache(cache_size)
+        self.store = store or LevelDBConcordance(primary_db_path, cluster_db_path)
+
+    @property
+    def store(self):
+        return self._store
+
+    @store.setter
+    def store(self, store):
+        self._store = store
+        self.clear_cache()
+
+    def clear_cache(self):
+        self._primary_cache.clear()
+        self._cluster_cache.clear()
+
+    def cache_stats(self):
+        return {
+            "primary": self._primary_cache.stats(),
+            "cluster": self._cluster_cache.stats(),
+        }
+
+    def get_primary_ocn(self, ocn):
+        return self.get_primary_ocns([ocn]).get(ocn)
+
+    def get_ocns_cluster_by_primary_ocn(self, primary_ocn):
+        cluster = self.get_ocns_clusters_by_primary_ocns([primary_ocn]).get(primary_ocn)
+        return list(cluster) if cluster else None
+
+    def get_ocns_cluster_by_ocn(self, ocn):
+        return self.get_ocns_clusters_by_ocns([ocn]).get(ocn)
+
+    def get_primary_ocns(self, ocns):
+        return self._cached_lookup(ocns, self._primary_cache, self.store.get_primary_ocns)
+
+    def get_ocns_clusters_by_primary_ocns(self, primary_ocns):
+        return self._cached_lookup(primary_ocns, self._cluster_cache, self.store.get_ocns_clusters_by_primary_ocns)
+
+    def get_ocns_clusters_by_ocns(self, ocns):
+        primaries = self.get_primary_ocns(ocns)
+        previous_ocns = self.get_ocns_clusters_by_primary_ocns(primaries.values())
+        return merge_primary_and_previous_ocns(primaries, previous_ocns)
+
+    def get_clusters_by_ocns(self, ocns):
+        return dedup_clusters(self.get_ocns_clusters_by_ocns(ocns).values())
+
+    def lookup_ocns_from_oclc(self, ocns):
+        return format_oclc_lookup_result(ocns, self.get_clusters_by_ocns(ocns))
+
+    def _cached_lookup(self, keys, cache, lookup):
+        """Returns lookup results for keys from the cache, looking up the keys not in the cache
+        in one batch and caching their results, including the keys that were not found.
+        """
+        results = {}
+        not_cached = set()
+        for key in set(keys):
+            if not key:
+                continue
+            value = cache.get(key, _NOT_CACHED)
+            if value is _NOT_CACHED:
+                not_cached.add(key)
+            elif value is not None:
+                results[key] = value
+
+        if not_cached:
+            found = lookup(not_cached)
+            for key in not_cached:
+                cache.put(key, found.get(key))
+            results.update(found)
+        return results
+
+    def close(self):
+        self.store.close()
+        self.clear_cache()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 def tests():
     clusters_raw = {'1': [6567842, 9987701, 53095235, 433981287],
             '1000000000': None,
@@ -11,6 +11,7 @@ from cid_minter.cid_minter import CidMinter
 
 from cid_minter.zephir_cluster_lookup import ZephirDatabase
 from cid_minter.cid_store import CidStore
+from cid_minter.minting_batch import PrefetchedZephirDatabase
 from cid_minter.oclc_lookup import get_ocns_cluster_by_ocn
 
 from cid_minter.cid_inquiry_by_ocns import cid_inquiry_by_ocns
@@ -72,6 +73,18 @@ def test_step_0_1(caplog, setup_configs):
     cid = cid_minter.mint_cid(input_ids)
     assert "Found current CID: 009705704 by htid: hvd.hw5jdo" in caplog.text
 
+def test_record_summary_log(caplog, setup_configs):
+    """At INFO the minter logs one summary line per record, the minting steps only at DEBUG.
+    """
+    caplog.set_level(logging.INFO)
+    cid_minter = CidMinter(setup_configs)
+
+    cid = cid_minter.mint_cid({"ocns": "80274381,25231018", "htid": "hvd.hw5jdo"})
+    assert cid == "009705704"
+    assert "Record hvd.hw5jdo: CID 009705704 by OCLC number(s) (current CID: 009705704)" in caplog.text
+    assert "Find current CID by htid" not in caplog.text
+    assert "Minting results from Zephir by OCNs" not in caplog.text
+
 def test_step_0_2(caplog, setup_configs):
     """Step 0: find record's current CID if exists 
     """
@@ -978,6 +991,130 @@ def test_step_3_b_3(caplog, setup_configs):
     minter_new = results[0].get("cid")
     assert int(minter_new) == int(minter) + 1
 
+def test_mint_cids(caplog, setup_configs, data_dir):
+    """Minting a batch gives the same CIDs, ZED events and local minter updates
+       as minting the records one by one.
+    """
+    caplog.set_level(logging.DEBUG)
+
+    batch = [
+        {"ocns": "8727632", "htid": "test.1234567890_1b1"},
+        {"ocns": "1234567890", "htid": "test.batch.1"},
+        # shares a new OCN with the record above
+        {"ocns": "1234567890,1234567891", "htid": "test.batch.2"},
+        {"ocns": "80274381,25231018", "contribsys_ids": "hvd000012735", "htid": "hvd.hw5jdo"},
+        {"ocns": "80274381,25231018,30461866", "htid": "hvd.hw5jdo"},
+        {"contribsys_ids": "pur215476,pur1234567", "htid": "test.2a1"},
+        {"contribsys_ids": "hvd000012735,nrlf.b100608668", "htid": "hvd.hw5jdo"},
+        {"contribsys_ids": "test.2b41234", "previous_contribsys_ids": "prev.1234", "htid": "test.2b4"},
+        # shares a new contribsys ID with the record above
+        {"contribsys_ids": "test.2b41234", "htid": "test.batch.3"},
+        {"contribsys_ids": "test.12345", "previous_contribsys_ids": "pur215476,pur.215476", "htid": "hvd.hw5jdo"},
+        # fails: previous contribsys ID matches more than one CID
+        {"contribsys_ids": "test.batch.4", "previous_contribsys_ids": "acme.992222222", "htid": "test.batch.4"},
+        {"contribsys_ids": "test.12345", "previous_contribsys_ids": "acme.b2222222", "htid": "test.12345"},
+        # fails: missing htid
+        {"ocns": "8727632"},
+    ]
+    zed_event_data = [{"object": ids.get("htid"), "ids": ids} for ids in batch]
+
+    def mint_one_by_one(cid_minter):
+        cids = []
+        for ids, event_data in zip(batch, zed_event_data):
+            cid_minter.cid_zed_event.setup_zed_event_data(event_data)
+            try:
+                cids.append(cid_minter.mint_cid(ids))
+            except Exception:
+                cids.append(None)
+        return cids
+
+    def mint_batch(cid_minter):
+        return cid_minter.mint_cids(batch, zed_event_data)
+
+    expected = mint_and_collect_results(setup_configs, mint_one_by_one)
+    assert expected["cids"][1] == expected["cids"][2]
+    assert expected["cids"][7] == expected["cids"][8]
+    assert expected["cids"][10] is None
+    assert expected["cids"][12] is None
+
+    reset_databases(data_dir)
+    assert mint_and_collect_results(setup_configs, mint_batch) == expected
+
+def test_mint_cids_write_failed(setup_configs):
+    """A batch fails when its local minter updates cannot be written."""
+    batch = [
+        {"ocns": "8727632", "htid": "test.1234567890_1b1"},
+        {"ocns": "1234567890", "htid": "test.batch.1"},
+    ]
+    cid_minter = CidMinter(setup_configs)
+    cid_minter._minter_db.write_identifiers = lambda rows: None
+    with pytest.raises(RuntimeError, match="Local minter error"):
+        cid_minter.mint_cids(batch)
+    cid_minter.close()
+
+def test_prefetched_zephir_database(setup_zephir_db):
+    """Prefetched lookups give the rows of the per record queries without querying the database."""
+    zephirDb = ZephirDatabase(setup_zephir_db["zephirDb"])
+    htids = ["hvd.hw5jdo", "pur1.32754075735872", "test.not.in.zephir"]
+    ocns = [8727632, 80274381, 25231018, 30461866, 1234567890]
+    sysids = ["pur215476", "hvd000012735", "nrlf.b100608668", "test.not.in.zephir"]
+    prefetched = PrefetchedZephirDatabase(zephirDb, htids, ocns, sysids)
+
+    queries = []
+    def record_query(*args):
+        queries.append(args)
+        return []
+    zephirDb._get_query_results_by_ids = record_query
+    zephirDb._get_query_results = record_query
+
+    expected = ZephirDatabase(setup_zephir_db["zephirDb"])
+    for htid in htids:
+        assert prefetched.find_cid_by_htid(htid) == expected.find_cid_by_htid(htid)
+    for ocns_list in [[8727632], [80274381, 25231018, 30461866], [1234567890]]:
+        assert prefetched.zephir_clusters_lookup(ocns_list) == expected.zephir_clusters_lookup(ocns_list)
+    for sysid_list in [["pur215476"], ["hvd000012735", "nrlf.b100608668"], ["test.not.in.zephir"]]:
+        results = prefetched.find_zephir_clusters_by_contribsys_ids(sysid_list)
+        assert results == expected.find_zephir_clusters_by_contribsys_ids(sysid_list)
+        for row in results or []:
+            cids = [row.get("cid")]
+            assert prefetched.find_zephir_clusters_and_contribsys_ids_by_cid(cids) == expected.find_zephir_clusters_and_contribsys_ids_by_cid(cids)
+    assert queries == []
+    expected.close()
+
+    # IDs outside the batch go to the database
+    prefetched.find_zephir_clusters_by_contribsys_ids(["pur215476", "other.sysid"])
+    assert len(queries) == 1
+
+def mint_and_collect_results(config, mint):
+    """Mint CIDs with a new CidMinter and return the CIDs, ZED events, local minter records and current minter.
+    """
+    cid_minter = CidMinter(config)
+    cids = mint(cid_minter)
+    cid_minter.close()
+
+    with open(config["zed_log"]) as zed_log:
+        events = [json.loads(line) for line in zed_log]
+    events = [(event["status"], event["object"], event["report"]) for event in events]
+
+    local_minter = CidStore(config["minterdb_conn_str"])
+    records = sorted((record.type, record.identifier, record.cid) for record in local_minter._find_all())
+    local_minter.session.close()
+
+    zephirDb = ZephirDatabase(config["zephirdb_conn_str"])
+    minter = zephirDb._get_query_results("SELECT cid from cid_minter")
+    zephirDb.close()
+
+    return {
+        "cids": cids,
+        "events": events,
+        "local_minter": records,
+        "minter": minter,
+    }
+
+def reset_databases(data_dir):
+    for db_name, sql in [("test_db_for_zephir.db", "setup_zephir_test_db.sql"), ("test_minter_sqlite.db", "prepare_cid_minter_datasets.sql")]:
+        os.system("sqlite3 {} < {}".format(os.path.join(data_dir, db_name), os.path.join(data_dir, sql)))
+
 def verify_events(log, expected_events):
     """Verify listed events in caplog.
        Args:
@@ -292,3 +292,59 @@ def test_write_a_record(create_test_db):
     assert result == expected
 
 
+
+def test_find_cids(create_test_db):
+    db_conn_str = create_test_db['db_conn_str']
+    db = CidStore(db_conn_str)
+
+    assert db.find_cids("ocn", ["8727632", "32882115", "1234567890"]) == {
+        "8727632": "002492721",
+        "32882115": "011323405"}
+    assert db.find_cids("sysid", ["pur215476", "8727632"]) == {"pur215476": "002492721"}
+    assert db.find_cids("ocn", []) == {}
+
+def test_write_identifiers(caplog, create_test_db):
+    caplog.set_level(logging.DEBUG)
+    db_conn_str = create_test_db['db_conn_str']
+    db = CidStore(db_conn_str)
+
+    rows = [
+        ("ocn", "8727632", "002492721"),     # exists
+        ("sysid", "pur215476", "123456789"), # update
+        ("ocn", "1234567890", "100000001"),  # insert
+        ("ocn", "1234567891", "100000001"),  # insert, then update in the same batch
+        ("ocn", "1234567891", "100000002"),
+    ]
+    assert db.write_identifiers(rows) == 3
+    assert "Local minter: Record exists. No need to update" in caplog.text
+    assert "Local minter: Updated an exsiting record" in caplog.text
+    assert "Local minter: Inserted a new record" in caplog.text
+
+    assert db.find_cids("ocn", ["8727632", "1234567890", "1234567891"]) == {
+        "8727632": "002492721",
+        "1234567890": "100000001",
+        "1234567891": "100000002"}
+    assert db.find_cids("sysid", ["pur215476"]) == {"pur215476": "123456789"}
+    assert len(db._find_all()) == 7
+
+    # nothing to write
+    assert db.write_identifiers(rows[:1]) == 0
+    assert db.write_identifiers([]) == 0
+
+def test_claim_identifiers(create_test_db):
+    db_conn_str = create_test_db['db_conn_str']
+    db = CidStore(db_conn_str)
+
+    rows = [
+        ("ocn", "8727632", "100000001"),     # exists, keeps its CID
+        ("ocn", "1234567890", "100000001"),  # insert
+        ("sysid", "test.1234", "100000001"), # insert
+    ]
+    assert db.claim_identifiers(rows) == {
+        ("ocn", "8727632"): "002492721",
+        ("ocn", "1234567890"): "100000001",
+        ("sysid", "test.1234"): "100000001"}
+
+    # claimed by another process first
+    assert db.claim_identifiers([("ocn", "1234567890", "100000002")]) == {("ocn", "1234567890"): "100000001"}
+    assert db.claim_identifiers([]) == {}
@@ -1,6 +1,7 @@
 import os
 
 import msgpack
+import numpy as np
 import pytest
 import plyvel
 from click.testing import CliRunner
@@ -9,8 +10,17 @@ from cid_minter.oclc_lookup import get_primary_ocn
 from cid_minter.oclc_lookup import get_ocns_cluster_by_primary_ocn
 from cid_minter.oclc_lookup import get_ocns_cluster_by_ocn
 from cid_minter.oclc_lookup import get_clusters_by_ocns
+from cid_minter.oclc_lookup import get_primary_ocns
+from cid_minter.oclc_lookup import get_ocns_clusters_by_primary_ocns
+from cid_minter.oclc_lookup import get_ocns_clusters_by_ocns
 from cid_minter.oclc_lookup import convert_set_to_list
 from cid_minter.oclc_lookup import lookup_ocns_from_oclc
+from cid_minter.oclc_lookup import OclcConcordance
+from cid_minter.oclc_lookup import LookupCache
+from cid_minter.oclc_lookup import LevelDBConcordance
+from cid_minter.concordance_arrays import SortedArrayConcordance
+from cid_minter.oclc_lookup import open_leveldb
+from cid_minter.oclc_lookup import close_leveldb
 
 # TESTS
 def test_get_primary_ocn(setup):
@@ -150,6 +160,45 @@ def test_get_ocns_cluster_by_ocns_wthnull_cases(setup):
         result = get_clusters_by_ocns(ocns, primary_db_path, cluster_db_path)
         assert result == set()
 
+def test_get_primary_ocns(setup):
+    primary_db_path = setup["primary_db_path"]
+
+    input = list(setup["dfs"]["primary.csv"]["ocn"])
+    expect = dict(zip(input, setup["dfs"]["primary.csv"]["primary"]))
+    # add duplicates, invalid and null ocns
+    result = get_primary_ocns(input + input[:2] + [1234567890, 0, None], primary_db_path)
+    assert result == expect
+
+    assert get_primary_ocns([], primary_db_path) == {}
+    assert get_primary_ocns([None, 1234567890], primary_db_path) == {}
+
+def test_get_ocns_clusters_by_primary_ocns(setup):
+    cluster_db_path = setup["cluster_db_path"]
+
+    result = get_ocns_clusters_by_primary_ocns([1, 17216714, 1000000000, 6567842, None], cluster_db_path)
+    assert sorted(result) == [1, 17216714]
+    assert sorted(result[1]) == [6567842, 9987701, 53095235, 433981287]
+    assert result[17216714] == [535434196]
+
+def test_get_ocns_clusters_by_ocns(setup):
+    primary_db_path = setup["primary_db_path"]
+    cluster_db_path = setup["cluster_db_path"]
+
+    # ocns sorting differently as integers and as LevelDB keys
+    ocns = [433981287, 1, 6567842, 1000000000, 535434196, 1234567890, None]
+    result = get_ocns_clusters_by_ocns(ocns, primary_db_path, cluster_db_path)
+    assert sorted(result) == [1, 6567842, 433981287, 535434196, 1000000000]
+    for ocn in [1, 6567842, 433981287]:
+        assert sorted(result[ocn]) == [1, 6567842, 9987701, 53095235, 433981287]
+        # the primary ocn is the last item as in get_ocns_cluster_by_ocn
+        assert result[ocn][-1] == 1
+    assert result[535434196] == [535434196, 17216714]
+    assert result[1000000000] == [1000000000]
+
+    # each ocn gets its own list
+    result[1].append(0)
+    assert 0 not in result[6567842]
+
 def test_convert_set_to_list():
     input_sets = {
         "one_tuple_single_item": {(1000000000,)},
@@ -219,6 +268,109 @@ def test_lookup_ocns_from_oclc(setup):
         assert result["matched_oclc_clusters"] == expected[k]["matched_oclc_clusters"]
         assert result["num_of_matched_oclc_clusters"] == expected[k]["num_of_matched_oclc_clusters"]
 
+def test_open_leveldb_shares_handle(setup):
+    primary_db_path = setup["primary_db_path"]
+
+    db = open_leveldb(primary_db_path)
+    assert open_leveldb(primary_db_path) is db
+    # trailing separator resolves to the same database
+    assert open_leveldb(primary_db_path.rstrip("/")) is db
+
+    close_leveldb(primary_db_path)
+    assert db.closed
+    new_db = open_leveldb(primary_db_path)
+    assert new_db is not db
+    assert not new_db.closed
+    close_leveldb()
+    assert new_db.closed
+
+def test_oclc_concordance(setup):
+    primary_db_path = setup["primary_db_path"]
+    cluster_db_path = setup["cluster_db_path"]
+
+    with OclcConcordance(primary_db_path, cluster_db_path) as concordance:
+        assert concordance.get_primary_ocn(6567842) == 1
+        assert sorted(concordance.get_ocns_cluster_by_primary_ocn(1)) == [6567842, 9987701, 53095235, 433981287]
+        assert sorted(concordance.get_ocns_cluster_by_ocn(6567842)) == [1, 6567842, 9987701, 53095235, 433981287]
+        assert concordance.get_clusters_by_ocns([6567842, 1234567890]) == {(1, 6567842, 9987701, 53095235, 433981287)}
+        # module level functions share the open databases
+        assert get_primary_ocn(6567842, primary_db_path) == 1
+
+        result = concordance.lookup_ocns_from_oclc([1000000000])
+        assert result["matched_oclc_clusters"] == [[1000000000]]
+        assert result["num_of_matched_oclc_clusters"] == 1
+
+    # databases can be opened by another handle after close
+    db = plyvel.DB(primary_db_path)
+    db.close()
+
+def test_lookup_cache():
+    cache = LookupCache(maxsize=2)
+    assert cache.get(1) is None
+    cache.put(1, "a")
+    cache.put(2, "b")
+    assert cache.get(1) == "a"
+    # 2 is the least recently used
+    cache.put(3, "c")
+    assert cache.get(2, "missing") == "missing"
+    assert cache.get(3) == "c"
+    assert cache.stats() == {"size": 2, "hits": 2, "misses": 2, "evictions": 1}
+
+    cache.clear()
+    assert len(cache) == 0
+
+    disabled = LookupCache(maxsize=0)
+    disabled.put(1, "a")
+    assert len(disabled) == 0
+
+def test_oclc_concordance_cache(setup):
+    primary_db_path = setup["primary_db_path"]
+    cluster_db_path = setup["cluster_db_path"]
+
+    concordance = OclcConcordance(primary_db_path, cluster_db_path, cache_size=10)
+    expected = [1, 6567842, 9987701, 53095235, 433981287]
+    assert sorted(concordance.get_ocns_cluster_by_ocn(6567842)) == expected
+    assert concordance.cache_stats()["primary"] == {"size": 1, "hits": 0, "misses": 1, "evictions": 0}
+    assert concordance.cache_stats()["cluster"] == {"size": 1, "hits": 0, "misses": 1, "evictions": 0}
+
+    # repeated and not found OCNs are answered from the cache
+    assert concordance.get_primary_ocn(1234567890) is None
+    assert sorted(concordance.get_ocns_cluster_by_ocn(6567842)) == expected
+    assert concordance.get_primary_ocn(1234567890) is None
+    stats = concordance.cache_stats()
+    assert stats["primary"] == {"size": 2, "hits": 2, "misses": 2, "evictions": 0}
+    assert stats["cluster"] == {"size": 1, "hits": 1, "misses": 1, "evictions": 0}
+
+    # changing the concordance store clears the caches
+    concordance.store = LevelDBConcordance(primary_db_path, cluster_db_path)
+    assert concordance.cache_stats()["primary"]["size"] == 0
+    assert concordance.cache_stats()["cluster"]["size"] == 0
+    concordance.close()
+
+def test_sorted_array_concordance(setup):
+    primary_db_path = setup["primary_db_path"]
+    cluster_db_path = setup["cluster_db_path"]
+    arrays_path = create_concordance_arrays(setup["tmpdatadir"], setup["dfs"]["primary.csv"])
+
+    store = SortedArrayConcordance(arrays_path)
+    leveldb_store = LevelDBConcordance(primary_db_path, cluster_db_path)
+
+    input = list(setup["dfs"]["primary.csv"]["ocn"]) + [1234567890, 0, None]
+    assert store.get_primary_ocns(input) == leveldb_store.get_primary_ocns(input)
+
+    primaries = list(setup["dfs"]["primary.csv"]["primary"]) + [6567842, 1234567890, None]
+    result = store.get_ocns_clusters_by_primary_ocns(primaries)
+    expected = leveldb_store.get_ocns_clusters_by_primary_ocns(primaries)
+    assert sorted(result) == sorted(expected)
+    for primary, cluster in result.items():
+        assert sorted(cluster) == sorted(expected[primary])
+    leveldb_store.close()
+
+    with OclcConcordance(store=store) as concordance:
+        assert sorted(concordance.get_ocns_cluster_by_ocn(6567842)) == [1, 6567842, 9987701, 53095235, 433981287]
+        assert concordance.get_ocns_cluster_by_ocn(1000000000) == [1000000000]
+        assert concordance.get_ocns_cluster_by_ocn(1234567890) is None
+
 # FIXTURES
 @pytest.fixture
 def setup(tmpdatadir, csv_to_df_loader):
@@ -311,3 +463,27 @@ def create_cluster_db(path, df):
         db.put(int_to_bytes(current_primary), packer.pack(cluster))
     db.close()
     return db_path
+
+def create_concordance_arrays(path, df):
+    """Create a sorted-array concordance with test data
+
+    Note:
+        1) Expects a dataframe: [ocn, primary]
+
+    Returns:
+        Path to the concordance arrays directory
+    """
+    arrays_path = os.path.join(path, "arrays/")
+    os.makedirs(arrays_path)
+
+    df = df.sort_values(by=["ocn"])
+    np.save(os.path.join(arrays_path, "ocns.npy"), df["ocn"].to_numpy(dtype=np.uint64))
+    np.save(os.path.join(arrays_path, "primaries.npy"), df["primary"].to_numpy(dtype=np.uint64))
+
+    previous = df[df["ocn"] != df["primary"]].sort_values(by=["primary", "ocn"])
+    cluster_primaries, counts = np.unique(previous["primary"].to_numpy(dtype=np.uint64), return_counts=True)
+    cluster_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.uint64)
+    np.save(os.path.join(arrays_path, "cluster_primaries.npy"), cluster_primaries)
+    np.save(os.path.join(arrays_path, "cluster_offsets.npy"), cluster_offsets)
+    np.save(os.path.join(arrays_path, "cluster_ocns.npy"), previous["ocn"].to_numpy(dtype=np.uint64))
+    return arrays_path
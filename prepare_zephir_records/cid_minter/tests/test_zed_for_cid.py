@@ -3,8 +3,12 @@ import sys
     
 import pytest
 import json
+from sqlalchemy import create_engine
 
 from cid_minter.zed_for_cid import CidZedEvent
+from cid_minter.zed_for_cid import ZedFileSink
+from cid_minter.zed_for_cid import ZedDatabaseSink
+from cid_minter.zed_for_cid import zed_event_row
 
 @pytest.fixture
 def setup_zed_msg_table(data_dir, tmpdir, scope="session"):
@@ -88,3 +92,93 @@ def test_zed_for_cid(caplog, setup_zed_msg_table):
             assert created_event == test_list[i].get("expected_event")
             i += 1
 
+
+def read_events(zed_log):
+    with open(zed_log) as f:
+        return [json.loads(line) for line in f]
+
+def test_zed_file_sink(tmpdir):
+    zed_log = os.path.join(tmpdir, "zed.log")
+    events = [{"event": str(i), "report": {"CID": "00000000" + str(i)}} for i in range(5)]
+
+    sink = ZedFileSink(zed_log, buffer_size=1024 * 1024, flush_interval=None)
+    for event in events:
+        sink.write(event)
+    assert read_events(zed_log) == []
+    sink.flush()
+    assert read_events(zed_log) == events
+    sink.write(events[0])
+    sink.close()
+    assert read_events(zed_log) == events + events[:1]
+
+    # write when the buffer is full
+    sink = ZedFileSink(zed_log, append=True, buffer_size=len(json.dumps(events[0])) * 2 + 2, flush_interval=None)
+    for event in events:
+        sink.write(event)
+    assert read_events(zed_log) == events + events[:1] + events[:4]
+    sink.close()
+    assert read_events(zed_log) == events + events[:1] + events
+
+    # write when the flush interval has passed
+    sink = ZedFileSink(zed_log, buffer_size=1024 * 1024, flush_interval=0, fsync=True)
+    sink.write(events[0])
+    assert read_events(zed_log) == events[:1]
+    sink.close()
+    sink.close()
+
+ZED_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "event": {"type": "string"},
+        "process": {"type": "string"},
+        "object": {"type": "string"},
+        "status": {"type": "object", "required": ["type", "zed_code", "msg_code"]},
+    },
+    "required": ["event", "process", "object", "status", "timestamp"]
+}
+
+def create_events_table(db_path):
+    engine = create_engine(f"sqlite:///{db_path}")
+    engine.execute("""CREATE TABLE events (id INTEGER PRIMARY KEY, event_key TEXT, process_key TEXT, topic TEXT, type TEXT,
+        action TEXT, subject TEXT, object TEXT, status_type TEXT, status_zed_code TEXT, status_msg_code TEXT,
+        status_msg TEXT, event_msg TEXT, timestamp TEXT)""")
+    return engine
+
+def test_zed_database_sink(tmpdir, setup_zed_msg_table):
+    engine = create_events_table(os.path.join(tmpdir, "events.db"))
+    zed_log = os.path.join(tmpdir, "zed.log")
+    sink = ZedDatabaseSink(f"sqlite:///{os.path.join(tmpdir, 'events.db')}", ZED_SCHEMA, ZedFileSink(zed_log),
+            batch_size=2, flush_interval=None)
+    zed_event = CidZedEvent(setup_zed_msg_table["msg_table"], sink=sink)
+
+    zed_event.setup_zed_event_data({"process_key": "92b1be8b-5fa0-44e5-9796-0a2ab3a4d5f0", "subject": "test.xml"})
+    events = []
+    for htid, msg_code in [("test.1", "pr0212"), ("test.2", "pr0213"), (None, "pr0213"), ("test.3", "pr0213")]:
+        zed_event.merge_zed_event_data({"object": htid, "report": {"CID": "123456789"}})
+        zed_event.create_zed_event(msg_code)
+        events.append(zed_event.zed_event)
+    # one batch inserted before close, the event without an object failed validation
+    assert engine.execute("select count(*) from events").scalar() == 2
+    zed_event.close()
+    assert read_events(zed_log) == events[2:3]
+
+    rows = engine.execute("select event_key, process_key, topic, type, action, subject, object, status_type, status_zed_code, "
+            "status_msg_code, status_msg, event_msg, timestamp from events order by id").fetchall()
+    assert [dict(row) for row in rows] == [zed_event_row(event) for event in events[:2] + events[3:]]
+    assert rows[0]["status_msg_code"] == "pr0212"
+    assert rows[0]["timestamp"] == events[0]["timestamp"][:23]
+    assert json.loads(rows[0]["event_msg"]) == events[0]
+    assert (sink.inserted, sink.failed) == (3, 1)
+
+def test_zed_database_sink_insert_error(tmpdir, caplog):
+    zed_log = os.path.join(tmpdir, "zed.log")
+    # no events table
+    sink = ZedDatabaseSink(f"sqlite:///{os.path.join(tmpdir, 'events.db')}", ZED_SCHEMA, ZedFileSink(zed_log))
+    events = [{"event": str(i), "process": "p", "object": "o", "status": {"type": "INFO", "zed_code": "200", "msg_code": "pr0212"},
+        "timestamp": "2022-05-11T12:00:00.1234"} for i in range(3)]
+    for event in events:
+        sink.write(event)
+    sink.close()
+    assert "ZED events insert error" in caplog.text
+    assert read_events(zed_log) == events
+    assert (sink.inserted, sink.failed) == (0, 3)
@@ -1,14 +1,17 @@
 import os
+import logging
 
 import pytest
 import environs
 
 from cid_minter.zephir_cluster_lookup import ZephirDatabase
 from cid_minter.zephir_cluster_lookup import CidMinterTable
+from cid_minter.zephir_cluster_lookup import CidBlockAllocator
 from cid_minter.zephir_cluster_lookup import valid_sql_in_clause_str
 from cid_minter.zephir_cluster_lookup import invalid_sql_in_clause_str
 from cid_minter.zephir_cluster_lookup import list_to_str
 from cid_minter.zephir_cluster_lookup import formatting_cid_id_clusters
+from cid_minter.zephir_cluster_lookup import engine_options
 
 @pytest.fixture
 def create_test_db(data_dir, tmpdir, scope="session"):
@@ -108,6 +111,42 @@ def test_find_zephir_cluster_by_cids(create_test_db):
         print(cid_ocn_list)
         assert cid_ocn_list == expected_cid_ocn_list[k]
 
+def test_find_zephir_cluster_by_ids_with_quotes(create_test_db):
+    """IDs are bound as parameters, so quotes in IDs are matched as they are
+    """
+    zephirDb = create_test_db
+    assert zephirDb.find_zephir_clusters_by_contribsys_ids(["acme.b'2222222", "a') or ('1'='1"]) == []
+    assert zephirDb.find_zephir_clusters_by_ocns(["8727632'"]) == []
+
+def test_engine_options():
+    assert engine_options("sqlite:///test.db") == {"pool_pre_ping": True}
+    assert engine_options("mysql://user:pw@localhost/zephir", pool_size=2, max_overflow=0, pool_recycle=60) == {
+        "pool_pre_ping": True,
+        "pool_size": 2,
+        "max_overflow": 0,
+        "pool_recycle": 60,
+    }
+
+def test_find_zephir_clusters_with_all_ocns_by_ocns(create_test_db):
+    """One query returns the same as the CIDs by OCNs and OCNs by CIDs queries
+    """
+    zephirDb = create_test_db
+    ocns_lists = [
+        [8727632],
+        [28477569],
+        [15437990, 5663662],
+        [25909, 123456789010],
+        [123456789010, 6758168, 28477569, 8727632, 217211158],
+        [123456789010],
+    ]
+    for ocns_list in ocns_lists:
+        cid_ocn_list = zephirDb.find_zephir_clusters_by_ocns(ocns_list)
+        cids_list = list(set([cid_ocn.get("cid") for cid_ocn in cid_ocn_list]))
+        expected = zephirDb.find_zephir_clusters_by_cids(cids_list) if cids_list else []
+        assert zephirDb.find_zephir_clusters_with_all_ocns_by_ocns(ocns_list) == expected
+
+    assert zephirDb.find_zephir_clusters_with_all_ocns_by_ocns([]) == None
+
 def test_find_zephir_cluster_by_contribsys_ids(create_test_db):
     """ the 'create_test_db' argument here is matched to the name of the
         fixture above
@@ -416,6 +455,41 @@ def test_update_cid_minter_table(create_test_db):
     result = cid_minter_table.get_cid()
     assert result.get("cid") == str(cid_init + 1)
 
+def test_reserve_and_release_cids(create_test_db):
+    zephirDb = create_test_db
+    cid_minter_table = CidMinterTable(zephirDb)
+    cid_init = 100000000
+
+    assert cid_minter_table.reserve_cids(10) == (cid_init + 1, cid_init + 10)
+    assert cid_minter_table.reserve_cids(5) == (cid_init + 11, cid_init + 15)
+    assert cid_minter_table.get_cid().get("cid") == str(cid_init + 15)
+
+    # only the last reserved block can be given back
+    assert cid_minter_table.release_cids(cid_init + 5, cid_init + 10) == False
+    assert cid_minter_table.release_cids(cid_init + 13, cid_init + 15) == True
+    assert cid_minter_table.get_cid().get("cid") == str(cid_init + 12)
+
+def test_cid_block_allocator(create_test_db, caplog):
+    caplog.set_level(logging.INFO)
+    zephirDb = create_test_db
+    cid_init = 100000000
+
+    allocator = CidBlockAllocator(CidMinterTable(zephirDb), block_size=3)
+    other_allocator = CidBlockAllocator(CidMinterTable(zephirDb), block_size=3)
+    assert allocator.unused_cids() == None
+    assert [allocator.next_cid() for i in range(4)] == [str(cid_init + i) for i in range(1, 5)]
+    assert other_allocator.next_cid() == str(cid_init + 7)
+    assert allocator.unused_cids() == (cid_init + 5, cid_init + 6)
+
+    # CIDs reserved after the block was: the unused CIDs are logged
+    allocator.close()
+    assert "Unused CIDs 100000005 to 100000006 were not returned" in caplog.text
+    assert allocator.unused_cids() == None
+
+    other_allocator.close()
+    assert "Returned unused CIDs 100000008 to 100000009" in caplog.text
+    assert CidMinterTable(zephirDb).get_cid().get("cid") == str(cid_init + 7)
+
 def test_list_to_str():
     input_list = {
         "1_item_int": [123],
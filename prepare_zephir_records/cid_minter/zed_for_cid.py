@@ -4,15 +4,178 @@ import sys
 from datetime import datetime
 import json
 from csv import DictReader
+import logging
+import time
 import uuid
 
+import jsonschema
+from sqlalchemy import create_engine
+from sqlalchemy import table, column
+from sqlalchemy.exc import SQLAlchemyError
+
+# bytes of events kept in memory before they are written to the ZED log
+ZED_LOG_BUFFER_SIZE = 1024 * 1024
+# longest time in seconds between two writes to the ZED log
+ZED_LOG_FLUSH_INTERVAL = 5.0
+# events inserted into the ZED events table at a time
+ZED_DB_BATCH_SIZE = 1000
+
+EVENTS_TABLE = table("events",
+        column("event_key"), column("process_key"), column("topic"), column("type"), column("action"),
+        column("subject"), column("object"), column("status_type"), column("status_zed_code"),
+        column("status_msg_code"), column("status_msg"), column("event_msg"), column("timestamp"))
+
+class ZedFileSink(object):
+    """Buffered writer for a ZED event log with one JSON event per line.
+
+    Events are serialized with json.dumps, which uses the C encoder (json.dump encodes
+    to the file piece by piece in Python), and kept in memory. They are written with one
+    write call when buffer_size bytes are pending or flush_interval seconds have passed
+    since the last write (checked when an event is added), and by flush() and close().
+
+    Args:
+        zed_event_log: path of the ZED log
+        append: add to an existing log instead of overwriting it
+        buffer_size: bytes kept before a write, 0 writes each event right away
+        flush_interval: longest time in seconds between writes, None for no time limit
+        fsync: sync the log to disk after each write, so written events survive a host crash
+    """
+    def __init__(self, zed_event_log, append=False, buffer_size=ZED_LOG_BUFFER_SIZE,
+            flush_interval=ZED_LOG_FLUSH_INTERVAL, fsync=False):
+        self.zed_event_log = zed_event_log
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._fp = open(zed_event_log, "a" if append else "w")
+        self._buffer = []
+        self._buffered_size = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, zed_event):
+        line = json.dumps(zed_event) + "\n"
+        self._buffer.append(line)
+        self._buffered_size += len(line)
+        if self._buffered_size >= self.buffer_size or \
+                (self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._fp.write("".join(self._buffer))
+            self._buffer = []
+            self._buffered_size = 0
+        self._fp.flush()
+        if self.fsync:
+            os.fsync(self._fp.fileno())
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if not self._fp.closed:
+            self.flush()
+            self._fp.close()
+
+class ZedDatabaseSink(object):
+    """Writes ZED events to the ZED events table in batches.
+
+    Events are validated against the ZED event schema (zed-verify/config/zed_schema.json) when
+    they are added, and inserted with one executemany per batch of batch_size events, when
+    flush_interval seconds have passed since the last insert, and by flush() and close().
+    Inserted events do not need the zed-verify validate and audit passes.
+    Events that fail validation, and batches that cannot be inserted, are written to the
+    fallback sink (the ZED log file) instead, to be validated and loaded the usual way.
+
+    Args:
+        db_conn_str: connection string of the database with the events table
+        schema: ZED event JSON schema
+        fallback_sink: ZedFileSink for the events that are not inserted
+        batch_size: events inserted at a time
+        flush_interval: longest time in seconds between inserts, None for no time limit
+    """
+    def __init__(self, db_conn_str, schema, fallback_sink, batch_size=ZED_DB_BATCH_SIZE,
+            flush_interval=ZED_LOG_FLUSH_INTERVAL):
+        self.engine = create_engine(db_conn_str, pool_pre_ping=True)
+        self.validator = jsonschema.validators.validator_for(schema)(schema)
+        self.fallback_sink = fallback_sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.inserted = 0
+        self.failed = 0
+        self._events = []
+        self._last_flush = time.monotonic()
+
+    def write(self, zed_event):
+        error = jsonschema.exceptions.best_match(self.validator.iter_errors(zed_event))
+        if error is not None:
+            logging.error(f"Invalid ZED event {zed_event.get('event')}: {error.message}")
+            self.failed += 1
+            self.fallback_sink.write(zed_event)
+            return
+        self._events.append(zed_event)
+        if len(self._events) >= self.batch_size or \
+                (self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self._events:
+            events = self._events
+            self._events = []
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(EVENTS_TABLE.insert(), [zed_event_row(zed_event) for zed_event in events])
+                self.inserted += len(events)
+            except SQLAlchemyError as err:
+                logging.error(f"ZED events insert error: {err}")
+                self.failed += len(events)
+                for zed_event in events:
+                    self.fallback_sink.write(zed_event)
+        self.fallback_sink.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.fallback_sink.close()
+        self.engine.dispose()
+        logging.info(f"ZED events: {self.inserted} inserted into the events table, {self.failed} written to {self.fallback_sink.zed_event_log}")
+
+def zed_event_row(zed_event):
+    """Map a ZED event to a row of the ZED events table."""
+    status = zed_event.get("status") or {}
+    return {
+        "event_key": zed_event.get("event"),
+        "process_key": zed_event.get("process"),
+        "topic": zed_event.get("topic"),
+        "type": zed_event.get("type"),
+        "action": zed_event.get("action"),
+        "subject": zed_event.get("subject"),
+        "object": zed_event.get("object"),
+        "status_type": status.get("type"),
+        "status_zed_code": status.get("zed_code"),
+        "status_msg_code": status.get("msg_code"),
+        "status_msg": status.get("msg"),
+        "event_msg": json.dumps(zed_event),
+        # milliseconds, as loaded from the ZED logs
+        "timestamp": zed_event.get("timestamp", "")[:23],
+    }
+
+def load_zed_schema(schema_file):
+    with open(schema_file, "r") as f:
+        return json.load(f)
+
 class CidZedEvent(object):
     """A class for ZED event with following properties:
     Attributes:
+    Events are written to a sink: a ZedDatabaseSink when given, otherwise the ZED log through a
+    buffered ZedFileSink (see ZedFileSink for buffer_size, flush_interval and fsync).
+    Call close() to write the buffered events.
     """
-    def __init__(self, zed_msg_table_file, zed_event_log, event_data=None):
+    def __init__(self, zed_msg_table_file, zed_event_log=None, event_data=None, append=False,
+            buffer_size=ZED_LOG_BUFFER_SIZE, flush_interval=ZED_LOG_FLUSH_INTERVAL, fsync=False, sink=None):
         self.zed_msg_table = self._get_zed_msg_table(zed_msg_table_file)
-        self.zed_log_fp = open(zed_event_log, "w")
+        self._event_default_values = {}
+        if sink is None:
+            sink = ZedFileSink(zed_event_log, append=append, buffer_size=buffer_size,
+                    flush_interval=flush_interval, fsync=fsync)
+        self.zed_log = sink
         self.zed_event_data = event_data
         self.zed_event = None
 
@@ -32,11 +195,15 @@ class CidZedEvent(object):
             return result
  
     def _get_zed_event_default_values(self, status_msg_code):
+        event_default_values = self._event_default_values.get(status_msg_code)
+        if event_default_values is not None:
+            return event_default_values
         event_default_values = {}
         data_fields = ["status_zed_code", "status_msg", "status_type", "topic", "type", "action"]
         try:
             for key in data_fields:
                 event_default_values[key] = self.zed_msg_table.get(status_msg_code).get(key)
+            self._event_default_values[status_msg_code] = event_default_values
             return event_default_values
         except Exception as ex:
             print(f"Zed msg table lookup error: {ex}")
@@ -83,7 +250,8 @@ class CidZedEvent(object):
         event_default_values = self._get_zed_event_default_values(status_msg_code)
 
         event_key = str(uuid.uuid4())
-        timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%fZ")[:-3]
+        # same as strftime("%Y-%m-%dT%H:%M:%S.%fZ")[:-3]
+        timestamp = datetime.now().isoformat(timespec="microseconds")[:-2]
 
         status = {
             "type": event_default_values.get("status_type"),
@@ -108,11 +276,13 @@ class CidZedEvent(object):
         }
 
         self.zed_event = zed_event
-        json.dump(zed_event, self.zed_log_fp)
-        self.zed_log_fp.write('\n')
+        self.zed_log.write(zed_event)
+
+    def flush(self):
+        self.zed_log.flush()
 
     def close(self):
-        self.zed_log_fp.close()
+        self.zed_log.close()
 
 def main():
     zed_msg_table_file= "/apps/htmm/cdl-env/zed/msg_tables/columns_prep.csv"
@@ -4,16 +4,37 @@ import re
 
 from sqlalchemy import create_engine
 from sqlalchemy import text
+from sqlalchemy import bindparam
 from sqlalchemy import table, column, update
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import SQLAlchemyError
 
 import logging
 
 from lib.utils import db_connect_url
 from lib.utils import get_configs_by_filename
 
+# Connection pool defaults for server databases (MySQL)
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_RECYCLE = 3600
+
 class Database:
-    def __init__(self, db_connect_str):
-        self.engine = create_engine(db_connect_str)
+    """Database with a pool of reusable connections.
+
+    Connections are checked out of the engine pool for each query and returned afterwards,
+    so the connect cost is paid once per pooled connection instead of once per query.
+    Pooled connections are pinged before use and recycled after pool_recycle seconds,
+    which keeps long running jobs from failing on connections the server has dropped.
+
+    Args:
+        db_connect_str: database connection string
+        pool_size: number of connections kept in the pool
+        max_overflow: connections opened beyond pool_size under load
+        pool_recycle: seconds before a pooled connection is replaced
+    """
+    def __init__(self, db_connect_str, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_recycle=POOL_RECYCLE):
+        self.engine = create_engine(db_connect_str, **engine_options(db_connect_str, pool_size, max_overflow, pool_recycle))
 
     def findall(self, sql, params=None):
         with self.engine.connect() as conn:
@@ -45,45 +66,65 @@ class Database:
     def close(self):
         self.engine.dispose()
 
+def engine_options(db_connect_str, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_recycle=POOL_RECYCLE):
+    """Engine options for a pool of pre-pinged connections.
+    SQLite uses its own pool, so the pool sizing only applies to other databases.
+    """
+    options = {"pool_pre_ping": True}
+    if make_url(db_connect_str).get_backend_name() != "sqlite":
+        options.update({
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_recycle": pool_recycle,
+        })
+    return options
+
 class ZephirDatabase(Database):
+    """Zephir database with the cluster lookup queries.
+
+    The lookup queries are built once as bound statements with expanding IN parameters,
+    so the values are passed to the driver as parameters instead of being quoted into the SQL
+    and the same statements are reused by every lookup.
+    """
     SELECT_ZEPHIR_BY_OCLC = """SELECT distinct z.cid cid, i.identifier ocn
         FROM zephir_records as z
         INNER JOIN zephir_identifier_records as r on r.record_autoid = z.autoid
         INNER JOIN zephir_identifiers as i on i.autoid = r.identifier_autoid
         WHERE z.cid != '0' AND i.type = 'oclc'
     """
-    AND_IDENTIFIER_IN = "AND i.identifier in"
-    AND_CID_IN = "AND z.cid in"
+    AND_IDENTIFIER_IN = "AND i.identifier in :ids"
+    AND_CID_IN = "AND z.cid in :ids"
     ORDER_BY = "ORDER BY z.cid, i.identifier"
 
     SELECT_CID_BY_HTID = "SELECT cid from zephir_records where id=:id"
+    SELECT_CID_BY_HTIDS = text("SELECT id, cid from zephir_records where id in :ids").bindparams(bindparam("ids", expanding=True))
 
-    def __init__(self, db_connect_str):
-        super().__init__(db_connect_str)
-
-    def _construct_select_zephir_cluster_by_ocns(self, ocns):
-        if invalid_sql_in_clause_str(ocns):
-            return None
-
-        return ZephirDatabase.SELECT_ZEPHIR_BY_OCLC + " " + ZephirDatabase.AND_IDENTIFIER_IN + " (" + ocns + ") " + ZephirDatabase.ORDER_BY
-
-    def _construct_select_zephir_cluster_by_cid(self, cids):
-        if invalid_sql_in_clause_str(cids):
-            return None
-
-        return ZephirDatabase.SELECT_ZEPHIR_BY_OCLC + " " + ZephirDatabase.AND_CID_IN + " (" + cids + ") " + ZephirDatabase.ORDER_BY
-
-    def _construct_select_zephir_cluster_by_contribsys_id(self, contribsys_ids):
-        if invalid_sql_in_clause_str(contribsys_ids):
-            return None
-
-        return "SELECT distinct cid, contribsys_id FROM zephir_records WHERE contribsys_id in (" + contribsys_ids + ") order by cid"
-
-    def _construct_select_contribsys_id_by_cid(self, cids):
-        if invalid_sql_in_clause_str(cids):
-            return None
-        
-        return "SELECT distinct cid, contribsys_id FROM zephir_records WHERE cid in (" + cids + ") order by cid"
+    SELECT_ZEPHIR_CLUSTER_BY_OCNS = text(" ".join([SELECT_ZEPHIR_BY_OCLC, AND_IDENTIFIER_IN, ORDER_BY])).bindparams(bindparam("ids", expanding=True))
+    SELECT_ZEPHIR_CLUSTER_BY_CIDS = text(" ".join([SELECT_ZEPHIR_BY_OCLC, AND_CID_IN, ORDER_BY])).bindparams(bindparam("ids", expanding=True))
+    # all OCNs of the clusters with any of the OCNs, joined to the matched CIDs
+    SELECT_ZEPHIR_CLUSTER_WITH_ALL_OCNS_BY_OCNS = text(" ".join([
+        """SELECT distinct z.cid cid, i.identifier ocn
+        FROM zephir_records as z
+        INNER JOIN zephir_identifier_records as r on r.record_autoid = z.autoid
+        INNER JOIN zephir_identifiers as i on i.autoid = r.identifier_autoid
+        INNER JOIN (
+            SELECT distinct mz.cid
+            FROM zephir_records as mz
+            INNER JOIN zephir_identifier_records as mr on mr.record_autoid = mz.autoid
+            INNER JOIN zephir_identifiers as mi on mi.autoid = mr.identifier_autoid
+            WHERE mz.cid != '0' AND mi.type = 'oclc' AND mi.identifier in :ids
+        ) as m on m.cid = z.cid
+        WHERE i.type = 'oclc'""",
+        ORDER_BY])).bindparams(bindparam("ids", expanding=True))
+    SELECT_ZEPHIR_CLUSTER_BY_CONTRIBSYS_IDS = text(
+        "SELECT distinct cid, contribsys_id FROM zephir_records WHERE contribsys_id in :ids order by cid"
+    ).bindparams(bindparam("ids", expanding=True))
+    SELECT_CONTRIBSYS_ID_BY_CIDS = text(
+        "SELECT distinct cid, contribsys_id FROM zephir_records WHERE cid in :ids order by cid"
+    ).bindparams(bindparam("ids", expanding=True))
+
+    def __init__(self, db_connect_str, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_recycle=POOL_RECYCLE):
+        super().__init__(db_connect_str, pool_size, max_overflow, pool_recycle)
 
     def zephir_clusters_lookup(self, ocns_list):
         """
@@ -98,36 +139,9 @@ class ZephirDatabase(Database):
             "num_of_matched_zephir_clusters": number of matched clusters
             "min_cid": lowest CID 
         """
-        zephir_cluster = {
-            "inquiry_ocns_zephir": ocns_list,
-            "cid_ocn_list": [],
-            "cid_ocn_clusters": {},
-            "num_of_matched_zephir_clusters": 0,
-            "min_cid": None,
-        }
-
-        cid_ocn_list_by_ocns = self.find_zephir_clusters_by_ocns(ocns_list)
-        if not cid_ocn_list_by_ocns:
-            return zephir_cluster
-
-        # find all OCNs in each cluster
-        cids_list = [cid_ocn.get("cid") for cid_ocn in cid_ocn_list_by_ocns]
-        unique_cids_list = list(set(cids_list))
-        cid_ocn_list = self.find_zephir_clusters_by_cids(unique_cids_list)
-        if not cid_ocn_list:
-            return zephir_cluster
-
-        # convert to a dict with key=cid, value=list of ocns
-        cid_ocn_clusters = formatting_cid_id_clusters(cid_ocn_list, "ocn")
-
-        zephir_cluster = {
-            "inquiry_ocns_zephir": ocns_list,
-            "cid_ocn_list": cid_ocn_list,
-            "cid_ocn_clusters": cid_ocn_clusters,
-            "num_of_matched_zephir_clusters": len(cid_ocn_clusters),
-            "min_cid": min([cid_ocn.get("cid") for cid_ocn in cid_ocn_list])
-        }
-        return zephir_cluster
+        # all OCNs in the clusters matched by the OCNs, in one query
+        cid_ocn_list = self.find_zephir_clusters_with_all_ocns_by_ocns(ocns_list)
+        return compile_zephir_clusters(ocns_list, cid_ocn_list)
 
     def zephir_clusters_lookup_by_sysids(self, sysids_list):
         """
@@ -174,14 +188,25 @@ class ZephirDatabase(Database):
         return zephir_cluster
 
     def _get_query_results(self, query, params=None):
-        if query:
+        if query is not None:
             try:
-                results = self.findall(text(query), params)
+                if isinstance(query, str):
+                    query = text(query)
+                results = self.findall(query, params)
                 return results
             except:
                 return None
         return None
 
+    def _get_query_results_by_ids(self, query, ids):
+        """Run a statement with an expanding IN parameter on a list of IDs.
+        IDs are compared as strings, as the identifier and cid columns are strings.
+        Returns None for an empty list.
+        """
+        if not ids:
+            return None
+        return self._get_query_results(query, {"ids": [str(id) for id in ids]})
+
     def find_zephir_clusters_by_ocns(self, ocns_list):
         """
         Args:
@@ -192,8 +217,19 @@ class ZephirDatabase(Database):
             [] when there is no match
             None: when there is an exception
         """
-        query = self._construct_select_zephir_cluster_by_ocns(list_to_str(ocns_list))
-        return self._get_query_results(query)
+        return self._get_query_results_by_ids(ZephirDatabase.SELECT_ZEPHIR_CLUSTER_BY_OCNS, ocns_list)
+
+    def find_zephir_clusters_with_all_ocns_by_ocns(self, ocns_list):
+        """Finds all OCNs in the Zephir clusters matched by a list of OCNs in one query.
+        Same result as find_zephir_clusters_by_cids on the CIDs found by find_zephir_clusters_by_ocns.
+        Args:
+            ocns_list: list of OCNs in integer
+        Returns:
+            list of dict with keys "cid" and "ocn"
+            [] when there is no match
+            None: when there is an exception
+        """
+        return self._get_query_results_by_ids(ZephirDatabase.SELECT_ZEPHIR_CLUSTER_WITH_ALL_OCNS_BY_OCNS, ocns_list)
 
     def find_zephir_clusters_by_cids(self, cid_list):
         """
@@ -203,8 +239,7 @@ class ZephirDatabase(Database):
         Returns:
             list of dict with keys "cid" and "ocn"
         """
-        query = self._construct_select_zephir_cluster_by_cid(list_to_str(cid_list))
-        return self._get_query_results(query)
+        return self._get_query_results_by_ids(ZephirDatabase.SELECT_ZEPHIR_CLUSTER_BY_CIDS, cid_list)
 
     def find_zephir_clusters_by_contribsys_ids(self, contribsys_id_list):
         """
@@ -213,8 +248,7 @@ class ZephirDatabase(Database):
         Returns:
             list of dict with keys "cid" and "contribsys_id"
         """
-        query = self._construct_select_zephir_cluster_by_contribsys_id(list_to_str(contribsys_id_list))
-        return self._get_query_results(query)
+        return self._get_query_results_by_ids(ZephirDatabase.SELECT_ZEPHIR_CLUSTER_BY_CONTRIBSYS_IDS, contribsys_id_list)
 
     def find_zephir_clusters_and_contribsys_ids_by_cid(self, cid_list):
         """
@@ -224,14 +258,21 @@ class ZephirDatabase(Database):
         Returns:
             list of dict with keys "cid" and "contribsys_id"
         """
-        query = self._construct_select_contribsys_id_by_cid(list_to_str(cid_list))
-        return self._get_query_results(query)
+        return self._get_query_results_by_ids(ZephirDatabase.SELECT_CONTRIBSYS_ID_BY_CIDS, cid_list)
 
     def find_cid_by_htid(self, id):
         query = ZephirDatabase.SELECT_CID_BY_HTID
         params = {"id": id}
         return self._get_query_results(query, params)
 
+    def find_cids_by_htids(self, htids):
+        """Finds the current CIDs of a list of htids in one query.
+        Returns:
+            list of dict with keys "id" and "cid"
+            None: when the list is empty or there is an exception
+        """
+        return self._get_query_results_by_ids(ZephirDatabase.SELECT_CID_BY_HTIDS, htids)
+
 class ZephirTables:
     def __init__(self, database):
         self.database = database
@@ -262,6 +303,76 @@ class CidMinterTable(ZephirTables):
         """
         self.update({"cid": self.table.c.cid +1}, condition=None)
 
+    def reserve_cids(self, count):
+        """Reserve a block of new CIDs by increasing the cid counter by count in one transaction.
+        The row stays locked until the transaction commits, so concurrent minters get separate blocks.
+        Returns: the first and the last CID of the block as integers
+        """
+        with self.database.engine.begin() as conn:
+            if conn.dialect.name == "mysql":
+                conn.execute(text("UPDATE cid_minter SET cid = LAST_INSERT_ID(cid + :count)"), {"count": count})
+                last_cid = conn.execute(text("SELECT LAST_INSERT_ID()")).scalar()
+            else:
+                conn.execute(text("UPDATE cid_minter SET cid = cid + :count"), {"count": count})
+                last_cid = conn.execute(text("SELECT cid FROM cid_minter")).scalar()
+        last_cid = int(last_cid)
+        return last_cid - count + 1, last_cid
+
+    def release_cids(self, first_cid, last_cid):
+        """Give back the unused CIDs at the end of a reserved block.
+        The cid counter is only set back when no CIDs were reserved after the block.
+        Returns: True when the CIDs were given back
+        """
+        with self.database.engine.begin() as conn:
+            result = conn.execute(text("UPDATE cid_minter SET cid = :cid WHERE cid = :last_cid"),
+                    {"cid": str(first_cid - 1), "last_cid": str(last_cid)})
+        return result.rowcount == 1
+
+class CidBlockAllocator:
+    """Hands out new CIDs from blocks reserved in the cid_minter table.
+
+    A block of block_size CIDs is reserved with one locked update of the cid counter
+    and its CIDs are handed out from memory, so minter processes running at the same time
+    never hand out the same CID. Call close() at shutdown to give back the unused CIDs of
+    the current block; they are logged when they cannot be given back.
+
+    Args:
+        cid_minter_table: CidMinterTable
+        block_size: number of CIDs reserved at a time
+    """
+    def __init__(self, cid_minter_table, block_size=1):
+        self.cid_minter_table = cid_minter_table
+        self.block_size = block_size
+        self._next_cid = None
+        self._last_cid = None
+
+    def next_cid(self):
+        """Return the next new CID in string."""
+        if self._next_cid is None or self._next_cid > self._last_cid:
+            self._next_cid, self._last_cid = self.cid_minter_table.reserve_cids(self.block_size)
+            if self.block_size > 1:
+                logging.info(f"Reserved CIDs {self._next_cid} to {self._last_cid}")
+        cid = self._next_cid
+        self._next_cid += 1
+        return str(cid)
+
+    def unused_cids(self):
+        """Return the first and the last unused CID of the current block, None when there is none."""
+        if self._next_cid is None or self._next_cid > self._last_cid:
+            return None
+        return self._next_cid, self._last_cid
+
+    def close(self):
+        unused = self.unused_cids()
+        self._next_cid = None
+        self._last_cid = None
+        if unused:
+            first_cid, last_cid = unused
+            if self.cid_minter_table.release_cids(first_cid, last_cid):
+                logging.info(f"Returned unused CIDs {first_cid} to {last_cid}")
+            else:
+                logging.warning(f"Unused CIDs {first_cid} to {last_cid} were not returned: more CIDs have been reserved since")
+
 def list_to_str(a_list):
     """Convert list items to single quoted and comma separated string for MySQL IN Clause use.
        Replace single quotes in the original list item to two single quotes so it can be matched by MySQL.
@@ -275,6 +386,34 @@ def list_to_str(a_list):
             new_str = "'" + item + "'"
     return new_str
 
+def compile_zephir_clusters(ocns_list, cid_ocn_list):
+    """Compile the zephir_clusters_lookup result from the cid and ocn pairs of the matched clusters.
+    Args:
+        ocns_list: list of inquiry OCNs
+        cid_ocn_list: list of dict with keys "cid" and "ocn" for all OCNs in the matched clusters
+    Returns:
+        A dict in the zephir_clusters_lookup format
+    """
+    if not cid_ocn_list:
+        return {
+            "inquiry_ocns_zephir": ocns_list,
+            "cid_ocn_list": [],
+            "cid_ocn_clusters": {},
+            "num_of_matched_zephir_clusters": 0,
+            "min_cid": None,
+        }
+
+    # convert to a dict with key=cid, value=list of ocns
+    cid_ocn_clusters = formatting_cid_id_clusters(cid_ocn_list, "ocn")
+
+    return {
+        "inquiry_ocns_zephir": ocns_list,
+        "cid_ocn_list": cid_ocn_list,
+        "cid_ocn_clusters": cid_ocn_clusters,
+        "num_of_matched_zephir_clusters": len(cid_ocn_clusters),
+        "min_cid": min([cid_ocn.get("cid") for cid_ocn in cid_ocn_list])
+    }
+
 def formatting_cid_id_clusters(cid_id_list, other_id):
     """Put cid and id pairs into clusters by unique cids. 
     Args:
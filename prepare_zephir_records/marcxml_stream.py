@@ -0,0 +1,167 @@
+import os
+import re
+
+from lxml import etree
+from pymarc import Record, Field
+from pymarc.marcxml import MARC_XML_NS
+
+RECORD_TAG = f"{{{MARC_XML_NS}}}record"
+
+COLLECTION_START = f'<collection xmlns="{MARC_XML_NS}">\n'.encode("ascii")
+COLLECTION_END = b"</collection>\n"
+EMPTY_COLLECTION = f'<collection xmlns="{MARC_XML_NS}"/>\n'.encode("ascii")
+# characters not allowed in XML 1.0
+INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+# characters that end a run of ASCII text in the libxml2 character data parser
+CHAR_DATA_STOP = re.compile("[\r&<>\x80-\U0010ffff]")
+
+def iter_marcxml_records(xml_file, strict=True):
+    """Read MARCXML records one at a time.
+
+    Parses the file with lxml iterparse and yields each record as soon as its closing tag is read.
+    The elements of a record are cleared once the record is built, so memory use does not grow
+    with the size of the file. Records are built the same way as marcxml.parse_xml_to_array(strict=True).
+
+    Args:
+      xml_file: path or binary file object of a MARCXML file
+      strict: only read records and fields in the MARC21 slim namespace (elements in other namespaces are ignored)
+    Yields:
+      pymarc Record
+    """
+    tag = RECORD_TAG if strict else None
+    for event, elem in etree.iterparse(xml_file, events=("end",), tag=tag, huge_tree=True):
+        if not strict and etree.QName(elem).localname != "record":
+            continue
+        record = element_to_record(elem, strict)
+        # free the parsed record and the records before it
+        elem.clear(keep_tail=True)
+        parent = elem.getparent()
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
+        yield record
+
+def element_to_record(elem, strict=True):
+    """Build a pymarc Record from a MARCXML record element."""
+    record = Record()
+    for child in elem.iterchildren(tag=etree.Element):
+        qname = etree.QName(child)
+        if strict and qname.namespace != MARC_XML_NS:
+            continue
+        element = qname.localname
+        if element == "leader":
+            record.leader = child.text or ""
+        elif element == "controlfield":
+            field = Field(child.get("tag"))
+            field.data = child.text or ""
+            record.add_field(field)
+        elif element == "datafield":
+            field = Field(child.get("tag"), [child.get("ind1", " "), child.get("ind2", " ")])
+            for subfield in child.iterchildren(tag=etree.Element):
+                if strict and etree.QName(subfield).namespace != MARC_XML_NS:
+                    continue
+                if etree.QName(subfield).localname == "subfield":
+                    field.subfields.append(subfield.get("code"))
+                    field.subfields.append(subfield.text or "")
+            record.add_field(field)
+    return record
+
+
+class MarcXmlWriter:
+    """Write MARCXML records to a file in the pretty printed format.
+
+    The output is the same as writing the records with pymarc XMLWriter and pretty printing
+    the file with lxml (XMLParser(remove_blank_text=True, recover=True), write(pretty_print=True)):
+    no XML declaration, two space indentation, non-ASCII characters as character references.
+    Records are written to a temporary file next to output_file, which is renamed to output_file by close().
+
+    Args:
+      output_file: full path of output file
+    """
+    def __init__(self, output_file):
+        self.output_file = output_file
+        dirname, filename = os.path.split(output_file)
+        self.tmp_file = os.path.join(dirname, f".{filename}.{os.getpid()}.tmp")
+        self._fh = open(self.tmp_file, "wb")
+        self.records = 0
+
+    def write(self, record):
+        if self.records == 0:
+            self._fh.write(COLLECTION_START)
+        self._fh.write(record_to_pretty_xml(record))
+        self.records += 1
+
+    def close(self):
+        """Finish the file and move it to output_file."""
+        self._fh.write(COLLECTION_END if self.records else EMPTY_COLLECTION)
+        self._fh.close()
+        os.replace(self.tmp_file, self.output_file)
+
+    def discard(self):
+        """Remove the file without writing output_file."""
+        self._fh.close()
+        if os.path.exists(self.tmp_file):
+            os.remove(self.tmp_file)
+
+def record_to_pretty_xml(record):
+    """Format a record as an indented MARCXML record element in ASCII bytes."""
+    lines = ["  <record>\n", _element("    ", "leader", [], str(record.leader))]
+    for field in record:
+        if field.is_control_field():
+            lines.append(_element("    ", "controlfield", [("tag", field.tag)], field.data))
+        else:
+            attrs = [("ind1", field.indicators[0]), ("ind2", field.indicators[1]), ("tag", field.tag)]
+            subfields = [_element("      ", "subfield", [("code", code)], value) for code, value in field]
+            if subfields:
+                lines.append(f"    <datafield{_attributes(attrs)}>\n")
+                lines.extend(subfields)
+                lines.append("    </datafield>\n")
+            else:
+                lines.append(f"    <datafield{_attributes(attrs)}/>\n")
+    lines.append("  </record>\n")
+    return "".join(lines).encode("ascii", "xmlcharrefreplace")
+
+def _element(indent, name, attrs, text):
+    text = _escape_text(text or "")
+    if text:
+        return f"{indent}<{name}{_attributes(attrs)}>{text}</{name}>\n"
+    return f"{indent}<{name}{_attributes(attrs)}/>\n"
+
+def _attributes(attrs):
+    return "".join(f' {name}="{_escape_attribute(value)}"' for name, value in attrs)
+
+def _escape_text(text):
+    text = INVALID_XML_CHARS.sub("", text)
+    if "\r" in text:
+        text = _parsed_line_ends(text)
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def _parsed_line_ends(text):
+    """Return the text as lxml reads it back with remove_blank_text=True.
+    Line ends are normalized to \\n. Leading blank runs that end at a \\r are dropped by the
+    libxml2 blank text heuristic, until the first non-blank run or the parser leaves its ASCII fast path.
+    """
+    kept = []
+    pos = 0
+    has_text = False
+    while True:
+        match = CHAR_DATA_STOP.search(text, pos)
+        if not match:
+            kept.append(text[pos:])
+            break
+        run = text[pos:match.start()]
+        if not (match.group() == "\r" and run and not has_text and not run.strip(" \t\n")):
+            has_text = has_text or bool(run)
+            kept.append(run)
+        next_char = text[match.end() + 1:match.end() + 2]
+        if text[match.start():match.end() + 1] == "\r\n" and next_char != "\r" and next_char <= "\x7f":
+            pos = match.end()
+            continue
+        kept.append(text[match.start():])
+        break
+    return re.sub("\r\n?", "\n", "".join(kept))
+
+def _escape_attribute(value):
+    value = INVALID_XML_CHARS.sub("", value)
+    value = value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+    return value.replace("\n", "&#10;").replace("\r", "&#13;").replace("\t", "&#9;")
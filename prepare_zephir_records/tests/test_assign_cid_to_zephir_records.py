@@ -1,10 +1,26 @@
 import os
+import atexit
+import logging
 
+import pandas
 import pytest
 from pymarc import marcxml
 from pymarc import Record, Field
+from pymarc import XMLWriter
 
+from assign_cid_to_zephir_records import assign_cids
+from assign_cid_to_zephir_records import config_logger
 from assign_cid_to_zephir_records import get_ids
+from assign_cid_to_zephir_records import lock_a_dir_for_cid_minting
+from assign_cid_to_zephir_records import lock_dirs_for_cid_minting
+from assign_cid_to_zephir_records import lock_a_file_for_cid_minting
+from assign_cid_to_zephir_records import parallel_batch_process
+from assign_cid_to_zephir_records import unlock_dir
+from assign_cid_to_zephir_records import zed_log_filename
+from cid_minter.cid_minter import CidMinter
+from cid_minter.tests.test_oclc_lookup import create_concordance_arrays
+
+CID_MINTER_DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "cid_minter", "tests", "test_cid_minter")
 
 def test_get_ids_(data_dir):
 
@@ -60,3 +76,179 @@ def test_get_ids_(data_dir):
 
 def test_assign_cids():
     pass
+
+@pytest.mark.parametrize("batch_size", [1, 1000])
+def test_assign_cids_truncated_xml(minting_config, caplog, batch_size):
+    """The records read before an XML syntax error are kept and the error file is written."""
+    import_dir = minting_config["import_dir"]
+    records = [
+        ("8727632", "test.1234567890_1b1"),
+        ("80274381,25231018", "hvd.hw5jdo"),
+        ("1234567890", "test.batch.1"),
+    ]
+    create_record_files(import_dir, {"a": {"a_1.xml": records}})
+    input_file = os.path.join(import_dir, "a", "prepared_files", "a_1.xml")
+    with open(input_file, "rb") as fh:
+        data = fh.read()
+    # cut the file in the middle of the last record
+    with open(input_file, "wb") as fh:
+        fh.write(data[:data.rindex(b"<record>") + 20])
+    output_file = os.path.join(import_dir, "a", "cidfiles", "a_1.xml")
+    err_file = f"{output_file}.err"
+
+    cid_minter = CidMinter({**minting_config, "zed_log": zed_log_filename(minting_config["zed_log_path"], os.getpid())})
+    try:
+        assign_cids(cid_minter, input_file, output_file, err_file, {"subject": "a_1.xml"}, batch_size)
+    finally:
+        cid_minter.close()
+
+    cids = read_cids(import_dir)
+    assert len(cids[os.path.join("a", "a_1.xml")]) == 2
+    assert cids[os.path.join("a", "a_1.xml.err")] == []
+    assert f"XML syntax error in {input_file}" in caplog.text
+
+def test_config_logger(tmpdir):
+    logfile = os.path.join(tmpdir, "cid_minting.log")
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    try:
+        listener = config_logger(logfile, False, level=logging.INFO)
+        logging.getLogger("cid_minter.cid_minter").debug("step")
+        logging.getLogger("cid_minter.cid_minter").info("Record %s: CID %s", "test.1", "000000001")
+        listener.stop()
+        atexit.unregister(listener.stop)
+    finally:
+        root.handlers, root.level = handlers, level
+    with open(logfile) as fp:
+        lines = fp.readlines()
+    assert len(lines) == 1
+    assert lines[0].endswith("INFO test_config_logger: Record test.1: CID 000000001\n")
+
+def create_prepared_files(import_dir, files):
+    for config_name, filenames in files.items():
+        prepared_dir = os.path.join(import_dir, config_name, "prepared_files")
+        os.makedirs(prepared_dir)
+        for filename in filenames:
+            open(os.path.join(prepared_dir, filename), 'w').close()
+
+def test_lock_dirs_for_cid_minting(tmpdir):
+    import_dir = str(tmpdir)
+    create_prepared_files(import_dir, {"a": ["a_1.xml"], "b": ["b_1.xml", "b_2.xml"], "c": [], "d": ["d_1.xml"]})
+    dir_path = os.path.join(import_dir, "*/prepared_files/")
+
+    # a directory locked by another CID minter is passed
+    assert lock_a_dir_for_cid_minting(os.path.join(import_dir, "d/prepared_files/")) == os.path.join(import_dir, "d/prepared_files")
+
+    locked_dirs = lock_dirs_for_cid_minting(dir_path)
+    assert sorted(locked_dirs) == [os.path.join(import_dir, config_name, "prepared_files") for config_name in ["a", "b"]]
+    for locked_dir in locked_dirs:
+        assert os.path.exists(os.path.join(locked_dir, "process.cid"))
+    assert lock_dirs_for_cid_minting(dir_path) == []
+
+    for locked_dir in locked_dirs:
+        unlock_dir(locked_dir)
+    assert len(lock_dirs_for_cid_minting(dir_path)) == 2
+
+def test_lock_a_file_for_cid_minting(tmpdir):
+    import_dir = str(tmpdir)
+    create_prepared_files(import_dir, {"b": ["b_1.xml", "b_2.xml"]})
+    prepared_dir = os.path.join(import_dir, "b/prepared_files")
+
+    locked = [lock_a_file_for_cid_minting(prepared_dir, pid) for pid in [101, 102, 103]]
+    assert sorted(filename_org for filename_org, filename_locked in locked[:2]) == ["b_1.xml", "b_2.xml"]
+    assert [filename_locked for filename_org, filename_locked in locked[:2]] == [f"{locked[0][0]}.101", f"{locked[1][0]}.102"]
+    assert locked[2] == (None, None)
+    assert sorted(os.listdir(prepared_dir)) == sorted(filename_locked for filename_org, filename_locked in locked[:2])
+
+def test_parallel_batch_process(minting_config):
+    import_dir = minting_config["import_dir"]
+    records = [
+        ("8727632", "test.1234567890_1b1"),
+        ("1234567890", "test.batch.1"),
+        ("80274381,25231018", "hvd.hw5jdo"),
+    ]
+    create_record_files(import_dir, {
+        "a": {f"a_{i}.xml": records for i in range(3)},
+        "b": {f"b_{i}.xml": records for i in range(2)},
+    })
+    parallel_batch_process(minting_config, os.path.join(import_dir, "*/prepared_files/"), 2)
+
+    assert sorted(os.listdir(os.path.join(import_dir, "a/prepared_files"))) == [f"a_{i}.xml.processed" for i in range(3)]
+    assert sorted(os.listdir(os.path.join(import_dir, "b/prepared_files"))) == [f"b_{i}.xml.processed" for i in range(2)]
+    assert sorted(os.listdir(os.path.join(import_dir, "a/cidfiles"))) == [f"a_{i}.xml" for i in range(3)]
+    assert sorted(os.listdir(os.path.join(import_dir, "b/cidfiles"))) == [f"b_{i}.xml" for i in range(2)]
+
+    cids = read_cids(import_dir)
+    assert len(cids) == 5
+    assert all(len(file_cids) == len(records) for file_cids in cids.values())
+    # every file gets the same CID for the same record
+    assert len(set(tuple(file_cids) for file_cids in cids.values())) == 1
+
+def test_parallel_batch_process_shared_new_ocn(minting_config):
+    """Files processed by different workers at the same time that share an OCN not in Zephir get the same new CID."""
+    import_dir = minting_config["import_dir"]
+    create_record_files(import_dir, {
+        "a": {"a_1.xml": [("1234567890", "test.batch.1")]},
+        "b": {"b_1.xml": [("1234567890", "test.batch.2")]},
+    })
+    parallel_batch_process(minting_config, os.path.join(import_dir, "*/prepared_files/"), 2)
+
+    cids = read_cids(import_dir)
+    assert len(cids) == 2
+    assert len(set(cid for file_cids in cids.values() for cid in file_cids)) == 1
+
+def create_record_files(import_dir, files):
+    """Write prepared files with one record per (ocns, htid) pair."""
+    for config_name, records_by_filename in files.items():
+        os.makedirs(os.path.join(import_dir, config_name, "cidfiles"))
+        create_prepared_files(import_dir, {config_name: []})
+        for filename, records in records_by_filename.items():
+            writer = XMLWriter(open(os.path.join(import_dir, config_name, "prepared_files", filename), "wb"))
+            for ocns, htid in records:
+                record = Record()
+                for ocn in ocns.split(","):
+                    record.add_field(Field(tag="035", indicators=[" ", " "], subfields=["a", f"(OCoLC){ocn}"]))
+                record.add_field(Field(tag="HOL", indicators=[" ", " "], subfields=["p", htid]))
+                writer.write(record)
+            writer.close()
+
+def read_cids(import_dir):
+    """CIDs of the records in the output files, by output file."""
+    cids = {}
+    for config_name in sorted(os.listdir(import_dir)):
+        cidfiles_dir = os.path.join(import_dir, config_name, "cidfiles")
+        for filename in sorted(os.listdir(cidfiles_dir)):
+            with open(os.path.join(cidfiles_dir, filename), "rb") as fh:
+                records = marcxml.parse_xml_to_array(fh, strict=True)
+            cids[os.path.join(config_name, filename)] = [record["CID"]["a"] for record in records]
+    return cids
+
+@pytest.fixture
+def minting_config(tmpdir):
+    """Configuration of a CID minter with SQLite databases and concordance arrays in tmpdir."""
+    tmp_path = str(tmpdir)
+    databases = {}
+    for db_name, sql in [("zephir", "setup_zephir_test_db.sql"), ("minter", "prepare_cid_minter_datasets.sql")]:
+        database = os.path.join(tmp_path, f"{db_name}.db")
+        os.system("sqlite3 {} < {}".format(database, os.path.join(CID_MINTER_DATA_DIR, sql)))
+        databases[db_name] = f"sqlite:///{database}"
+
+    zed_msg_table = os.path.join(tmp_path, "columns_prep.csv")
+    with open(zed_msg_table, "w") as fp:
+        fp.write("status_msg_code,status_zed_code,status_msg,status_type,topic,type,action\n")
+        fp.write("pr0212,200,Assigned new CID,INFO,Raw,Preprun,MintCID\n")
+        fp.write("pr0213,200,Assigned existing CID,INFO,Raw,Preprun,MintCID\n")
+        fp.write("pr0094,200,OCLC table does not contain OCNs,ERROR,Raw,Preprun,MintCID\n")
+
+    zed_log_path = os.path.join(tmp_path, "zed")
+    os.makedirs(zed_log_path)
+    df = pandas.read_csv(os.path.join(CID_MINTER_DATA_DIR, "primary.csv"))
+    return {
+        "zephirdb_conn_str": databases["zephir"],
+        "minterdb_conn_str": databases["minter"],
+        "concordance_arrays_path": create_concordance_arrays(tmp_path, df),
+        "zed_log_path": zed_log_path,
+        "zed_msg_table": zed_msg_table,
+        "cid_block_size": 10,
+        "import_dir": os.path.join(tmp_path, "import"),
+    }
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+from lxml import etree
+from pymarc import marcxml
+from pymarc import XMLWriter, Record, Field
+
+from marcxml_stream import iter_marcxml_records
+from marcxml_stream import MarcXmlWriter
+
+def marc_data(records):
+    return [(record.leader, [(field.tag, getattr(field, "indicators", None), getattr(field, "subfields", None), getattr(field, "data", None))
+        for field in record.get_fields()]) for record in records]
+
+@pytest.mark.parametrize("filename", ["test_records.xml", "../test_assign_cid_to_zephir_records/test_records_nrlf-6_20221021.xml"])
+def test_iter_marcxml_records(data_dir, filename):
+    record_file = os.path.join(data_dir, filename)
+    with open(record_file, 'rb') as fh:
+        expected_records = marcxml.parse_xml_to_array(fh, strict=True, normalize_form=None)
+    with open(record_file, 'rb') as fh:
+        records = list(iter_marcxml_records(fh, strict=True))
+    assert len(records) == len(expected_records)
+    assert marc_data(records) == marc_data(expected_records)
+
+def test_iter_marcxml_records_not_strict(data_dir):
+    record_file = os.path.join(data_dir, "test_records.xml")
+    with open(record_file, 'rb') as fh:
+        records = list(iter_marcxml_records(fh, strict=False))
+    assert len(records) == 2
+    assert records[0]["999"]["a"] == "other namespace"
+
+def test_iter_marcxml_records_streams(data_dir):
+    record_file = os.path.join(data_dir, "test_records.xml")
+    reader = iter_marcxml_records(record_file)
+    record = next(reader)
+    assert record["001"].data == "test.1"
+    assert record["245"]["a"] == "Café & crème <test>"
+    assert record["HOL"].indicators == [" ", " "]
+    record = next(reader)
+    assert record.leader == ""
+    assert record["500"]["a"] == "line 1\nline 2"
+
+def write_pretty_xml(records, tmp_file, output_file):
+    """Write records the way assign_cids did before MarcXmlWriter: XMLWriter, then pretty print with lxml."""
+    writer = XMLWriter(open(tmp_file, 'wb'))
+    for record in records:
+        writer.write(record)
+    writer.close()
+    parser = etree.XMLParser(remove_blank_text=True, recover=True)
+    etree.parse(tmp_file, parser).write(output_file, pretty_print=True)
+
+def write_records(records, output_file):
+    writer = MarcXmlWriter(output_file)
+    for record in records:
+        writer.write(record)
+    writer.close()
+
+def special_records():
+    texts = ["a & b <c> \"d\" 'e'", "Caf\u00e9 \u20ac \U0001F600", "  ", "", "line 1\r\nline 2\rline 3",
+        " \t\r\u0085", "\r\n \r a", "\n \r\n\t\rb", "]]> --"]
+    records = []
+    for text in texts:
+        record = Record()
+        record.leader = "00000cam a2200000Ia 4500"
+        record.add_field(Field("001", data=text))
+        record.add_field(Field("245", indicators=['"', "\t"], subfields=["a", text, "&", text]))
+        record.add_field(Field("500", indicators=[" ", " "], subfields=[]))
+        records.append(record)
+    return records
+
+@pytest.mark.parametrize("filename", ["test_records.xml", "../test_assign_cid_to_zephir_records/test_records_nrlf-6_20221021.xml"])
+def test_marcxml_writer(data_dir, tmpdir, filename):
+    records = list(iter_marcxml_records(os.path.join(data_dir, filename)))
+    for records in [records, special_records(), []]:
+        expected_file = os.path.join(tmpdir, "expected.xml")
+        output_file = os.path.join(tmpdir, "output.xml")
+        write_pretty_xml(records, os.path.join(tmpdir, "expected.tmp"), expected_file)
+        write_records(records, output_file)
+        with open(expected_file, 'rb') as expected, open(output_file, 'rb') as output:
+            assert output.read() == expected.read()
+        assert sorted(os.listdir(tmpdir)) == ["expected.tmp", "expected.xml", "output.xml"]
+
+def test_marcxml_writer_discard(tmpdir):
+    output_file = os.path.join(tmpdir, "output.xml")
+    writer = MarcXmlWriter(output_file)
+    writer.write(special_records()[0])
+    assert not os.path.exists(output_file)
+    writer.discard()
+    assert os.listdir(tmpdir) == []
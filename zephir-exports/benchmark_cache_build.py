@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import tempfile
+import time
+import zlib
+
+from exports.ht_bib_cache import CLUSTER_BATCH_SIZE
+from exports.ht_bib_cache import batched
+from lib.export_cache import ExportCache
+
+
+def read_entries(cache_path, limit=None):
+    """(cache_id, cache_key, cache_data, cache_date) entries of an existing cache."""
+    cache = ExportCache(path=cache_path)
+    with cache.engine.connect() as con:
+        query = "select cache_id, cache_key, cache_data, cache_date from cache order by cache_id"
+        if limit:
+            query += " limit {}".format(int(limit))
+        return [
+            (
+                cache_id,
+                cache_key,
+                zlib.decompress(cache_data).decode("utf8"),
+                cache_date,
+            )
+            for cache_id, cache_key, cache_data, cache_date in con.execute(query)
+        ]
+
+
+def save_objects(cache, entries):
+    """The ORM path ht_bib_cache used before bulk_build, saving every 5000 entries."""
+    session = cache.session()
+    for batch in batched(entries, 5000):
+        session.bulk_save_objects([cache.entry(*entry) for entry in batch])
+    session.commit()
+    session.close()
+
+
+def insert_mappings(cache, entries):
+    """ORM bulk inserts of entry values in cluster batches."""
+    session = cache.session()
+    for batch in batched(entries, CLUSTER_BATCH_SIZE):
+        session.bulk_insert_mappings(
+            cache.Cache, [ExportCache.entry_values(*entry) for entry in batch]
+        )
+    session.commit()
+    session.close()
+
+
+def bulk_build(cache, entries):
+    with cache.bulk_build() as insert:
+        for batch in batched(entries, CLUSTER_BATCH_SIZE):
+            insert([ExportCache.entry_row(*entry) for entry in batch])
+
+
+def benchmark(write, cache_path, entries):
+    """Returns clusters per second for compressing and writing the entries to a new cache."""
+    cache = ExportCache(path=cache_path, force=True)
+    start = time.perf_counter()
+    write(cache, entries)
+    return len(entries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure clusters written per second when building an export cache."
+    )
+    parser.add_argument("cache", help="Export cache to read the clusters from")
+    parser.add_argument(
+        "--clusters",
+        "-n",
+        dest="clusters",
+        type=int,
+        help="Number of clusters to write (default all)",
+    )
+    parser.add_argument(
+        "--tmp-dir", dest="tmp_dir", help="Directory for the new caches"
+    )
+
+    args = parser.parse_args()
+
+    entries = read_entries(args.cache, args.clusters)
+    runs = [
+        ("ORM bulk_save_objects", save_objects),
+        ("ORM bulk_insert_mappings", insert_mappings),
+        ("bulk_build executemany", bulk_build),
+    ]
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        cache_path = os.path.join(tmp_dir, "cache.db")
+        for name, write in runs:
+            rate = benchmark(write, cache_path, entries)
+            print("{:<26} {:>10.0f} clusters/s".format(name, rate))
+
+
+if __name__ == "__main__":
+    main()
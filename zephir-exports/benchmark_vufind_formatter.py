@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import time
+
+from lib.vufind_formatter import VufindFormatter
+
+
+def read_cluster(path):
+    """The records of a cluster file, one json record per line. The cid is the file name."""
+    with open(path, "r") as f:
+        records = [line for line in f if line.strip()]
+    return os.path.splitext(os.path.basename(path))[0], records
+
+
+def expand_cluster(records, size):
+    """Grow a cluster to size records with copies of its holding records,
+    giving each copy its own 035 values and item id so every copy adds new 035s."""
+    holdings = records[1:] or records
+    expanded = list(records)
+    copy = 0
+    while len(expanded) < size:
+        record = json.loads(holdings[copy % len(holdings)])
+        copy += 1
+        for field in record["fields"]:
+            for tag, value in field.items():
+                if tag in ("035", "974"):
+                    value["subfields"] = [
+                        {
+                            code: (
+                                "{}-{}".format(sub_value, copy)
+                                if code in ("a", "u")
+                                else sub_value
+                            )
+                        }
+                        for subfield in value["subfields"]
+                        for code, sub_value in subfield.items()
+                    ]
+        expanded.append(json.dumps(record))
+    return expanded
+
+
+def pymarc_record(cid, records):
+    return VufindFormatter.create_record(cid, records).as_dict()
+
+
+def benchmark(create_record, clusters, passes):
+    """Returns the merged records of the clusters and the clusters merged per second."""
+    start = time.perf_counter()
+    for i in range(passes):
+        merged = [
+            json.dumps(create_record(cid, records), separators=(",", ":"))
+            for cid, records in clusters
+        ]
+    return merged, len(clusters) * passes / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure clusters merged per second by the VuFind formatters and check their output against a golden file."
+    )
+    parser.add_argument(
+        "clusters",
+        nargs="+",
+        help="Cluster files with one json record per line, named <cid>.json",
+    )
+    parser.add_argument(
+        "--size",
+        "-s",
+        dest="size",
+        type=int,
+        default=500,
+        help="Records per cluster, holdings are copied to reach it",
+    )
+    parser.add_argument(
+        "--passes",
+        "-n",
+        dest="passes",
+        type=int,
+        default=5,
+        help="Times the clusters are merged per formatter",
+    )
+    parser.add_argument(
+        "--golden",
+        "-g",
+        dest="golden",
+        required=True,
+        help="Golden file of merged records, written with create_record when it does not exist",
+    )
+
+    args = parser.parse_args()
+
+    clusters = []
+    for path in args.clusters:
+        cid, records = read_cluster(path)
+        clusters.append((cid, expand_cluster(records, args.size)))
+
+    if not os.path.exists(args.golden):
+        merged, rate = benchmark(pymarc_record, clusters, 1)
+        with open(args.golden, "w") as f:
+            f.write("\n".join(merged) + "\n")
+        print("Wrote golden file {}".format(args.golden))
+    with open(args.golden, "r") as f:
+        golden = f.read().splitlines()
+
+    runs = [
+        ("create_record (pymarc)", pymarc_record),
+        ("create_record_dict", VufindFormatter.create_record_dict),
+    ]
+    for name, create_record in runs:
+        merged, rate = benchmark(create_record, clusters, args.passes)
+        print(
+            "{:<24} {:>10.1f} clusters/s {:>12.0f} records/s  same as golden: {}".format(
+                name, rate, rate * args.size, merged == golden
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
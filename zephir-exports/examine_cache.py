@@ -8,6 +8,7 @@ from environs import Env
 from sqlalchemy import create_engine
 from sqlalchemy.engine.url import URL
 
+from exports.ht_bib_cache import load_live_index
 from lib.export_cache import ExportCache
 from lib.utils_refactor import zephir_config
 
@@ -39,21 +40,12 @@ def main():
         )
     )
     htmm_engine = create_engine(HTMM_DB_CONNECT_STR)
-    live_statement = (
-        "select cid as cache_id, "
-        "crc32(CONCAT(count(id), max(db_updated_at))) as cache_key "
-        "from zephir_records "
-        "where attr_ingest_date is not null "
-        "group by cache_id"
-    )
 
     print(datetime.datetime.time(datetime.datetime.now()))
     cache = ExportCache(os.path.abspath("cache"), "quick-complete")
-    live_index = {}
     with htmm_engine.connect() as con:
-        result = con.execute(live_statement)
-        for row in result:
-            live_index[row.cache_id] = row.cache_key
+        # cache keys computed the same way as in ht_bib_cache
+        live_index = load_live_index(con.connection.cursor())
     comparison = cache.compare(live_index)
     print("uncached")
     print(len(comparison.uncached))
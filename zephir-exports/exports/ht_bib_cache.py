@@ -1,7 +1,15 @@
 #!/usr/bin/env python
 
+import collections
 import datetime
+import functools
+import itertools
+import multiprocessing
 import os
+import queue
+import re
+import shutil
+import threading
 import zlib
 
 import json
@@ -11,10 +19,85 @@ from lib.export_cache import ExportCache
 from lib.vufind_formatter import VufindFormatter
 import lib.utils as utils
 
+# Clusters per formatting task and per bulk insert
+CLUSTER_BATCH_SIZE = 500
+# Clusters per query when refreshing a cache
+REFRESH_QUERY_SIZE = 1000
+# Rows per fetchmany from the streaming source query
+FETCH_SIZE = 1000
+# fetchmany batches a partition reader reads ahead of the clusters in progress
+PARTITION_READ_AHEAD = 16
+# Seconds the server waits for a partition reader that is not reading,
+# a later partition waits until the earlier partitions are read
+PARTITION_WRITE_TIMEOUT = 86400
+
+# Load merge version queries
+SQL_RECORDS = (
+    "select cid, db_updated_at, metadata_json, "
+    "var_usfeddoc, var_score, concat(cid,'_',zr.autoid) as vufind_sort  "
+    "from zephir_records as zr "
+    "inner join zephir_filedata as zf on zr.id = zf.id "
+    "where attr_ingest_date is not null "
+)
+SQL_ORDER = {
+    "v2": "order by cid, var_score DESC, vufind_sort ASC",
+    "v3": "order by cid, var_usfeddoc DESC, var_score DESC, vufind_sort ASC",
+}
+SQL_SELECT = {
+    merge_version: SQL_RECORDS + order for merge_version, order in SQL_ORDER.items()
+}
+# Lowest and highest cid, for splitting the query into cid ranges
+SQL_CID_RANGE = "select min(cid), max(cid) from zephir_records"
+# Record count and last update of each cluster, the inputs of the cache_key
+SQL_LIVE_INDEX = (
+    "select cid, count(zr.id), max(db_updated_at) "
+    "from zephir_records as zr "
+    "inner join zephir_filedata as zf on zr.id = zf.id "
+    "where attr_ingest_date is not null "
+    "group by cid"
+)
+
 
 def ht_bib_cache(
-    console, input_path=None, cache_path=None, merge_version=None, force=False
+    console,
+    input_path=None,
+    cache_path=None,
+    merge_version=None,
+    force=False,
+    workers=1,
+    refresh=False,
+    partitions=1,
 ):
+    """Create the export cache: one entry per cluster (cid) with the merged
+    VuFind record of the ingested zephir records of the cluster.
+
+    A new cache is loaded with ExportCache.bulk_build, one executemany per
+    batch of CLUSTER_BATCH_SIZE clusters. With more than one worker, clusters
+    are formatted and compressed by a pool of worker processes, while a writer
+    thread inserts the formatted batches into the cache in cid order.
+
+    The records are streamed from an unbuffered cursor in fetchmany batches.
+    With more than one partition, the query is split into cid ranges that are
+    queried on their own connections at the same time (see read_partitions).
+
+    With refresh, an existing cache is brought up to date instead of being
+    rebuilt: the cache at cache_path, or else the latest cache of the merge
+    version in the cache directory. Only the clusters whose record count or
+    last update changed are formatted again (see refresh_cache).
+
+    Args:
+        console: A console messenger for output provided by the calling CLI.
+        cache_path: File or directory location of cache file.
+        merge_version: Version of merge algorithm used for cache.
+        force: Boolean for overwriting existing files.
+        workers: Number of processes formatting clusters.
+        refresh: Boolean for refreshing an existing cache.
+        partitions: Number of cid ranges queried in parallel for a new cache.
+
+    Returns:
+        The location of the cache file.
+
+    """
     debug_start_time = datetime.datetime.now()
 
     # LOAD: environment, configuration
@@ -31,7 +114,10 @@ def ht_bib_cache(
         cache_path = os.path.join(os.getcwd(), cache_path)
 
     # create a template file name if only a directory is given
+    base_cache_path = None
     if os.path.isdir(cache_path):
+        if refresh and not force:
+            base_cache_path = latest_cache(cache_path, merge_version)
         cache_template = "cache-{}-{}.db".format(
             merge_version, datetime.datetime.today().strftime("%Y-%m-%d")
         )
@@ -47,6 +133,8 @@ def ht_bib_cache(
     if os.path.exists(cache_path):
         if force:
             console.debug("Cache file exist. Forcing overwrite")
+        elif refresh:
+            base_cache_path = cache_path
         else:
             console.debug("Using existing cache: {}".format(cache_path))
             return cache_path
@@ -60,9 +148,15 @@ def ht_bib_cache(
     console.debug("Cache location: {}".format(cache_path))
 
     # create cache
+    if base_cache_path:
+        console.debug("Refreshing cache: {}".format(base_cache_path))
+        shutil.copyfile(base_cache_path, tmp_cache_path)
     console.debug("Creating cache file, session")
-    cache = ExportCache(path=tmp_cache_path, force=force)
-    bulk_session = cache.session()
+    cache = ExportCache(path=tmp_cache_path, force=force and not base_cache_path)
+
+    # start the formatting processes before connecting to the database,
+    # so they do not share the connection
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
 
     try:
         # DATABASE: Access to current records
@@ -70,81 +164,50 @@ def ht_bib_cache(
         db_settings = APP.CONFIG.get("database", {}).get(APP.ENV)
         db_config = utils.DatabaseHelper(config=db_settings, env_prefix="ZEPHIR")
         db_connection = mysql.connector.connect(**db_config.connection_args())
-        db_cursor = db_connection.cursor()
-
-        # Load merge version queries
-        sql_select = {
-            "v2": "select cid, db_updated_at, metadata_json, "
-            "var_usfeddoc, var_score, concat(cid,'_',zr.autoid) as vufind_sort  "
-            "from zephir_records as zr "
-            "inner join zephir_filedata as zf on zr.id = zf.id "
-            "where attr_ingest_date is not null "
-            "order by cid, var_score DESC, vufind_sort ASC",
-            "v3": "select cid, db_updated_at, metadata_json, "
-            "var_usfeddoc, var_score, concat(cid,'_',zr.autoid) as vufind_sort  "
-            "from zephir_records as zr "
-            "inner join zephir_filedata as zf on zr.id = zf.id "
-            "where attr_ingest_date is not null "
-            "order by cid, var_usfeddoc DESC, var_score DESC, vufind_sort ASC",
-        }
-
-        # Execute query
-        db_cursor.execute(sql_select[merge_version])
-
-        # PROCESS: calculate/merge records from database into cache datastore
-        console.debug("Processing records...")
-        curr_cid = None
-        records = []
-        entries = []
-        max_date = None
-        for idx, row in enumerate(db_cursor):
-            cid, db_date, record, var_usfeddoc, var_score, vufind_sort = row
-            if cid != curr_cid or curr_cid is None:
-                # write last cluster
-                if curr_cid:
-                    cache_id = curr_cid
-                    cache_data = json.dumps(
-                        VufindFormatter.create_record(curr_cid, records).as_dict(),
-                        separators=(",", ":"),
-                    )
-                    cache_key = zlib.crc32(
-                        "{}{}".format(len(records), max_date).encode("utf8")
-                    )
-                    cache_date = max_date
-                    entry = cache.entry(cache_id, cache_key, cache_data, cache_date)
-                    entries.append(entry)
-
-                # prepare next cluster
-                curr_cid = cid
-                records = [record]
-                max_date = db_date
+        db_cursor = db_connection.cursor(buffered=False)
+
+        if base_cache_path:
+            comparison = refresh_cache(cache, db_cursor, merge_version, pool, workers)
+            console.debug(
+                "Refreshed {} stale and {} uncached clusters, removed {}, "
+                "verified {}".format(
+                    len(comparison.stale),
+                    len(comparison.uncached),
+                    len(comparison.unexamined),
+                    len(comparison.verified),
+                )
+            )
+        else:
+            # Execute query
+            if partitions > 1:
+                bounds = cid_partitions(db_cursor, partitions)
+                console.debug("Reading records in {} cid range(s)".format(len(bounds)))
+                connect = functools.partial(
+                    mysql.connector.connect, **db_config.connection_args()
+                )
+                rows = read_partitions(connect, merge_version, bounds)
             else:
-                if db_date > max_date:
-                    max_date = db_date
-                records.append(record)
+                db_cursor.execute(SQL_SELECT[merge_version])
+                rows = fetch_rows(db_cursor)
 
-            # periodic save records to datastore to chunk work
-            if idx % 5000 == 0:
-                bulk_session.bulk_save_objects(entries)
-                entries = []
+            # PROCESS: calculate/merge records from database into cache datastore
+            console.debug("Processing records with {} worker(s)...".format(workers))
+            batches = batched(read_clusters(rows), CLUSTER_BATCH_SIZE)
+            if pool:
+                write_entries(
+                    cache, format_in_pool(pool, format_clusters, batches, workers)
+                )
+            else:
+                with cache.bulk_build() as insert:
+                    for batch in batches:
+                        insert(format_clusters(batch))
 
-        # finish processing on last chunk of work
-        cache_id = curr_cid
-        cache_data = json.dumps(
-            VufindFormatter.create_record(curr_cid, records).as_dict(),
-            separators=(",", ":"),
-        )
-        cache_key = zlib.crc32("{}{}".format(len(records), max_date).encode("utf8"))
-        cache_date = max_date
-        entry = cache.entry(cache_id, cache_key, cache_data, cache_date)
-        entries.append(entry)
-        bulk_session.bulk_save_objects(entries)
-
-        console.debug("Finished processing, final commit to cache datastore")
-        bulk_session.commit()
-        bulk_session.close()
+        console.debug("Finished processing cache datastore")
         os.rename(tmp_cache_path, cache_path)
     finally:
+        if pool:
+            pool.terminate()
+            pool.join()
         # TODO(cc): This will fail if cursor not defined
         db_cursor.close()
         db_connection.close()
@@ -156,5 +219,318 @@ def ht_bib_cache(
     return cache_path
 
 
+def read_clusters(rows):
+    """Group database rows ordered by cid into clusters.
+
+    Yields:
+        (cid, records, max_date) for each cluster, where records are the
+        metadata_json of the rows in query order.
+    """
+    curr_cid = None
+    records = []
+    max_date = None
+    for row in rows:
+        cid, db_date, record, var_usfeddoc, var_score, vufind_sort = row
+        if cid != curr_cid or curr_cid is None:
+            if curr_cid:
+                yield curr_cid, records, max_date
+            curr_cid = cid
+            records = [record]
+            max_date = db_date
+        else:
+            if db_date > max_date:
+                max_date = db_date
+            records.append(record)
+    if curr_cid:
+        yield curr_cid, records, max_date
+
+
+def fetch_rows(db_cursor, size=FETCH_SIZE):
+    """Rows of the executed query, fetched size rows at a time."""
+    while True:
+        rows = db_cursor.fetchmany(size)
+        if not rows:
+            return
+        for row in rows:
+            yield row
+
+
+def partition_bounds(min_cid, max_cid, partitions):
+    """Split the cids into ranges.
+
+    The span from min_cid to max_cid is split evenly, with the bounds as
+    numbers zero-padded to the width of max_cid. The first range has no lower
+    and the last no upper bound, so every cid is in exactly one range and the
+    ranges follow each other in cid order, even for cids that are not numbers.
+
+    Returns:
+        List of (lower, upper) bounds, None for an open bound.
+    """
+    cuts = []
+    if (
+        partitions > 1
+        and min_cid
+        and max_cid
+        and min_cid.isdigit()
+        and max_cid.isdigit()
+    ):
+        low, high = int(min_cid), int(max_cid)
+        for i in range(1, partitions):
+            cut = str(low + (high - low) * i // partitions).zfill(len(max_cid))
+            if min_cid < cut <= max_cid and cut not in cuts:
+                cuts.append(cut)
+    bounds = [None] + cuts + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def cid_partitions(db_cursor, partitions):
+    """Split the cids of the database into ranges (see partition_bounds)."""
+    db_cursor.execute(SQL_CID_RANGE)
+    min_cid, max_cid = db_cursor.fetchall()[0]
+    return partition_bounds(min_cid, max_cid, partitions)
+
+
+def partition_query(merge_version, lower, upper):
+    """The merge version query for the cids from lower up to upper.
+
+    Returns:
+        (query, params)
+    """
+    conditions = ""
+    params = []
+    if lower is not None:
+        conditions += "and cid >= %s "
+        params.append(lower)
+    if upper is not None:
+        conditions += "and cid < %s "
+        params.append(upper)
+    return SQL_RECORDS + conditions + SQL_ORDER[merge_version], params
+
+
+def read_partitions(connect, merge_version, bounds):
+    """Read the records of cid ranges with one connection per range.
+
+    Each range is queried by a reader thread on its own connection from
+    connect, so the server runs the queries at the same time. The readers
+    stream the rows with fetchmany and keep up to PARTITION_READ_AHEAD
+    batches ahead of the rows taken; the rows are yielded one range after
+    the other, so they are in the order of the merge version query.
+    An error in a reader is raised when its range is reached.
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=PARTITION_READ_AHEAD) for _ in bounds]
+
+    def reader(rows_queue, lower, upper):
+        try:
+            db_connection = connect()
+            try:
+                db_cursor = db_connection.cursor(buffered=False)
+                db_cursor.execute(
+                    "set session net_write_timeout = %s", (PARTITION_WRITE_TIMEOUT,)
+                )
+                db_cursor.execute(*partition_query(merge_version, lower, upper))
+                while not stop.is_set():
+                    rows = db_cursor.fetchmany(FETCH_SIZE)
+                    if not rows:
+                        break
+                    rows_queue.put(rows)
+            finally:
+                db_connection.close()
+        except Exception as err:
+            rows_queue.put(err)
+        rows_queue.put(None)
+
+    threads = [
+        threading.Thread(
+            target=reader,
+            args=(rows_queue, lower, upper),
+            name="cid-range-reader",
+            daemon=True,
+        )
+        for rows_queue, (lower, upper) in zip(queues, bounds)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for rows_queue in queues:
+            while True:
+                rows = rows_queue.get()
+                if rows is None:
+                    break
+                if isinstance(rows, Exception):
+                    raise rows
+                for row in rows:
+                    yield row
+    finally:
+        stop.set()
+        # keep taking batches, so the readers are not blocked
+        for rows_queue, thread in zip(queues, threads):
+            while thread.is_alive():
+                try:
+                    rows_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            thread.join()
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def cache_key(record_count, max_date):
+    return zlib.crc32("{}{}".format(record_count, max_date).encode("utf8"))
+
+
+def merge_clusters(clusters):
+    """Merge and serialize a batch of clusters.
+
+    Returns:
+        List of (cache_id, cache_key, cache_data, cache_date) entries.
+    """
+    entries = []
+    for cid, records, max_date in clusters:
+        cache_data = json.dumps(
+            VufindFormatter.create_record_dict(cid, records),
+            separators=(",", ":"),
+        )
+        entries.append((cid, cache_key(len(records), max_date), cache_data, max_date))
+    return entries
+
+
+def format_clusters(clusters):
+    """Merge, serialize and compress a batch of clusters.
+
+    Returns:
+        List of cache entry rows (see ExportCache.entry_row).
+    """
+    return [ExportCache.entry_row(*entry) for entry in merge_clusters(clusters)]
+
+
+def format_in_pool(pool, format_batch, batches, workers):
+    """Format batches of clusters with format_batch in a process pool.
+
+    At most two batches per worker are in progress at a time, so the reader
+    does not get ahead of the pool.
+
+    Yields:
+        Formatted batches, in the order of the input batches.
+    """
+    pending = collections.deque()
+    for batch in batches:
+        pending.append(pool.apply_async(format_batch, (batch,)))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def write_entries(cache, batches):
+    """Insert formatted batches into a new cache from a writer thread.
+
+    The writer loads the batches with ExportCache.bulk_build, inserting each
+    batch while the next ones are read and formatted. An error in the writer
+    is raised in the calling thread.
+    """
+    entries_queue = queue.Queue(maxsize=4)
+    errors = []
+
+    def writer():
+        try:
+            with cache.bulk_build() as insert:
+                while True:
+                    entries = entries_queue.get()
+                    if entries is None:
+                        break
+                    insert(entries)
+        except Exception as err:
+            errors.append(err)
+            # keep taking batches, so the reader is not blocked
+            while entries_queue.get() is not None:
+                pass
+
+    thread = threading.Thread(target=writer, name="cache-writer")
+    thread.start()
+    try:
+        for entries in batches:
+            if errors:
+                break
+            entries_queue.put(entries)
+    finally:
+        entries_queue.put(None)
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def latest_cache(cache_dir, merge_version):
+    """Path of the most recent dated cache of a merge version in a directory,
+    None when there is none."""
+    dated_cache = re.compile(
+        r"cache-{}-\d{{4}}-\d{{2}}-\d{{2}}\.db$".format(re.escape(merge_version))
+    )
+    caches = sorted(name for name in os.listdir(cache_dir) if dated_cache.match(name))
+    if caches:
+        return os.path.join(cache_dir, caches[-1])
+
+
+def load_live_index(db_cursor):
+    """The cache_key of each cluster in the database, computed as in
+    merge_clusters from the record count and last update of the cluster.
+
+    Returns:
+        Dict of cache_id: cache_key, with keys as stored in the cache.
+    """
+    db_cursor.execute(SQL_LIVE_INDEX)
+    return {
+        cid: str(cache_key(record_count, max_date))
+        for cid, record_count, max_date in db_cursor
+    }
+
+
+def read_cluster_rows(db_cursor, merge_version, cids):
+    """Rows of the given clusters, in the order of the merge version query."""
+    for cid_set in batched(sorted(cids), REFRESH_QUERY_SIZE):
+        db_cursor.execute(
+            SQL_RECORDS
+            + "and cid in ({}) ".format(", ".join(["%s"] * len(cid_set)))
+            + SQL_ORDER[merge_version],
+            cid_set,
+        )
+        for row in db_cursor.fetchall():
+            yield row
+
+
+def refresh_cache(cache, db_cursor, merge_version, pool=None, workers=1):
+    """Bring a cache up to date with the database.
+
+    Compares the cache with the live index of the database. Stale clusters
+    (changed cache_key) and uncached clusters (new cid) are formatted again and
+    upserted, clusters that are no longer in the database (unexamined) are
+    removed. Verified clusters are not read.
+
+    Returns:
+        The CacheComparison of the cache before the refresh.
+    """
+    comparison = cache.compare(load_live_index(db_cursor))
+    if comparison.unexamined:
+        cache.remove_set(comparison.unexamined)
+    rows = read_cluster_rows(
+        db_cursor, merge_version, comparison.stale | comparison.uncached
+    )
+    batches = batched(read_clusters(rows), CLUSTER_BATCH_SIZE)
+    if pool:
+        merged = format_in_pool(pool, merge_clusters, batches, workers)
+    else:
+        merged = (merge_clusters(batch) for batch in batches)
+    for entries in merged:
+        cache.upsert(entries)
+    return comparison
+
+
 if __name__ == "__main__":
     ht_bib_cache()
@@ -48,6 +48,27 @@ exec(
     default=False,
     help="Remove and rewrite over existing cache",
 )
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes formatting records for the cache",
+)
+@click.option(
+    "-r",
+    "--refresh",
+    is_flag=True,
+    default=False,
+    help="Update the latest cache with the changed clusters instead of rebuilding it",
+)
+@click.option(
+    "-p",
+    "--partitions",
+    type=int,
+    default=1,
+    help="Number of cid ranges read from the database in parallel for a new cache",
+)
 def generate_cli(state, **kwargs):
     """Generate Zephir exports files for HathiTrust."""
 
@@ -64,7 +85,11 @@ def generate_cli(state, **kwargs):
 
 
 def generate_cmd(app):
-    if app.args["cache_path"] and os.path.exists(app.args["cache_path"]):
+    if (
+        app.args["cache_path"]
+        and os.path.exists(app.args["cache_path"])
+        and not app.args["refresh"]
+    ):
         app.console.debug("Using existing cache {}".format(app.args["cache_path"]))
         cache = app.args["cache_path"]
     else:
@@ -73,6 +98,9 @@ def generate_cmd(app):
             cache_path=app.args["cache_path"],
             merge_version=app.args["merge_version"],
             force=app.args["force"],
+            workers=app.args["workers"],
+            refresh=app.args["refresh"],
+            partitions=app.args["partitions"],
         )
     if app.args["export_type"] == "ht-bib-full":
         ht_bib_full(
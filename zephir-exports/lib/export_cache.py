@@ -11,6 +11,24 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.ext.automap import automap_base
 
+# Columns of the cache table, in the order of entry_row
+CACHE_COLUMNS = (
+    "cache_id",
+    "cache_key",
+    "cache_data",
+    "cache_date",
+    "data_key",
+    "data_date",
+)
+CREATE_INDEX_STMT = (
+    "create index 'cache_id_key_index' ON 'cache' ('cache_id'	ASC,'cache_key');"
+)
+INSERT_STMT = "insert into cache ({}) values ({})".format(
+    ", ".join(CACHE_COLUMNS), ", ".join(["?"] * len(CACHE_COLUMNS))
+)
+# Page cache of a bulk build connection, in KiB
+BULK_BUILD_CACHE_SIZE = 256 * 1024
+
 
 class ExportCache:
     def __init__(self, cache_dir=None, name=None, force=False, path=None):
@@ -37,11 +55,7 @@ class ExportCache:
                     "PRIMARY KEY('cache_id'));"
                 )
                 con.execute(create_table_stmt)
-                create_index_stmt = (
-                    "create index 'cache_id_key_index' ON "
-                    "'cache' ('cache_id'	ASC,'cache_key');"
-                )
-                con.execute(create_index_stmt)
+                con.execute(CREATE_INDEX_STMT)
 
         metadata = MetaData()
         metadata.reflect(self.engine, only=["cache"])
@@ -73,6 +87,36 @@ class ExportCache:
     def session(self):
         return self.Session()
 
+    @contextmanager
+    def bulk_build(self, cache_size=BULK_BUILD_CACHE_SIZE):
+        """Load entries into a new cache. Yields a function that inserts a
+        list of entry rows (see entry_row) with one executemany.
+
+        The load runs in one transaction on its own sqlite connection, with
+        journal_mode=OFF, synchronous=OFF and a page cache of cache_size KiB.
+        These settings end with the connection, but a failed load can leave
+        the file corrupt, so only use it on a file that is discarded when the
+        build fails. The cache_id_key_index is dropped during the load and
+        created afterwards. The function must be called from the thread that
+        entered the context.
+        """
+        con = self.engine.raw_connection()
+        try:
+            cursor = con.cursor()
+            cursor.execute("pragma journal_mode=OFF")
+            cursor.execute("pragma synchronous=OFF")
+            cursor.execute("pragma cache_size=-{}".format(cache_size))
+            cursor.execute("drop index if exists cache_id_key_index")
+
+            def insert(rows):
+                cursor.executemany(INSERT_STMT, rows)
+
+            yield insert
+            cursor.execute(CREATE_INDEX_STMT)
+            con.commit()
+        finally:
+            con.close()
+
     def size(self):
         with self.session_context() as session:
             size = session.query(self.Cache).count()
@@ -97,33 +141,69 @@ class ExportCache:
             session.add(new_cache)
 
     def entry(self, cache_id, cache_key, cache_data, cache_date):
-        d_key = zlib.crc32(cache_data.encode("utf8"))
-        compressed_cache_data = zlib.compress(cache_data.encode("utf8"))
         new_cache = self.Cache(
-            cache_id=cache_id,
-            cache_key=cache_key,
-            cache_data=compressed_cache_data,
-            cache_date=cache_date,
-            data_key=d_key,
-            data_date=str(datetime.datetime.utcnow()),
+            **ExportCache.entry_values(cache_id, cache_key, cache_data, cache_date)
         )
         return new_cache
 
+    @staticmethod
+    def entry_values(cache_id, cache_key, cache_data, cache_date):
+        """Column values of a cache entry, with the data compressed. Used for
+        bulk inserts, and can be computed in another process."""
+        d_key = zlib.crc32(cache_data.encode("utf8"))
+        compressed_cache_data = zlib.compress(cache_data.encode("utf8"))
+        return {
+            "cache_id": cache_id,
+            "cache_key": cache_key,
+            "cache_data": compressed_cache_data,
+            "cache_date": cache_date,
+            "data_key": d_key,
+            "data_date": str(datetime.datetime.utcnow()),
+        }
+
+    @staticmethod
+    def entry_row(cache_id, cache_key, cache_data, cache_date):
+        """Column values of a cache entry in CACHE_COLUMNS order, for bulk_build."""
+        values = ExportCache.entry_values(cache_id, cache_key, cache_data, cache_date)
+        return tuple(values[column] for column in CACHE_COLUMNS)
+
     def update(self, cache_id, cache_key, cache_data, cache_date):
         with self.session_context() as session:
             cache = session.query(self.Cache).get(cache_id)
-            cache.cache_key = cache_key
-            cache.cache_date = cache_date
-            # only update the data fields if the data has updated
-            # note: the metadata changes indicated by a cache_key changes
-            # will not always cause the data to change.
-            data_key = str(zlib.crc32(cache_data.encode("utf8")))
-            if cache.data_key != data_key:
-                compressed_cache_data = zlib.compress(cache_data.encode("utf8"))
-                cache.cache_data = compressed_cache_data
-                # cache.cache_data = cache_data
-                cache.data_key = data_key
-                cache.data_date = str(datetime.datetime.utcnow())
+            self._update_entry(cache, cache_key, cache_data, cache_date)
+
+    def upsert(self, entries):
+        """Update or add a list of (cache_id, cache_key, cache_data, cache_date)
+        entries in one transaction. Existing entries are updated as by update."""
+        with self.session_context() as session:
+            cache_ids = [cache_id for cache_id, _, _, _ in entries]
+            existing = {
+                cache.cache_id: cache
+                for cache in session.query(self.Cache).filter(
+                    self.Cache.cache_id.in_(cache_ids)
+                )
+            }
+            for cache_id, cache_key, cache_data, cache_date in entries:
+                if cache_id in existing:
+                    self._update_entry(
+                        existing[cache_id], cache_key, cache_data, cache_date
+                    )
+                else:
+                    session.add(self.entry(cache_id, cache_key, cache_data, cache_date))
+
+    def _update_entry(self, cache, cache_key, cache_data, cache_date):
+        cache.cache_key = cache_key
+        cache.cache_date = cache_date
+        # only update the data fields if the data has updated
+        # note: the metadata changes indicated by a cache_key changes
+        # will not always cause the data to change.
+        data_key = str(zlib.crc32(cache_data.encode("utf8")))
+        if cache.data_key != data_key:
+            compressed_cache_data = zlib.compress(cache_data.encode("utf8"))
+            cache.cache_data = compressed_cache_data
+            # cache.cache_data = cache_data
+            cache.data_key = data_key
+            cache.data_date = str(datetime.datetime.utcnow())
 
     def compare(self, compare_index):
         cache_index = self._load_index()
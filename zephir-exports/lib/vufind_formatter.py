@@ -1,5 +1,15 @@
+import functools
+import json
+
 import pymarc
 
+# Fields of the holding records used by the merge
+HOLDING_TAGS = frozenset(["035", "974", "CID", "HOL"])
+
+
+class UnsupportedRecord(Exception):
+    """Raised when a record cannot be merged as a MARC-in-JSON dict."""
+
 
 class VufindFormatter:
     """VufindFormatter is a utility class for creating vufind records.
@@ -105,6 +115,264 @@ class VufindFormatter:
 
         return base_record
 
+    @staticmethod
+    def create_record_dict(cid, records):
+        """The create_record_dict method produces the formatted VuFind record of
+        create_record as a MARC-in-JSON dict, the same as
+        create_record(cid, records).as_dict().
+
+        The records are merged as parsed MARC-in-JSON dicts, without pymarc
+        records. The new 035 sdr and OCLC fields are collected in one pass and
+        inserted as blocks at the positions where create_record inserts them
+        one at a time. Only the fields the merge uses are read from the
+        holding records. Clusters that do not have the record structure this
+        relies on are merged with create_record.
+
+        Args:
+            cid: The CID for the created record, to be used in the 001.
+            records: A list of strings, representing the json records to be
+            parsed and combined into a single record.
+
+        Returns:
+            The merged record as a dict.
+
+        Raises:
+            ValueError: Raised if the record list is empty.
+
+        """
+
+        if len(records) == 0:
+            raise ValueError("Record list may not be empty")
+
+        try:
+            return VufindFormatter._merge_dicts(cid, records)
+        except UnsupportedRecord:
+            return VufindFormatter.create_record(cid, records).as_dict()
+
+    @staticmethod
+    def _merge_dicts(cid, records):
+        """The _merge_dicts method merges the records of create_record_dict.
+
+        Raises:
+            UnsupportedRecord: Raised if a record does not have the expected
+            structure, or the merge would fail in create_record.
+
+        """
+
+        base_record = None
+        base_sdr_idx = None
+        base_ocn_idx = None
+        holdings = []
+        sdrs = []
+        ocns = []
+        incl_sdrs = set()
+        incl_ocns = set()
+        mismatched_cids = []
+
+        for record in records:
+            tags = None if base_record is None else HOLDING_TAGS
+            json_records = VufindFormatter._read_json(record, tags)
+            for marc_record, tag_idx, zero35s in json_records:
+                fields = marc_record["fields"]
+                try:
+                    holding = fields[tag_idx["974"]]
+                    hol_subfields = fields[tag_idx["HOL"]]["HOL"]["subfields"]
+                    record_cid = VufindFormatter._subfield(
+                        "a", fields[tag_idx["CID"]]["CID"]["subfields"]
+                    )
+                    if base_record is None:
+                        fields[tag_idx["001"]]["001"] = cid
+                except KeyError:
+                    raise UnsupportedRecord()
+
+                # transfer source and collection code from bib-level field to 974 item-level field
+                VufindFormatter._insert_subfield_dict(
+                    "c",
+                    VufindFormatter._subfield("c", hol_subfields),
+                    holding["974"]["subfields"],
+                )
+                VufindFormatter._insert_subfield_dict(
+                    "b",
+                    VufindFormatter._subfield("s", hol_subfields),
+                    holding["974"]["subfields"],
+                )
+
+                if cid != record_cid:
+                    mismatched_cids.append(record_cid)
+
+                if base_record is None:
+                    base_record = marc_record
+                    for idx, value in zero35s:
+                        if value.startswith("sdr-"):
+                            incl_sdrs.add(value)
+                            base_sdr_idx = idx
+                        if value.startswith("(OCoLC)"):
+                            incl_ocns.add(value)
+                            if base_ocn_idx is None:
+                                base_ocn_idx = idx
+                else:
+                    holdings.append(holding)
+                    for idx, value in zero35s:
+                        if value.startswith("sdr-"):
+                            sdrs.append((value, fields[idx]))
+                        if value.startswith("(OCoLC)"):
+                            ocns.append((value, fields[idx]))
+
+        fields = base_record["fields"]
+        fields.extend(holdings)
+
+        # only include new sdrs (different holdings can share sdrs),
+        # inserted below the last sdr of the base record
+        base_sdr_count = len(incl_sdrs)
+        new_sdrs = []
+        for value, field in sdrs:
+            if value not in incl_sdrs:
+                new_sdrs.append(field)
+                incl_sdrs.add(value)
+        if new_sdrs:
+            if base_sdr_idx is None:
+                raise UnsupportedRecord()
+            pos = base_sdr_idx + base_sdr_count
+            fields[pos:pos] = new_sdrs
+            if base_ocn_idx is not None and pos <= base_ocn_idx:
+                base_ocn_idx += len(new_sdrs)
+
+        # only include new ocns, inserted below the first ocn of the base
+        # record, or else below the sdrs
+        base_ocn_count = len(incl_ocns)
+        new_ocns = []
+        for value, field in ocns:
+            if value not in incl_ocns:
+                new_ocns.append(field)
+                incl_ocns.add(value)
+        if new_ocns:
+            if base_ocn_idx is not None:
+                pos = base_ocn_idx + base_ocn_count
+            elif base_sdr_idx is not None:
+                pos = base_sdr_idx + len(incl_sdrs)
+            else:
+                raise UnsupportedRecord()
+            fields[pos:pos] = new_ocns
+
+        for record_cid in mismatched_cids:
+            # todo(cscollett): clean up after reconciling period is done
+            print("{} mismatched with {}".format(cid, record_cid))
+
+        return base_record
+
+    @staticmethod
+    def _read_json(record, tags=None):
+        """The _read_json method parses a json record string into
+        MARC-in-JSON dicts in the form of pymarc as_dict. With tags, only the
+        fields of those tags are read, the other fields are None.
+
+        Yields:
+            (record, tag_idx, zero35s) for each record in the string, where
+            tag_idx is the index of the first field of each tag, and zero35s
+            the index and value of each 035 field.
+
+        Raises:
+            UnsupportedRecord: Raised if the record is not read the same way
+            by pymarc.JSONReader.
+
+        """
+
+        if not isinstance(record, str):
+            raise UnsupportedRecord()
+        jobjs = json.loads(record, strict=False)
+        if isinstance(jobjs, dict):
+            jobjs = [jobjs]
+        elif not isinstance(jobjs, list):
+            raise UnsupportedRecord()
+
+        for jobj in jobjs:
+            if not isinstance(jobj, dict) or not isinstance(jobj.get("fields"), list):
+                raise UnsupportedRecord()
+            fields = []
+            tag_idx = {}
+            zero35s = []
+            for field in jobj["fields"]:
+                if not isinstance(field, dict) or len(field) != 1:
+                    raise UnsupportedRecord()
+                ((tag, value),) = field.items()
+                if VufindFormatter._normalized_tag(tag) != tag:
+                    raise UnsupportedRecord()
+                if tags is not None and tag not in tags:
+                    fields.append(None)
+                    continue
+                if tag < "010" and tag.isdigit():
+                    if not isinstance(value, str):
+                        raise UnsupportedRecord()
+                    field = {tag: value}
+                else:
+                    try:
+                        ind1 = value["ind1"]
+                        ind2 = value["ind2"]
+                        subfields = [
+                            {code: sub_value}
+                            for sub in value["subfields"]
+                            for code, sub_value in sub.items()
+                        ]
+                    except (KeyError, TypeError, AttributeError):
+                        raise UnsupportedRecord()
+                    if not (isinstance(ind1, str) and isinstance(ind2, str)):
+                        raise UnsupportedRecord()
+                    field = {tag: {"subfields": subfields, "ind1": ind1, "ind2": ind2}}
+                    if tag == "035":
+                        zero35s.append(
+                            (len(fields), VufindFormatter._field_value(subfields))
+                        )
+                tag_idx.setdefault(tag, len(fields))
+                fields.append(field)
+            marc_record = {"leader": str(jobj["leader"]), "fields": fields}
+            yield marc_record, tag_idx, zero35s
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _normalized_tag(tag):
+        """The _normalized_tag method returns a tag the way pymarc.Field
+        normalizes it."""
+
+        try:
+            return "%03i" % int(tag)
+        except ValueError:
+            return "%03s" % tag
+
+    @staticmethod
+    def _field_value(subfields):
+        """The _field_value method returns the value of a data field the way
+        pymarc.Field.value does."""
+
+        values = []
+        for subfield in subfields:
+            for value in subfield.values():
+                if not isinstance(value, str):
+                    raise UnsupportedRecord()
+                values.append(value.strip())
+        return " ".join(values)
+
+    @staticmethod
+    def _subfield(code, subfields):
+        """The _subfield method returns the first value of a subfield code,
+        None if there is none."""
+
+        for subfield in subfields:
+            if code in subfield:
+                return subfield[code]
+        return None
+
+    @staticmethod
+    def _insert_subfield_dict(code, value, subfields):
+        """The _insert_subfield_dict method inserts a new subfield in
+        MARC-in-JSON subfields in alpha-numeric order, as _insert_subfield."""
+
+        pos = len(subfields)
+        for idx, subfield in enumerate(subfields):
+            if code <= next(iter(subfield)):
+                pos = idx
+                break
+        subfields.insert(pos, {code: value})
+
     @staticmethod
     def _insert_subfield(indicator, value, subfields_list):
         """The _insert_subfield method is a helper to insert a new subfield in
@@ -4,6 +4,9 @@ import os
 import pytest
 
 from exports.ht_bib_cache import ht_bib_cache
+from exports.ht_bib_cache import latest_cache
+from exports.ht_bib_cache import partition_bounds
+from exports.ht_bib_cache import read_clusters
 from lib.export_cache import ExportCache
 from lib.utils import ConsoleMessenger
 
@@ -19,11 +22,14 @@ def env_setup(td_tmpdir, monkeypatch):
     os.system("mysql --host=localhost --user=root  < {}/micro-db.sql".format(td_tmpdir))
 
 
-def test_create_cache_successfully(td_tmpdir, env_setup, capsys, pytestconfig):
+@pytest.mark.parametrize("options", [{}, {"workers": 2}, {"partitions": 3}])
+def test_create_cache_successfully(td_tmpdir, env_setup, capsys, pytestconfig, options):
     for merge_version in ["v2", "v3"]:
 
         console = ConsoleMessenger(verbosity=pytestconfig.getoption("verbose"))
-        ht_bib_cache(console=console, merge_version=merge_version, force=True)
+        ht_bib_cache(
+            console=console, merge_version=merge_version, force=True, **options
+        )
 
         new_cache = ExportCache(
             td_tmpdir,
@@ -38,6 +44,70 @@ def test_create_cache_successfully(td_tmpdir, env_setup, capsys, pytestconfig):
         )
 
 
+def test_refresh_cache(td_tmpdir, env_setup, capsys, pytestconfig):
+    console = ConsoleMessenger(verbosity=2)
+    previous_cache_path = os.path.join(td_tmpdir, "cache-v3-2019-01-01.db")
+    cache_path = ht_bib_cache(console=console, merge_version="v3", force=True)
+    os.rename(cache_path, previous_cache_path)
+    capsys.readouterr()
+    ht_bib_cache(console=console, merge_version="v3", refresh=True)
+    out, err = capsys.readouterr()
+    assert "Refreshing cache: {}".format(previous_cache_path) in err
+    assert "Refreshed 0 stale and 0 uncached clusters, removed 0" in err
+
+    new_cache = ExportCache(
+        td_tmpdir,
+        "cache-v3-{}".format(datetime.datetime.today().strftime("%Y-%m-%d")),
+    )
+    ref_cache = ExportCache(td_tmpdir, "cache-v3-ref")
+    assert hash(new_cache.frozen_content_set()) == hash(ref_cache.frozen_content_set())
+
+
+def test_latest_cache(tmpdir):
+    for name in [
+        "cache-v3-2019-01-01.db",
+        "cache-v3-2019-01-02.db",
+        "cache-v2-2019-01-03.db",
+        "cache-v3-ref.db",
+        "tmp-cache-v3-2019-01-04",
+    ]:
+        open(os.path.join(tmpdir, name), "w").close()
+    latest = latest_cache(str(tmpdir), "v3")
+    assert latest == os.path.join(tmpdir, "cache-v3-2019-01-02.db")
+    assert latest_cache(str(tmpdir), "v4") is None
+
+
+def test_read_clusters():
+    rows = [
+        ("001", "2019-01-02", "r1", 0, 1, "001_1"),
+        ("001", "2019-01-03", "r2", 0, 1, "001_2"),
+        ("001", "2019-01-01", "r3", 0, 1, "001_3"),
+        ("002", "2019-01-01", "r4", 0, 1, "002_4"),
+    ]
+    assert list(read_clusters(rows)) == [
+        ("001", ["r1", "r2", "r3"], "2019-01-03"),
+        ("002", ["r4"], "2019-01-01"),
+    ]
+    assert list(read_clusters([])) == []
+
+
+def test_partition_bounds():
+    assert partition_bounds("000000100", "000000400", 3) == [
+        (None, "000000200"),
+        ("000000200", "000000300"),
+        ("000000300", None),
+    ]
+    assert partition_bounds("000000100", "000000104", 3) == [
+        (None, "000000101"),
+        ("000000101", "000000102"),
+        ("000000102", None),
+    ]
+    assert partition_bounds("000000100", "000000101", 4) == [(None, None)]
+    assert partition_bounds("000000100", "000000400", 1) == [(None, None)]
+    assert partition_bounds(None, None, 3) == [(None, None)]
+    assert partition_bounds("abc", "xyz", 3) == [(None, None)]
+
+
 def test_reuse_existing_cache(td_tmpdir, env_setup, capsys, pytestconfig):
     console = ConsoleMessenger(verbosity=2)
     ht_bib_cache(console=console, merge_version="v3", force=False)
@@ -73,6 +73,60 @@ def test_update_to_cache_key_only_without_data_update(td_tmpdir):
     assert cache.get("012345")["cache_data"] == first_result["cache_data"]
 
 
+def test_upsert_updates_and_adds(td_tmpdir):
+    cache = ExportCache(td_tmpdir, "empty-cache")
+    cache.add(
+        "012345", "C7EE1838", '{"leader":"this is marc data"}', "2016-06-29 11:09:04"
+    )
+    cache.add("67891", "R9PE2815", '{"leader":"unchanged"}', "2018-06-29 11:09:04")
+    first_result = cache.get("012345")
+    cache.upsert(
+        [
+            ("012345", "NEWKEY", '{"leader":"this is new marc data"}', "NEWDATE"),
+            ("11111", "2222222", '{"leader":"new cluster"}', "2017-06-29 11:09:04"),
+        ]
+    )
+    assert cache.size() == 3
+    assert cache.get("012345")["cache_key"] == "NEWKEY"
+    assert cache.get("012345")["cache_date"] == "NEWDATE"
+    assert cache.get("012345")["data_key"] != first_result["data_key"]
+    assert cache.get("11111")["cache_key"] == "2222222"
+    assert cache.get("67891")["cache_key"] == "R9PE2815"
+
+
+def test_bulk_build_same_as_add(td_tmpdir):
+    entries = [
+        (
+            "012345",
+            "C7EE1838",
+            '{"leader":"01158nam a22003491  4500"}',
+            "2016-06-29 11:09:04",
+        ),
+        (
+            "67891",
+            "R9PE2815",
+            '{"leader":"02258nam a22003491  4500"}',
+            "2018-06-29 11:09:04",
+        ),
+    ]
+    cache = ExportCache(td_tmpdir, "cache")
+    for entry in entries:
+        cache.add(*entry)
+    bulk_cache = ExportCache(td_tmpdir, "bulk-cache")
+    with bulk_cache.bulk_build() as insert:
+        insert([ExportCache.entry_row(*entry) for entry in entries])
+    assert bulk_cache.frozen_content_set() == cache.frozen_content_set()
+    for cache_id in ["012345", "67891"]:
+        result = bulk_cache.get(cache_id)
+        expected = cache.get(cache_id)
+        assert result["cache_data"] == expected["cache_data"]
+        assert result["data_key"] == expected["data_key"]
+    with bulk_cache.engine.connect() as con:
+        query = "select name from sqlite_master where type = 'index'"
+        indexes = [row[0] for row in con.execute(query)]
+    assert "cache_id_key_index" in indexes
+
+
 def test_remove_set(td_tmpdir):
     cache = ExportCache(td_tmpdir, "empty-cache")
     first_entry = {
@@ -1,3 +1,4 @@
+import json
 import os
 
 import pytest
@@ -82,6 +83,64 @@ def test_vufind_merged_no_ocns(td_tmpdir):
     assert len(vufind_record.get_fields("035")) == 6
     assert vufind_record.get_fields("974")[0]["u"] == "mdp.39015018415946"
 
+def read_records(td_tmpdir, name):
+    with open(os.path.join(td_tmpdir, name), "r") as f:
+        return [line for line in f]
+
+
+def same_as_create_record(cid, records):
+    expected = json.dumps(
+        VufindFormatter.create_record(cid, records).as_dict(), separators=(",", ":")
+    )
+    merged = json.dumps(
+        VufindFormatter.create_record_dict(cid, records), separators=(",", ":")
+    )
+    return merged == expected
+
+
+def test_create_record_dict_same_as_create_record(td_tmpdir):
+    for cid in ["000000001", "000000002", "000000003"]:
+        records = read_records(td_tmpdir, "{}.json".format(cid))
+        assert same_as_create_record(cid, records)
+        # every record as base
+        for i in range(1, len(records)):
+            assert same_as_create_record(cid, records[i:] + records[:i])
+
+
+def test_create_record_dict_large_cluster(td_tmpdir):
+    records = read_records(td_tmpdir, "000000001.json")
+    for copy in range(300):
+        record = json.loads(records[1 + copy % 4])
+        for field in record["fields"]:
+            if "035" in field:
+                subfield = field["035"]["subfields"][0]
+                subfield["a"] = "{}-{}".format(subfield["a"], copy % 120)
+        records.append(json.dumps(record))
+    assert same_as_create_record("000000001", records)
+
+
+def test_create_record_dict_falls_back_to_create_record(td_tmpdir):
+    records = read_records(td_tmpdir, "000000001.json")
+    # pymarc reads the tag "35" as 035
+    record = json.loads(records[1])
+    record["fields"].append(
+        {"35": {"ind1": " ", "ind2": " ", "subfields": [{"a": "sdr-NEW"}]}}
+    )
+    records[1] = json.dumps(record)
+    assert same_as_create_record("000000001", records)
+    zero35s = [
+        field["035"]["subfields"][0]["a"]
+        for field in VufindFormatter.create_record_dict("000000001", records)["fields"]
+        if "035" in field
+    ]
+    assert "sdr-NEW" in zero35s
+
+
+def test_create_record_dict_value_error_raised_with_empty_list():
+    with pytest.raises(ValueError):
+        VufindFormatter.create_record_dict("000000001", [])
+
+
 def test_value_error_raised_with_empty_list():
     records = []
     with pytest.raises(ValueError):
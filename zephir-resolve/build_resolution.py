@@ -0,0 +1,81 @@
+import os
+
+import click
+
+from concordance_sort import sort_concordance_by_primary
+from create_cluster_table import compact_clusters
+from resolution_table import ResolutionTable
+from resolution_table import BUILD_WRITE_BUFFER_SIZE
+from resolution_table import echo_progress
+
+
+@click.command()
+@click.argument("input_path", nargs=1, type=click.Path(exists=True))
+@click.argument("output_path", type=click.Path(exists=True, file_okay=False))
+@click.option("--memory", default=1024, help="Memory budget for sorting in MB")
+@click.option("--tmp-dir", default=None, help="Directory for temporary sort files")
+@click.option(
+    "--batch-size", default=100000, help="Rows written per LevelDB write batch"
+)
+@click.option("--workers", default=1, help="Processes sorting the concordance")
+@click.pass_context
+def build_resolution(
+    ctx,
+    input_path,
+    output_path=".",
+    memory=1024,
+    tmp_dir=None,
+    batch_size=100000,
+    workers=1,
+):
+    """Build the primary and cluster resolution tables from a concordance in one pass
+
+    The concordance is sorted by primary OCN once and the sorted rows are
+    written to both LevelDB tables as they stream by, without intermediate
+    tsv files.
+
+    INPUT_PATH is the path of a concordance tsv file
+
+    OUTPUT_PATH is the directory for the primary-table and cluster LevelDB tables
+    """
+
+    if os.path.isdir(input_path):
+        raise Exception("A valid path to the concordance file is required")
+
+    primary_rt = ResolutionTable(
+        os.path.join(output_path, "primary-table"),
+        key=int,
+        value=int,
+        write_buffer_size=BUILD_WRITE_BUFFER_SIZE,
+    )
+    cluster_rt = ResolutionTable(
+        os.path.join(output_path, "cluster"),
+        key=int,
+        value=list,
+        write_buffer_size=BUILD_WRITE_BUFFER_SIZE,
+    )
+    primary_writer = primary_rt.bulk_writer(batch_size, progress=echo_progress)
+    cluster_writer = cluster_rt.bulk_writer(batch_size)
+
+    rows = sort_concordance_by_primary(
+        input_path, memory_mb=memory, tmp_dir=tmp_dir, workers=workers
+    )
+    for primary, cluster in compact_clusters(write_primaries(rows, primary_writer)):
+        cluster_writer.put(primary, cluster)
+
+    primary_writer.close()
+    cluster_writer.close()
+    primary_rt.close()
+    cluster_rt.close()
+    return primary_rt.path, cluster_rt.path
+
+
+def write_primaries(rows, writer):
+    """Write (primary, oclc) rows to the primary table writer and pass them on"""
+    for primary, oclc in rows:
+        writer.put(oclc, primary)
+        yield [primary, oclc]
+
+
+if __name__ == "__main__":
+    build_resolution()
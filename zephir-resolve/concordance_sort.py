@@ -0,0 +1,315 @@
+import heapq
+import io
+import itertools
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Approximate peak bytes per concordance row while a chunk is parsed and sorted
+BYTES_PER_ROW = 64
+# Approximate bytes per row of a merge buffer, held as a Python tuple of ints
+MERGE_BYTES_PER_ROW = 160
+# Fewest rows read from each sorted run at a time while merging. When the
+# memory budget leaves fewer rows per run, groups of runs are merged into
+# larger runs first.
+MIN_MERGE_BLOCK_ROWS = 1024
+
+
+def chunksize_for_memory(memory_mb):
+    """Number of concordance rows to sort in memory at a time for a memory budget"""
+    return max(1, int(memory_mb * 1024 * 1024 // BYTES_PER_ROW))
+
+
+def merge_block_rows(memory_mb, runs):
+    """Number of rows read from each run at a time when merging runs within a
+    memory budget, counting one more buffer for the merged output"""
+    return max(1, int(memory_mb * 1024 * 1024 // (MERGE_BYTES_PER_ROW * (runs + 1))))
+
+
+def merge_fan_in(memory_mb):
+    """Number of runs merged at a time within a memory budget, so that at least
+    MIN_MERGE_BLOCK_ROWS rows are read from each run at a time"""
+    buffers = memory_mb * 1024 * 1024 // (MERGE_BYTES_PER_ROW * MIN_MERGE_BLOCK_ROWS)
+    return max(2, int(buffers) - 1)
+
+
+class FileRange(io.RawIOBase):
+    """Read-only file object over the bytes [start, end) of a file"""
+
+    def __init__(self, path, start, end):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._remaining)
+        if size <= 0:
+            return 0
+        read = self._file.readinto(memoryview(buffer)[:size])
+        self._remaining -= read
+        return read
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def split_file(path, parts):
+    """Split a file into byte ranges that start and end at line boundaries
+
+    Returns:
+        List of (start, end) byte offsets, at most parts long.
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for part in range(1, parts):
+            offset = max(size * part // parts, bounds[-1])
+            f.seek(offset)
+            if offset > 0:
+                f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def read_concordance_chunks(input_path, chunksize, byte_range=None):
+    """Read a concordance file in chunks
+
+    Rows are (oclc, primary) integer pairs separated by tabs or spaces.
+
+    Args:
+        input_path: path of the concordance file
+        chunksize: number of rows per chunk
+        byte_range: optional (start, end) byte offsets of the part of the file to read
+
+    Yields:
+        int64 numpy arrays with one row per concordance row: [oclc, primary]
+    """
+    source = input_path
+    if byte_range:
+        source = io.BufferedReader(FileRange(input_path, *byte_range))
+    reader = pd.read_csv(
+        source,
+        sep=r"\s+",
+        names=["oclc", "primary"],
+        dtype=np.int64,
+        chunksize=chunksize,
+    )
+    try:
+        for chunk in reader:
+            yield chunk.to_numpy(dtype=np.int64)
+    finally:
+        if byte_range:
+            source.close()
+
+
+def write_sorted_runs(
+    input_path, run_dir, chunksize, primary_only=False, byte_range=None, prefix="run"
+):
+    """Sort a concordance file by (primary, oclc) into sorted run files
+
+    Args:
+        input_path: path of the concordance file
+        run_dir: directory for the run files
+        chunksize: number of rows sorted in memory at a time
+        primary_only: keep only the rows where oclc is the primary
+        byte_range: optional (start, end) byte offsets of the part of the file to sort
+        prefix: run file name prefix
+
+    Returns:
+        List of run file paths. Each run holds [primary, oclc] rows.
+    """
+    run_paths = []
+    for chunk in read_concordance_chunks(input_path, chunksize, byte_range):
+        if primary_only:
+            chunk = chunk[chunk[:, 0] == chunk[:, 1]]
+        order = np.lexsort((chunk[:, 0], chunk[:, 1]))
+        run = chunk[order][:, ::-1]
+        run_name = "{}-{:06d}.npy".format(prefix, len(run_paths))
+        run_path = os.path.join(run_dir, run_name)
+        np.save(run_path, run)
+        run_paths.append(run_path)
+    return run_paths
+
+
+def write_ocn_sorted_runs(input_path, run_dir, chunksize, prefix="ocn"):
+    """Sort a concordance file by oclc into sorted run files
+
+    Only the last row of each oclc in a chunk is kept. The rows are tagged
+    with the run number, so rows of later runs sort after rows of earlier
+    runs with the same oclc.
+
+    Returns:
+        List of run file paths. Each run holds [oclc, run number, primary] rows.
+    """
+    run_paths = []
+    for chunk in read_concordance_chunks(input_path, chunksize):
+        chunk = chunk[np.argsort(chunk[:, 0], kind="stable")]
+        last_of_oclc = np.ones(len(chunk), dtype=bool)
+        last_of_oclc[:-1] = chunk[1:, 0] != chunk[:-1, 0]
+        chunk = chunk[last_of_oclc]
+        run_number = np.full(len(chunk), len(run_paths), dtype=np.int64)
+        run = np.column_stack((chunk[:, 0], run_number, chunk[:, 1]))
+        run_name = "{}-{:06d}.npy".format(prefix, len(run_paths))
+        run_path = os.path.join(run_dir, run_name)
+        np.save(run_path, run)
+        run_paths.append(run_path)
+    return run_paths
+
+
+def read_run(run_path, block_rows=MIN_MERGE_BLOCK_ROWS):
+    run = np.load(run_path, mmap_mode="r")
+    for start in range(0, len(run), block_rows):
+        end = start + block_rows
+        for row in run[start:end].tolist():
+            yield tuple(row)
+
+
+def merge_runs(run_paths, block_rows=MIN_MERGE_BLOCK_ROWS):
+    """Merge sorted run files into one sorted stream of (primary, oclc) tuples"""
+    return heapq.merge(*[read_run(path, block_rows) for path in run_paths])
+
+
+def write_merged_run(run_paths, run_path, block_rows):
+    """Merge sorted run files into one run file, block_rows rows at a time"""
+    shapes = [np.load(path, mmap_mode="r").shape for path in run_paths]
+    rows = sum(shape[0] for shape in shapes)
+    # write the header of the merged array, then append the rows to the file
+    header = np.lib.format.open_memmap(
+        run_path, mode="w+", dtype=np.int64, shape=(rows, shapes[0][1])
+    )
+    offset = header.offset
+    del header
+    merged = merge_runs(run_paths, block_rows)
+    with open(run_path, "r+b") as f:
+        f.seek(offset)
+        while True:
+            block = list(itertools.islice(merged, block_rows))
+            if not block:
+                break
+            f.write(np.array(block, dtype=np.int64).tobytes())
+
+
+def reduce_runs(run_paths, run_dir, memory_mb):
+    """Merge groups of runs into larger runs until they can be merged in one pass
+    within the memory budget
+
+    Returns:
+        List of run file paths, at most merge_fan_in(memory_mb) long.
+    """
+    fan_in = merge_fan_in(memory_mb)
+    block_rows = merge_block_rows(memory_mb, fan_in)
+    merge_pass = 0
+    while len(run_paths) > fan_in:
+        merged_paths = []
+        for start in range(0, len(run_paths), fan_in):
+            end = start + fan_in
+            group = run_paths[start:end]
+            if len(group) == 1:
+                merged_paths.extend(group)
+                continue
+            run_name = "merge{:03d}-{:06d}.npy".format(merge_pass, len(merged_paths))
+            run_path = os.path.join(run_dir, run_name)
+            write_merged_run(group, run_path, block_rows)
+            for path in group:
+                os.remove(path)
+            merged_paths.append(run_path)
+        run_paths = merged_paths
+        merge_pass += 1
+    return run_paths
+
+
+def sort_concordance_by_primary(
+    input_path,
+    memory_mb=1024,
+    chunksize=None,
+    tmp_dir=None,
+    primary_only=False,
+    workers=1,
+):
+    """Stream the rows of a concordance file sorted by (primary, oclc)
+
+    Sorts the file with an external merge sort, so the whole file is never
+    held in memory. Chunks of the file are sorted in memory and written to
+    temporary run files, then the runs are merged.
+
+    With more than one worker, the file is split into line aligned byte
+    ranges which are parsed and sorted into runs by a pool of processes.
+    The memory budget is shared by the workers.
+
+    The runs are merged with buffers sized from the memory budget. When
+    there are too many runs for buffers of MIN_MERGE_BLOCK_ROWS rows, groups
+    of runs are merged into larger runs first.
+
+    Args:
+        input_path: path of the concordance file with (oclc, primary) rows
+        memory_mb: memory budget for sorting in MB
+        chunksize: rows sorted in memory at a time, overrides memory_mb
+        tmp_dir: directory for the temporary run files
+        primary_only: keep only the rows where oclc is the primary
+        workers: number of processes sorting the file
+
+    Yields:
+        (primary, oclc) tuples of integers
+    """
+    chunksize = chunksize or chunksize_for_memory(memory_mb)
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        if workers > 1:
+            ranges = split_file(input_path, workers)
+            args = [
+                (
+                    input_path,
+                    run_dir,
+                    max(1, chunksize // workers),
+                    primary_only,
+                    byte_range,
+                    "run{:03d}".format(part),
+                )
+                for part, byte_range in enumerate(ranges)
+            ]
+            with multiprocessing.Pool(workers) as pool:
+                run_paths = sum(pool.starmap(write_sorted_runs, args), [])
+        else:
+            run_paths = write_sorted_runs(input_path, run_dir, chunksize, primary_only)
+        run_paths = reduce_runs(run_paths, run_dir, memory_mb)
+        block_rows = merge_block_rows(memory_mb, len(run_paths))
+        for row in merge_runs(run_paths, block_rows):
+            yield row
+
+
+def sort_concordance_by_ocn(input_path, memory_mb=1024, chunksize=None, tmp_dir=None):
+    """Stream the rows of a concordance file sorted by oclc, one row per oclc
+
+    Sorts the file with the same external merge sort as
+    sort_concordance_by_primary. When an oclc is listed more than once, the
+    last row wins, as it does when the rows are loaded into a LevelDB
+    resolution table.
+
+    Args:
+        input_path: path of the concordance file with (oclc, primary) rows
+        memory_mb: memory budget for sorting in MB
+        chunksize: rows sorted in memory at a time, overrides memory_mb
+        tmp_dir: directory for the temporary run files
+
+    Yields:
+        (oclc, primary) tuples of integers
+    """
+    chunksize = chunksize or chunksize_for_memory(memory_mb)
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        run_paths = write_ocn_sorted_runs(input_path, run_dir, chunksize)
+        run_paths = reduce_runs(run_paths, run_dir, memory_mb)
+        block_rows = merge_block_rows(memory_mb, len(run_paths))
+        previous = None
+        for oclc, _, primary in merge_runs(run_paths, block_rows):
+            if previous is not None and oclc != previous[0]:
+                yield previous
+            previous = (oclc, primary)
+        if previous is not None:
+            yield previous
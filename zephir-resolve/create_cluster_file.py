@@ -2,14 +2,17 @@ import datetime
 import os
 
 import click
-import pandas as pd
+
+from concordance_sort import sort_concordance_by_primary
 
 
 @click.command()
 @click.argument("input_path", nargs=1, type=click.Path(exists=True))
 @click.argument("output_path", type=click.Path())
+@click.option("--memory", default=1024, help="Memory budget for sorting in MB")
+@click.option("--tmp-dir", default=None, help="Directory for temporary sort files")
 @click.pass_context
-def create_cluster_file(ctx, input_path, output_path="."):
+def create_cluster_file(ctx, input_path, output_path=".", memory=1024, tmp_dir=None):
     """Create a cluster datafile for use in building a
     resolution table for concordance lookup
 
@@ -28,14 +31,12 @@ def create_cluster_file(ctx, input_path, output_path="."):
     else:
         cluster_file_path = output_path
 
-    # load the validated concordance from HT
-    validated_concord_df = pd.read_csv(
-        validated_concord_path, sep="\t", names=["oclc", "primary"]
-    )
-    # sort and export
-    validated_concord_df[["primary", "oclc"]].sort_values(["primary", "oclc"]).to_csv(
-        cluster_file_path, index=False, header=False, sep="\t"
-    )
+    # stream the validated concordance from HT sorted by primary and export
+    with open(cluster_file_path, "w") as outfile:
+        for primary, oclc in sort_concordance_by_primary(
+            validated_concord_path, memory_mb=memory, tmp_dir=tmp_dir
+        ):
+            outfile.write("{}\t{}\n".format(primary, oclc))
     return cluster_file_path
 
 
@@ -6,13 +6,18 @@ import click
 import plyvel
 
 from resolution_table import ResolutionTable
+from resolution_table import BUILD_WRITE_BUFFER_SIZE
+from resolution_table import echo_progress
 
 
 @click.command()
 @click.argument("input_path", nargs=1, type=click.Path(exists=True))
 @click.argument("output_path", type=click.Path())
+@click.option(
+    "--batch-size", default=100000, help="Rows written per LevelDB write batch"
+)
 @click.pass_context
-def create_cluster_table(ctx, input_path, output_path="."):
+def create_cluster_table(ctx, input_path, output_path=".", batch_size=100000):
     """Create a LevelDB cluster resolution table for concordance lookup
 
     INPUT_PATH is the path of a generated cluster tsv file
@@ -30,9 +35,18 @@ def create_cluster_table(ctx, input_path, output_path="."):
     else:
         cluster_db_path = output_path
 
-    rt = ResolutionTable(os.path.join(cluster_db_path), key=int, value=list)
+    rt = ResolutionTable(
+        os.path.join(cluster_db_path),
+        key=int,
+        value=list,
+        write_buffer_size=BUILD_WRITE_BUFFER_SIZE,
+    )
     with open(cluster_file_path) as f:
-        rt.bulk_load(compact_clusters(force_types(csv.reader(f, delimiter="\t"))))
+        rt.bulk_build(
+            compact_clusters(force_types(csv.reader(f, delimiter="\t"))),
+            batch_size=batch_size,
+            progress=echo_progress,
+        )
     rt.close()
     return rt.path
 
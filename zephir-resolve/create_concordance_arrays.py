@@ -0,0 +1,169 @@
+import itertools
+import os
+import tempfile
+
+import click
+import numpy as np
+
+from concordance_sort import sort_concordance_by_ocn
+from concordance_sort import sort_concordance_by_primary
+
+# Array files of the sorted-array concordance format, read with numpy memory mapping:
+#   ocns.npy, primaries.npy: every OCN and its primary OCN, sorted by OCN
+#   cluster_primaries.npy: primary OCNs with previous OCNs, sorted
+#   cluster_offsets.npy: start of each primary's previous OCNs in cluster_ocns.npy,
+#       with one extra entry for the end of the last cluster
+#   cluster_ocns.npy: previous OCNs grouped by primary, sorted within each group
+ARRAY_FILES = [
+    "ocns.npy",
+    "primaries.npy",
+    "cluster_primaries.npy",
+    "cluster_offsets.npy",
+    "cluster_ocns.npy",
+]
+DTYPE = np.uint64
+# Rows converted from the sorted streams to arrays at a time
+WRITE_BLOCK_ROWS = 65536
+
+
+@click.command()
+@click.argument("input_path", nargs=1, type=click.Path(exists=True))
+@click.argument("output_path", type=click.Path())
+@click.option("--memory", default=1024, help="Memory budget for sorting in MB")
+@click.option("--tmp-dir", default=None, help="Directory for temporary sort files")
+@click.pass_context
+def create_concordance_arrays(
+    ctx, input_path, output_path=".", memory=1024, tmp_dir=None
+):
+    """Create a sorted-array concordance for memory mapped lookups
+
+    The sorted-array concordance holds the same data as the primary and cluster
+    LevelDB resolution tables, in flat uint64 arrays.
+
+    INPUT_PATH is the path of a generated primary tsv file (ocn, primary)
+
+    OUTPUT_PATH is the directory for the concordance array files
+    """
+
+    if os.path.isdir(input_path):
+        raise Exception("A valid path to the primary tsv is required")
+
+    if os.path.exists(output_path) and not os.path.isdir(output_path):
+        raise Exception("A directory path for the concordance arrays is required")
+    os.makedirs(output_path, exist_ok=True)
+
+    write_concordance_arrays(input_path, output_path, memory_mb=memory, tmp_dir=tmp_dir)
+    return output_path
+
+
+class ArrayFileWriter:
+    """Write a one dimensional array file block by block
+
+    The length of the array is not known until the last block is written, so
+    the blocks are staged in a raw file and copied into the memory mapped
+    array file on close.
+    """
+
+    def __init__(self, path, staging_path):
+        self.path = path
+        self.staging_path = staging_path
+        self.rows = 0
+        self._staging = open(staging_path, "wb")
+
+    def write(self, values):
+        np.asarray(values, dtype=DTYPE).tofile(self._staging)
+        self.rows += len(values)
+
+    def close(self):
+        self._staging.close()
+        array = np.lib.format.open_memmap(
+            self.path, mode="w+", dtype=DTYPE, shape=(self.rows,)
+        )
+        if self.rows:
+            staged = np.memmap(self.staging_path, dtype=DTYPE, mode="r")
+            for start in range(0, self.rows, WRITE_BLOCK_ROWS):
+                end = start + WRITE_BLOCK_ROWS
+                array[start:end] = staged[start:end]
+            del staged
+        array.flush()
+        del array
+        os.remove(self.staging_path)
+
+
+def iter_blocks(rows):
+    """Group a stream of integer tuples into uint64 arrays of WRITE_BLOCK_ROWS rows"""
+    rows = iter(rows)
+    while True:
+        block = list(itertools.islice(rows, WRITE_BLOCK_ROWS))
+        if not block:
+            return
+        yield np.array(block, dtype=DTYPE)
+
+
+def write_concordance_arrays(
+    input_path, output_path, memory_mb=1024, chunksize=None, tmp_dir=None
+):
+    """Write the sorted-array concordance files for a concordance file
+
+    The concordance is never held in memory. It is sorted by OCN with an
+    external sort to write ocns.npy and primaries.npy, and the previous OCNs
+    are then sorted by (primary, ocn) to write the cluster arrays.
+
+    When an OCN is listed more than once, the last row wins, as it does
+    when the rows are loaded into a LevelDB resolution table.
+
+    Args:
+        input_path: path of the concordance file with (ocn, primary) rows
+        output_path: directory for the array files
+        memory_mb: memory budget for sorting in MB
+        chunksize: rows sorted in memory at a time, overrides memory_mb
+        tmp_dir: directory for temporary files
+    """
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+        arrays = {
+            filename: ArrayFileWriter(
+                os.path.join(output_path, filename),
+                os.path.join(work_dir, filename + ".raw"),
+            )
+            for filename in ARRAY_FILES
+        }
+        previous_path = os.path.join(work_dir, "previous.tsv")
+        previous_rows = 0
+        with open(previous_path, "w") as previous_file:
+            rows = sort_concordance_by_ocn(
+                input_path, memory_mb=memory_mb, chunksize=chunksize, tmp_dir=work_dir
+            )
+            for block in iter_blocks(rows):
+                arrays["ocns.npy"].write(block[:, 0])
+                arrays["primaries.npy"].write(block[:, 1])
+                previous = block[block[:, 0] != block[:, 1]]
+                np.savetxt(previous_file, previous, fmt="%d", delimiter="\t")
+                previous_rows += len(previous)
+
+        cluster_ocns = arrays["cluster_ocns.npy"]
+        if previous_rows:
+            rows = sort_concordance_by_primary(
+                previous_path,
+                memory_mb=memory_mb,
+                chunksize=chunksize,
+                tmp_dir=work_dir,
+            )
+            last_primary = None
+            for block in iter_blocks(rows):
+                keys = block[:, 0]
+                starts = np.ones(len(keys), dtype=bool)
+                starts[1:] = keys[1:] != keys[:-1]
+                starts[0] = keys[0] != last_primary
+                arrays["cluster_primaries.npy"].write(keys[starts])
+                arrays["cluster_offsets.npy"].write(
+                    np.flatnonzero(starts) + cluster_ocns.rows
+                )
+                cluster_ocns.write(block[:, 1])
+                last_primary = keys[-1]
+        arrays["cluster_offsets.npy"].write([cluster_ocns.rows])
+        for array in arrays.values():
+            array.close()
+
+
+if __name__ == "__main__":
+    create_concordance_arrays()
@@ -0,0 +1,50 @@
+import datetime
+import os
+
+import click
+
+from concordance_sort import sort_concordance_by_primary
+
+
+@click.command()
+@click.argument("input_path", nargs=1, type=click.Path(exists=True))
+@click.argument("output_path", type=click.Path(exists=True, file_okay=False))
+@click.option("--memory", default=1024, help="Memory budget for sorting in MB")
+@click.option("--tmp-dir", default=None, help="Directory for temporary sort files")
+@click.pass_context
+def create_concordance_files(
+    ctx, input_path, output_path=".", memory=1024, tmp_dir=None
+):
+    """Create the primary only list and the cluster datafile in one pass
+    for use in building resolution tables for concordance lookup
+
+    INPUT_PATH is the path of a concordance tsv file
+
+    OUTPUT_PATH is the directory for the generated tsv files
+    """
+
+    if os.path.isdir(input_path):
+        raise Exception("A valid path to the concordance file is required")
+
+    today = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    primary_only_file_path = os.path.join(
+        output_path, "{}.primary_only_list.tsv".format(today)
+    )
+    cluster_file_path = os.path.join(
+        output_path, "{}.primary-to-multi-cluster.tsv".format(today)
+    )
+
+    with open(primary_only_file_path, "w") as primary_only_file, open(
+        cluster_file_path, "w"
+    ) as cluster_file:
+        for primary, oclc in sort_concordance_by_primary(
+            input_path, memory_mb=memory, tmp_dir=tmp_dir
+        ):
+            if primary == oclc:
+                primary_only_file.write("{}\t{}\n".format(oclc, primary))
+            cluster_file.write("{}\t{}\n".format(primary, oclc))
+    return primary_only_file_path, cluster_file_path
+
+
+if __name__ == "__main__":
+    create_concordance_files()
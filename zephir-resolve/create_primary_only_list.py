@@ -2,14 +2,19 @@ import datetime
 import os
 
 import click
-import pandas as pd
+
+from concordance_sort import sort_concordance_by_primary
 
 
 @click.command()
 @click.argument("input_path", nargs=1, type=click.Path(exists=True))
 @click.argument("output_path", type=click.Path())
+@click.option("--memory", default=1024, help="Memory budget for sorting in MB")
+@click.option("--tmp-dir", default=None, help="Directory for temporary sort files")
 @click.pass_context
-def create_primary_only_list(ctx, input_path, output_path="."):
+def create_primary_only_list(
+    ctx, input_path, output_path=".", memory=1024, tmp_dir=None
+):
     """Create a cluster datafile for use in building a
     resolution table for concordance lookup
 
@@ -29,18 +34,12 @@ def create_primary_only_list(ctx, input_path, output_path="."):
     else:
         primary_only_file_path = output_path
 
-    # load the raw concordance from OCLC
-    raw_concord_df = pd.read_csv(raw_concord_path, sep="\t", names=["oclc", "primary"])
-
-    # create dataframe of only the master oclc numbers
-    primary_only_df = raw_concord_df[
-        raw_concord_df["oclc"] == raw_concord_df["primary"]
-    ].copy()
-
-    # sort and export
-    primary_only_df[["oclc", "primary"]].sort_values("oclc").to_csv(
-        primary_only_file_path, index=False, header=False, sep="\t"
-    )
+    # stream only the master oclc numbers of the raw concordance from OCLC, sorted
+    with open(primary_only_file_path, "w") as outfile:
+        for primary, oclc in sort_concordance_by_primary(
+            raw_concord_path, memory_mb=memory, tmp_dir=tmp_dir, primary_only=True
+        ):
+            outfile.write("{}\t{}\n".format(oclc, primary))
     return primary_only_file_path
 
 
@@ -6,13 +6,18 @@ import click
 import plyvel
 
 from resolution_table import ResolutionTable
+from resolution_table import BUILD_WRITE_BUFFER_SIZE
+from resolution_table import echo_progress
 
 
 @click.command()
 @click.argument("input_path", nargs=1, type=click.Path(exists=True))
 @click.argument("output_path", type=click.Path())
+@click.option(
+    "--batch-size", default=100000, help="Rows written per LevelDB write batch"
+)
 @click.pass_context
-def create_primary_table(ctx, input_path, output_path="."):
+def create_primary_table(ctx, input_path, output_path=".", batch_size=100000):
     """Create a LevelDB primary resolution table for concordance lookup
 
     INPUT_PATH is the path of a generated primary tsv file
@@ -30,9 +35,18 @@ def create_primary_table(ctx, input_path, output_path="."):
     else:
         primary_db_path = output_path
 
-    rt = ResolutionTable(os.path.join(primary_db_path), key=int, value=int)
+    rt = ResolutionTable(
+        os.path.join(primary_db_path),
+        key=int,
+        value=int,
+        write_buffer_size=BUILD_WRITE_BUFFER_SIZE,
+    )
     with open(primary_file_path) as f:
-        rt.bulk_load(force_types(csv.reader(f, delimiter="\t")))
+        rt.bulk_build(
+            force_types(csv.reader(f, delimiter="\t")),
+            batch_size=batch_size,
+            progress=echo_progress,
+        )
     rt.close()
     return rt.path
 
@@ -1,14 +1,19 @@
 import os
+import time
 
+import click
 import csv
 import msgpack
 import plyvel
 
+# LevelDB write buffer used while building a table
+BUILD_WRITE_BUFFER_SIZE = 64 * 1024 * 1024
+
 
 class ResolutionTable:
-    def __init__(self, path=".", key=None, value=None):
+    def __init__(self, path=".", key=None, value=None, **db_options):
         self.path = os.path.join(path)
-        self._db = plyvel.DB(self.path, create_if_missing=True)
+        self._db = plyvel.DB(self.path, create_if_missing=True, **db_options)
 
         self._packer = msgpack.Packer()
 
@@ -40,10 +45,52 @@ class ResolutionTable:
     def get(self, key):
         return self.value_from_bytes(self._db.get(self.key_to_bytes(key)))
 
+    def delete(self, key):
+        return self._db.delete(self.key_to_bytes(key))
+
+    def write_batch(self, sync=False):
+        """A LevelDB write batch of the table, for writing stored (byte) keys."""
+        return self._db.write_batch(sync=sync)
+
+    def compact(self):
+        """Compact the whole key range of the table."""
+        self._db.compact_range()
+
     def bulk_load(self, iter_obj=[]):
         for item in iter_obj:
             self.put(item[0], item[1])
 
+    def bulk_build(self, iter_obj=[], batch_size=100000, compact=True, progress=None):
+        """Load items with LevelDB write batches, for building a table from scratch.
+
+        Items are buffered and written batch_size at a time in one write batch,
+        sorted by their stored (byte) key and without syncing to disk. When the
+        same key appears more than once, the last item wins, as with bulk_load.
+        The whole key range is compacted after the last batch.
+
+        Args:
+            iter_obj: iterable of [key, value] items
+            batch_size: number of items written per write batch
+            compact: run a manual compaction after loading
+            progress: optional callable(count, elapsed_seconds) called after each batch
+
+        Returns:
+            Number of items loaded.
+        """
+        writer = self.bulk_writer(batch_size, progress)
+        for item in iter_obj:
+            writer.put(item[0], item[1])
+        writer.close(compact)
+        return writer.count
+
+    def bulk_writer(self, batch_size=100000, progress=None, sync=False):
+        """Return a BulkWriter for loading items one at a time, see bulk_build.
+
+        Use sync=True when updating a table in place, so each batch is on disk
+        before the next one is written.
+        """
+        return BulkWriter(self, batch_size, progress, sync)
+
     def convert_dtypes_from_csv(self, csvreader):
         for row in csvreader:
             yield [self.key(row[0]), self.value(row[1])]
@@ -55,3 +102,57 @@ class ResolutionTable:
     @staticmethod
     def int_from_bytes(bnum):
         return int.from_bytes(bnum, "big")
+
+
+class BulkWriter:
+    """Buffered loader of a ResolutionTable, see ResolutionTable.bulk_build."""
+
+    def __init__(self, table, batch_size=100000, progress=None, sync=False):
+        self.table = table
+        self.batch_size = batch_size
+        self.progress = progress
+        self.sync = sync
+        self.count = 0
+        self._batch = {}
+        self._start = time.time()
+
+    def put(self, key, value):
+        self._batch[self.table.key_to_bytes(key)] = self.table.value_to_bytes(value)
+        self.count += 1
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def delete(self, key):
+        self._batch[self.table.key_to_bytes(key)] = None
+        self.count += 1
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered items in one atomic write batch."""
+        if not self._batch:
+            return
+        with self.table.write_batch(sync=self.sync) as wb:
+            for key in sorted(self._batch):
+                value = self._batch[key]
+                if value is None:
+                    wb.delete(key)
+                else:
+                    wb.put(key, value)
+        self._batch = {}
+        if self.progress:
+            self.progress(self.count, time.time() - self._start)
+
+    def close(self, compact=True):
+        self.flush()
+        if compact:
+            self.table.compact()
+
+
+def format_progress(count, elapsed):
+    rate = count / elapsed if elapsed > 0 else 0
+    return "Loaded {:,} rows in {:.1f}s ({:,.0f} rows/s)".format(count, elapsed, rate)
+
+
+def echo_progress(count, elapsed):
+    click.echo(format_progress(count, elapsed), err=True)
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+from resolution_table import ResolutionTable
+from build_resolution import build_resolution
+
+
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_build_resolution(tmpdatadir, capsys, workers):
+    with pytest.raises(SystemExit) as pytest_e:
+        sys.argv = [
+            "",
+            os.path.join(tmpdatadir, "concordance.tsv"),
+            tmpdatadir,
+            "--workers",
+            workers,
+        ]
+        build_resolution()
+
+    assert [pytest_e.type, pytest_e.value.code] == [SystemExit, 0]
+
+    rt = ResolutionTable(os.path.join(tmpdatadir, "primary-table"), key=int, value=int)
+    assert {ocn: rt.get(ocn) for ocn in range(1, 9)} == {
+        1: 1,
+        2: 1,
+        3: 1,
+        4: 1,
+        5: 5,
+        6: 5,
+        7: 5,
+        8: 8,
+    }
+    rt.close()
+
+    rt = ResolutionTable(os.path.join(tmpdatadir, "cluster"), key=int, value=list)
+    assert rt.get(1) == [2, 3, 4]
+    assert rt.get(5) == [6, 7]
+    rt.close()
@@ -0,0 +1,115 @@
+import os
+
+from concordance_sort import chunksize_for_memory
+from concordance_sort import merge_block_rows
+from concordance_sort import merge_fan_in
+from concordance_sort import sort_concordance_by_ocn
+from concordance_sort import sort_concordance_by_primary
+from concordance_sort import split_file
+
+
+def test_sort_concordance_by_primary(tmpdatadir):
+    input_path = os.path.join(tmpdatadir, "concordance.tsv")
+    expected = [
+        (1, 1),
+        (1, 2),
+        (1, 3),
+        (1, 4),
+        (5, 5),
+        (5, 6),
+        (5, 7),
+        (8, 8),
+        (256, 256),
+        (256, 300),
+    ]
+    # one run, and several runs merged
+    for chunksize in [100, 3, 1]:
+        rows = list(sort_concordance_by_primary(input_path, chunksize=chunksize))
+        assert rows == expected
+
+
+def test_sort_concordance_with_workers(tmpdatadir):
+    input_path = os.path.join(tmpdatadir, "concordance.tsv")
+    expected = list(sort_concordance_by_primary(input_path, chunksize=100))
+    for workers in [2, 3, 20]:
+        rows = list(
+            sort_concordance_by_primary(input_path, chunksize=4, workers=workers)
+        )
+        assert rows == expected
+
+
+def test_sort_concordance_by_ocn(tmpdatadir, tmpdir):
+    input_path = os.path.join(tmpdatadir, "concordance.tsv")
+    expected = sorted(
+        (oclc, primary)
+        for primary, oclc in sort_concordance_by_primary(input_path, chunksize=100)
+    )
+    for chunksize in [100, 3, 1]:
+        rows = list(sort_concordance_by_ocn(input_path, chunksize=chunksize))
+        assert rows == expected
+
+    # the last row of a duplicate oclc wins
+    input_path = os.path.join(tmpdir, "duplicates.tsv")
+    with open(input_path, "w") as f:
+        f.write("7\t1\n3\t3\n7\t2\n7\t5\n3\t4\n")
+    for chunksize in [100, 2, 1]:
+        rows = list(sort_concordance_by_ocn(input_path, chunksize=chunksize))
+        assert rows == [(3, 4), (7, 5)]
+    rows = list(sort_concordance_by_ocn(input_path, memory_mb=0.3, chunksize=1))
+    assert rows == [(3, 4), (7, 5)]
+
+
+def test_split_file(tmpdatadir):
+    input_path = os.path.join(tmpdatadir, "concordance.tsv")
+    with open(input_path, "rb") as f:
+        data = f.read()
+    for parts in [1, 2, 3, 100]:
+        ranges = split_file(input_path, parts)
+        assert len(ranges) <= parts
+        assert b"".join(data[start:end] for start, end in ranges) == data
+        for start, end in ranges:
+            assert start == 0 or data.startswith(b"\n", start - 1)
+
+
+def test_sort_concordance_primary_only(tmpdatadir):
+    input_path = os.path.join(tmpdatadir, "concordance.tsv")
+    rows = list(sort_concordance_by_primary(input_path, chunksize=3, primary_only=True))
+    assert rows == [(1, 1), (5, 5), (8, 8), (256, 256)]
+
+
+def test_sort_concordance_multi_pass_merge(tmpdatadir, tmpdir):
+    input_path = os.path.join(tmpdatadir, "concordance.tsv")
+    expected = list(sort_concordance_by_primary(input_path, chunksize=100))
+    sort_dir = os.path.join(tmpdir, "sort")
+    os.mkdir(sort_dir)
+    # ten runs merged two at a time
+    assert merge_fan_in(0.3) == 2
+    rows = list(
+        sort_concordance_by_primary(
+            input_path, memory_mb=0.3, chunksize=1, tmp_dir=sort_dir
+        )
+    )
+    assert rows == expected
+    assert os.listdir(sort_dir) == []
+
+
+def test_sort_concordance_removes_runs(tmpdatadir, tmpdir):
+    input_path = os.path.join(tmpdatadir, "concordance.tsv")
+    sort_dir = os.path.join(tmpdir, "sort")
+    os.mkdir(sort_dir)
+    list(sort_concordance_by_primary(input_path, chunksize=2, tmp_dir=sort_dir))
+    assert os.listdir(sort_dir) == []
+
+
+def test_chunksize_for_memory():
+    assert chunksize_for_memory(1) == 16384
+    assert chunksize_for_memory(0) == 1
+
+
+def test_merge_block_rows():
+    assert merge_block_rows(8, 1) > merge_block_rows(8, 10) > merge_block_rows(8, 100)
+    assert merge_block_rows(8, 10) * 11 * 160 <= 8 * 1024 * 1024
+    assert merge_block_rows(0, 10) == 1
+    # runs merged in one pass still get buffers of at least 1024 rows
+    assert merge_block_rows(8, merge_fan_in(8)) >= 1024
+    assert merge_fan_in(0) == 2
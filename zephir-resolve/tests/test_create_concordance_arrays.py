@@ -0,0 +1,83 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import create_concordance_arrays as concordance_arrays
+from create_concordance_arrays import create_concordance_arrays
+from create_concordance_arrays import write_concordance_arrays
+
+
+def test_create_concordance_arrays(tmpdatadir, capsys):
+    output_path = os.path.join(tmpdatadir, "arrays")
+    with pytest.raises(SystemExit) as pytest_e:
+        sys.argv = [
+            "",
+            os.path.join(tmpdatadir, "input.tsv"),
+            output_path,
+            "--memory",
+            "16",
+            "--tmp-dir",
+            tmpdatadir,
+        ]
+        create_concordance_arrays()
+
+    assert [pytest_e.type, pytest_e.value.code] == [SystemExit, 0]
+
+    ocns = np.load(os.path.join(output_path, "ocns.npy"), mmap_mode="r")
+    primaries = np.load(os.path.join(output_path, "primaries.npy"), mmap_mode="r")
+    assert ocns.dtype == np.uint64
+    assert list(ocns) == [1, 2, 3, 4, 5, 6, 256]
+    assert list(primaries) == [1, 1, 1, 5, 5, 6, 256]
+
+    cluster_primaries = np.load(os.path.join(output_path, "cluster_primaries.npy"))
+    cluster_offsets = np.load(os.path.join(output_path, "cluster_offsets.npy"))
+    cluster_ocns = np.load(os.path.join(output_path, "cluster_ocns.npy"))
+    assert list(cluster_primaries) == [1, 5]
+    assert list(cluster_offsets) == [0, 2, 3]
+    assert list(cluster_ocns) == [2, 3, 4]
+
+
+def load_arrays(output_path):
+    return [
+        list(np.load(os.path.join(output_path, filename)))
+        for filename in concordance_arrays.ARRAY_FILES
+    ]
+
+
+def test_write_concordance_arrays_in_blocks(tmpdatadir, monkeypatch):
+    # clusters and sorted runs split across blocks
+    monkeypatch.setattr(concordance_arrays, "WRITE_BLOCK_ROWS", 2)
+    output_path = os.path.join(tmpdatadir, "arrays")
+    os.mkdir(output_path)
+    write_concordance_arrays(
+        os.path.join(tmpdatadir, "input.tsv"), output_path, chunksize=2
+    )
+    assert load_arrays(output_path) == [
+        [1, 2, 3, 4, 5, 6, 256],
+        [1, 1, 1, 5, 5, 6, 256],
+        [1, 5],
+        [0, 2, 3],
+        [2, 3, 4],
+    ]
+
+
+def test_write_concordance_arrays_last_row_wins(tmpdir):
+    input_path = os.path.join(tmpdir, "input.tsv")
+    with open(input_path, "w") as f:
+        f.write("7\t1\n3\t3\n7\t2\n")
+    # duplicates within one sorted run and across runs
+    for chunksize in [100, 1]:
+        output_path = os.path.join(tmpdir, "arrays{}".format(chunksize))
+        os.mkdir(output_path)
+        write_concordance_arrays(input_path, output_path, chunksize=chunksize)
+        assert load_arrays(output_path) == [[3, 7], [3, 2], [2], [0, 1], [7]]
+
+
+def test_write_concordance_arrays_without_clusters(tmpdir):
+    input_path = os.path.join(tmpdir, "input.tsv")
+    with open(input_path, "w") as f:
+        f.write("3\t3\n1\t1\n")
+    write_concordance_arrays(input_path, str(tmpdir))
+    assert load_arrays(str(tmpdir)) == [[1, 3], [1, 3], [], [0], []]
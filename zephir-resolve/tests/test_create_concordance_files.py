@@ -0,0 +1,30 @@
+import filecmp
+import glob
+import os
+import sys
+
+import pytest
+
+from create_concordance_files import create_concordance_files
+
+
+def test_create_concordance_files(tmpdatadir, capsys):
+    output_path = os.path.join(tmpdatadir, "output")
+    os.mkdir(output_path)
+    with pytest.raises(SystemExit) as pytest_e:
+        sys.argv = [
+            "",
+            os.path.join(tmpdatadir, "concordance.tsv"),
+            output_path,
+        ]
+        create_concordance_files()
+
+    assert [pytest_e.type, pytest_e.value.code] == [SystemExit, 0]
+    assert filecmp.cmp(
+        glob.glob(os.path.join(output_path, "*.primary_only_list.tsv"))[0],
+        os.path.join(tmpdatadir, "primary_only_output.tsv"),
+    )
+    assert filecmp.cmp(
+        glob.glob(os.path.join(output_path, "*.primary-to-multi-cluster.tsv"))[0],
+        os.path.join(tmpdatadir, "cluster_output.tsv"),
+    )
@@ -48,3 +48,21 @@ def test_bulk_load_items(tmpdir):
     result = db.get(ResolutionTable.int_to_bytes(2))
     assert msgpack.unpackb(result) == [1, 3]
     db.close()
+
+
+def test_bulk_build_items(tmpdir):
+    rt = ResolutionTable(os.path.join(tmpdir, "ints/"), key=int, value=int)
+    # keys sort differently as integers and as stored bytes; 2 is loaded twice
+    data = [[2, 1], [256, 256], [3, 1], [2, 5], [1, 1]]
+    reported = []
+    count = rt.bulk_build(
+        iter_obj=data,
+        batch_size=2,
+        progress=lambda count, elapsed: reported.append(count),
+    )
+    assert count == 5
+    assert reported == [2, 4, 5]
+    assert rt.get(2) == 5
+    assert rt.get(256) == 256
+    assert rt.get(3) == 1
+    rt.close()
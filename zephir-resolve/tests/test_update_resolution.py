@@ -0,0 +1,63 @@
+import filecmp
+import os
+import sys
+
+import pytest
+
+from build_resolution import build_resolution
+from resolution_table import ResolutionTable
+from update_resolution import diff_clusters
+from update_resolution import update_resolution
+
+
+def run_command(command, args):
+    with pytest.raises(SystemExit) as pytest_e:
+        sys.argv = [""] + args
+        command()
+    assert [pytest_e.type, pytest_e.value.code] == [SystemExit, 0]
+
+
+def test_diff_clusters():
+    previous_rows = [(1, 1), (1, 2), (1, 4), (5, 5), (5, 7), (8, 8)]
+    rows = [(1, 1), (1, 2), (3, 3), (5, 4), (5, 5), (8, 8)]
+    assert list(diff_clusters(previous_rows, rows)) == [
+        (1, [1, 2], [], [4]),
+        (3, [3], [3], []),
+        (5, [4, 5], [4], [7]),
+    ]
+
+
+def test_update_resolution(tmpdatadir, capsys):
+    tables_path = os.path.join(tmpdatadir, "tables")
+    os.mkdir(tables_path)
+    run_command(
+        build_resolution, [os.path.join(tmpdatadir, "previous.tsv"), tables_path]
+    )
+    report_path = os.path.join(tmpdatadir, "output_report.tsv")
+    run_command(
+        update_resolution,
+        [
+            os.path.join(tmpdatadir, "previous.tsv"),
+            os.path.join(tmpdatadir, "concordance.tsv"),
+            tables_path,
+            "--report",
+            report_path,
+        ],
+    )
+    assert filecmp.cmp(report_path, os.path.join(tmpdatadir, "report.tsv"))
+    assert "Changed 4 primaries: 4 OCNs gained, 2 OCNs lost, 1 OCNs deleted" in (
+        capsys.readouterr().err
+    )
+
+    # the updated tables match tables built from scratch
+    rebuilt_path = os.path.join(tmpdatadir, "rebuilt")
+    os.mkdir(rebuilt_path)
+    run_command(
+        build_resolution, [os.path.join(tmpdatadir, "concordance.tsv"), rebuilt_path]
+    )
+    for table in ["primary-table", "cluster"]:
+        updated = ResolutionTable(os.path.join(tables_path, table))
+        rebuilt = ResolutionTable(os.path.join(rebuilt_path, table))
+        assert list(updated._db.iterator()) == list(rebuilt._db.iterator())
+        updated.close()
+        rebuilt.close()
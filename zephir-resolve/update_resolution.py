@@ -0,0 +1,177 @@
+import itertools
+import os
+
+import click
+
+from concordance_sort import sort_concordance_by_primary
+from resolution_table import ResolutionTable
+
+
+@click.command()
+@click.argument("previous_path", nargs=1, type=click.Path(exists=True))
+@click.argument("input_path", nargs=1, type=click.Path(exists=True))
+@click.argument("output_path", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--report", default=None, help="Path for a tsv report of changed primaries"
+)
+@click.option("--memory", default=1024, help="Memory budget for sorting in MB")
+@click.option("--tmp-dir", default=None, help="Directory for temporary sort files")
+@click.option(
+    "--batch-size", default=100000, help="Rows written per LevelDB write batch"
+)
+@click.pass_context
+def update_resolution(
+    ctx,
+    previous_path,
+    input_path,
+    output_path=".",
+    report=None,
+    memory=1024,
+    tmp_dir=None,
+    batch_size=100000,
+):
+    """Update the primary and cluster resolution tables with a concordance delta
+
+    The previous and the new concordance are sorted by primary OCN and compared
+    cluster by cluster as they stream by. Only the changed keys are written to
+    the existing tables, in atomic write batches.
+
+    PREVIOUS_PATH is the path of the concordance tsv the tables were built from
+
+    INPUT_PATH is the path of the new concordance tsv file
+
+    OUTPUT_PATH is the directory of the primary-table and cluster LevelDB tables
+    """
+
+    for path in [previous_path, input_path]:
+        if os.path.isdir(path):
+            raise Exception("A valid path to the concordance file is required")
+
+    primary_rt = ResolutionTable(
+        os.path.join(output_path, "primary-table"), key=int, value=int
+    )
+    cluster_rt = ResolutionTable(
+        os.path.join(output_path, "cluster"), key=int, value=list
+    )
+
+    previous_rows = sort_concordance_by_primary(
+        previous_path, memory_mb=memory / 2, tmp_dir=tmp_dir
+    )
+    rows = sort_concordance_by_primary(
+        input_path, memory_mb=memory / 2, tmp_dir=tmp_dir
+    )
+    changes = diff_clusters(previous_rows, rows)
+    if report:
+        with open(report, "w") as report_file:
+            report_file.write("primary\tgained\tlost\n")
+            stats = apply_changes(
+                write_report(changes, report_file), primary_rt, cluster_rt, batch_size
+            )
+    else:
+        stats = apply_changes(changes, primary_rt, cluster_rt, batch_size)
+    primary_rt.close()
+    cluster_rt.close()
+
+    click.echo(
+        "Changed {primaries:,} primaries: {gained:,} OCNs gained, "
+        "{lost:,} OCNs lost, {deleted:,} OCNs deleted".format(**stats),
+        err=True,
+    )
+    return stats
+
+
+def group_by_primary(rows):
+    """Group sorted (primary, oclc) rows into (primary, set of OCNs) clusters"""
+    for primary, group in itertools.groupby(rows, key=lambda row: row[0]):
+        yield primary, {oclc for _, oclc in group}
+
+
+def diff_clusters(previous_rows, rows):
+    """Compare two concordances sorted by (primary, oclc) cluster by cluster
+
+    Yields:
+        (primary, ocns, gained, lost) for each primary whose cluster changed,
+        with the new cluster OCNs and the gained and lost OCNs as sorted lists. Clusters that appear or
+        disappear entirely are reported with all of their OCNs gained or lost.
+    """
+    previous = group_by_primary(previous_rows)
+    current = group_by_primary(rows)
+    previous_cluster = next(previous, None)
+    cluster = next(current, None)
+    while previous_cluster or cluster:
+        if cluster is None or (previous_cluster and previous_cluster[0] < cluster[0]):
+            primary, previous_ocns = previous_cluster
+            ocns = set()
+            previous_cluster = next(previous, None)
+        elif previous_cluster is None or cluster[0] < previous_cluster[0]:
+            primary, ocns = cluster
+            previous_ocns = set()
+            cluster = next(current, None)
+        else:
+            primary, previous_ocns = previous_cluster
+            ocns = cluster[1]
+            previous_cluster = next(previous, None)
+            cluster = next(current, None)
+        if ocns != previous_ocns:
+            yield (
+                primary,
+                sorted(ocns),
+                sorted(ocns - previous_ocns),
+                sorted(previous_ocns - ocns),
+            )
+
+
+def apply_changes(changes, primary_rt, cluster_rt, batch_size=100000):
+    """Apply cluster changes to the primary and cluster resolution tables
+
+    Gained OCNs are pointed at their new primary. Lost OCNs are deleted from
+    the primary table after all changes are written, unless they were gained
+    by another cluster. Each changed cluster entry is rewritten with its new
+    list of previous OCNs, or deleted when none are left.
+
+    Returns:
+        A dict with the number of changed primaries, gained, lost and deleted OCNs.
+    """
+    primary_writer = primary_rt.bulk_writer(batch_size, sync=True)
+    cluster_writer = cluster_rt.bulk_writer(batch_size, sync=True)
+    stats = {"primaries": 0, "gained": 0, "lost": 0, "deleted": 0}
+    gained_ocns = set()
+    lost_ocns = set()
+    for primary, ocns, gained, lost in changes:
+        stats["primaries"] += 1
+        stats["gained"] += len(gained)
+        stats["lost"] += len(lost)
+        for ocn in gained:
+            primary_writer.put(ocn, primary)
+        gained_ocns.update(gained)
+        lost_ocns.update(lost)
+
+        cluster = [ocn for ocn in ocns if ocn != primary]
+        if cluster:
+            cluster_writer.put(primary, cluster)
+        else:
+            cluster_writer.delete(primary)
+
+    for ocn in sorted(lost_ocns - gained_ocns):
+        primary_writer.delete(ocn)
+        stats["deleted"] += 1
+    primary_writer.close(compact=False)
+    cluster_writer.close(compact=False)
+    return stats
+
+
+def write_report(changes, report_file):
+    """Write each change to a tsv report as it passes through"""
+    for primary, ocns, gained, lost in changes:
+        report_file.write(
+            "{}\t{}\t{}\n".format(
+                primary,
+                " ".join(str(ocn) for ocn in gained),
+                " ".join(str(ocn) for ocn in lost),
+            )
+        )
+        yield primary, ocns, gained, lost
+
+
+if __name__ == "__main__":
+    update_resolution()